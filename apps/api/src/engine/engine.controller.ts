@@ -10,7 +10,7 @@ export class EngineController {
   @Post('run')
   @ApiOperation({ summary: 'Enqueue engine run' })
   async enqueueRun(
-    @Body() body: { userId: string; type: 'scoring' | 'pac' | 'full' },
+    @Body() body: { userId: string; type: 'scoring' | 'pac' | 'full' | 'pac_batch' | 'pac_drift' | 'snapshot' | 'snapshot_backfill' },
   ) {
     return this.engineService.enqueueRun(body.userId, body.type);
   }
@@ -11,14 +11,18 @@ export class EngineService {
     @InjectQueue('aurora-jobs') private readonly jobQueue: Queue,
   ) {}
 
-  async enqueueRun(userId: string, runType: 'scoring' | 'pac' | 'full') {
+  async enqueueRun(userId: string, runType: 'scoring' | 'pac' | 'full' | 'pac_batch' | 'pac_drift' | 'snapshot' | 'snapshot_backfill') {
     const runId = `run_${Date.now()}_${Math.random().toString(36).substring(7)}`;
 
     // Map frontend type to database status
     const statusMap: Record<string, string> = {
       'scoring': 'ETF_SCORING',
       'pac': 'MONTHLY_PAC',
-      'full': 'FULL_ANALYSIS'
+      'full': 'FULL_ANALYSIS',
+      'pac_batch': 'MONTHLY_PAC_BATCH',
+      'pac_drift': 'MONTHLY_PAC_DRIFT',
+      'snapshot': 'POSITION_SNAPSHOT',
+      'snapshot_backfill': 'POSITION_SNAPSHOT_BACKFILL'
     };
 
     const run = await prisma.engineRun.create({
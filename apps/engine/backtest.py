@@ -0,0 +1,264 @@
+"""
+Historical backtest of the scoring + PAC strategy.
+
+At every monthly rebalance date each instrument is re-scored on the lookback
+window ending that day (walk-forward: only data up to the rebalance close is
+used), the top pac_max_instruments are allocated with the run_pac rule and the
+monthly contribution is invested at that close, net of fees. With
+rebalance=True the whole portfolio is also traded back to the target weights.
+
+Scoring the rebalance dates is the expensive part and runs in a process pool
+over a memory-mapped copy of the price matrix; the simulation is a handful of
+matrix products between rebalance dates.
+
+Usage:
+    python backtest.py                     # price_history via the price store
+    python backtest.py --synthetic 20 500  # synthetic 20-year x 500-ETF universe
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from config import settings
+from scoring_engine import TRADING_DAYS, batch_metrics, metric_points
+from pac_engine import DEFAULT_CONTRIBUTION, allocation_weights
+from return_cache import ffill
+
+MIN_ROWS = 200
+
+# Set in pool workers by _init_worker
+_closes = None
+
+class BacktestResult:
+    def __init__(self, dates: np.ndarray, values: np.ndarray, returns: np.ndarray,
+                 weights: np.ndarray, rebalance_idx: np.ndarray, invested: float, fees: float, traded: float):
+        self.dates = dates
+        self.values = values
+        self.returns = returns
+        self.weights = weights
+        self.rebalance_idx = rebalance_idx
+        self.invested = invested
+        self.fees = fees
+        self.traded = traded
+
+    def summary(self) -> dict:
+        """CAGR, volatility and drawdown of the time-weighted return, plus turnover and costs"""
+        if len(self.returns) < 2:
+            return {}
+        index = np.cumprod(1 + self.returns)
+        years = (self.dates[-1] - self.dates[0]) / np.timedelta64(1, 'D') / 365.25
+        drawdown = 1 - index / np.maximum.accumulate(index)
+        return {
+            'cagr': round((index[-1] ** (1 / years) - 1) * 100, 2) if years > 0 else None,
+            'volatility': round(self.returns.std(ddof=1) * np.sqrt(TRADING_DAYS) * 100, 2),
+            'max_drawdown': round(drawdown.max() * 100, 2),
+            'turnover': round(self.traded / self.values.mean() / years * 100, 2) if years > 0 else None,
+            'final_value': round(float(self.values[-1]), 2),
+            'invested': round(self.invested, 2),
+            'fees': round(self.fees, 2),
+            'rebalances': len(self.rebalance_idx),
+        }
+
+def monthly_rebalance_dates(dates: np.ndarray, start_idx: int = 0) -> np.ndarray:
+    """Index of the first trading day of every month, from start_idx on"""
+    months = dates.astype('datetime64[M]')
+    first = np.flatnonzero(np.concatenate([[True], months[1:] != months[:-1]]))
+    return first[first >= start_idx]
+
+def rebalance_metrics(closes: np.ndarray, dates: np.ndarray, rebalance_idx: np.ndarray,
+                      lookback_days: int = None, processes: int = None) -> np.ndarray:
+    """
+    Scoring metrics for every instrument at every rebalance date, on the
+    lookback window ending that day. Returns a (4, rebalances, instruments)
+    array of returns_1y, volatility, sharpe_ratio, max_drawdown; NaN where an
+    instrument has fewer than MIN_ROWS bars in its window (scaled to the
+    lookback, since MIN_ROWS is meant for a one-year window).
+    """
+    lookback_days = lookback_days or settings.scoring_lookback_days
+    min_rows = int(MIN_ROWS * min(lookback_days, 365) / 365)
+    starts = np.searchsorted(dates, dates[rebalance_idx] - np.timedelta64(lookback_days, 'D'))
+    tasks = [(int(s), int(e) + 1, min_rows) for s, e in zip(starts, rebalance_idx)]
+
+    processes = processes if processes is not None else (settings.backtest_processes or os.cpu_count())
+    if processes <= 1 or len(tasks) < 2 * processes:
+        return np.stack([_window_metrics(closes, task) for task in tasks], axis=1)
+
+    # Workers map the matrix from a temporary .npy instead of receiving a copy
+    tmp = tempfile.mkdtemp(prefix="aurora-backtest-")
+    try:
+        path = os.path.join(tmp, "closes.npy")
+        np.save(path, np.ascontiguousarray(closes))
+        chunks = np.array_split(np.arange(len(tasks)), processes * 4)
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(path,)) as pool:
+            parts = pool.map(_metrics_chunk, [[tasks[i] for i in chunk] for chunk in chunks if len(chunk)])
+            return np.concatenate(list(parts), axis=1)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def target_weights(metrics: np.ndarray, max_instruments: int = None, min_allocation_pct: float = None,
+                   thresholds: dict = None) -> np.ndarray:
+    """
+    (rebalances x instruments) target weights from rebalance_metrics with the
+    run_pac rule: top max_instruments by total score, allocated by score.
+    thresholds overrides the scoring ladders (see metric_points).
+    """
+    max_instruments = max_instruments or settings.pac_max_instruments
+    totals = sum(metric_points(*metrics, thresholds=thresholds)).astype(np.float64)
+    totals[np.isnan(metrics[0])] = -np.inf
+
+    weights = np.zeros(totals.shape)
+    top = np.argsort(-totals, axis=1, kind='stable')[:, :max_instruments]
+    for k, idx in enumerate(top):
+        idx = idx[np.isfinite(totals[k, idx])]
+        if len(idx):
+            weights[k, idx] = allocation_weights(totals[k, idx], min_allocation_pct) / 100
+    return weights
+
+def simulate(closes: np.ndarray, dates: np.ndarray, rebalance_idx: np.ndarray, weights: np.ndarray,
+             contribution: float = DEFAULT_CONTRIBUTION, fee_pct: float = None, fee_fixed: float = None,
+             rebalance: bool = False) -> BacktestResult:
+    """
+    Invest the monthly contribution at every rebalance close according to
+    weights (and, with rebalance=True, trade the portfolio back to them).
+    Daily returns are time-weighted: contributions are flows, fees are losses.
+    """
+    fee_pct = settings.backtest_fee_pct if fee_pct is None else fee_pct
+    fee_fixed = settings.backtest_fee_fixed if fee_fixed is None else fee_fixed
+
+    # Only rebalance dates with something to buy
+    active = weights.sum(axis=1) > 0
+    rebalance_idx, weights = rebalance_idx[active], weights[active]
+    if not len(rebalance_idx):
+        empty = np.empty(0)
+        return BacktestResult(dates[:0], empty, empty, weights, rebalance_idx, 0.0, 0.0, 0.0)
+
+    prices = ffill(closes)
+    first = rebalance_idx[0]
+    n_days = len(dates) - first
+    values = np.zeros(n_days)
+    flows = np.zeros(n_days)
+    units = np.zeros(closes.shape[1])
+    invested = fees = traded = 0.0
+
+    bounds = list(rebalance_idx) + [len(dates)]
+    for k, (t, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        price = prices[t]
+        held = np.nan_to_num(price * units)
+        current = held.sum()
+        tradable = ~np.isnan(price) & (price > 0)
+        w = np.where(tradable, weights[k], 0)
+        if w.sum() > 0:
+            w = w / w.sum()
+            if rebalance:
+                trades = (current + contribution) * w - held
+            else:
+                trades = contribution * w
+            orders = np.abs(trades) > 0.005
+            cost = np.abs(trades[orders]).sum() * fee_pct / 100 + fee_fixed * orders.sum()
+            # Buys are scaled down so that the contribution plus sale proceeds pays for them and the fees
+            sells = -trades[trades < 0].sum()
+            buys = trades[trades > 0].sum()
+            scale = max(contribution + sells - cost, 0) / buys if buys > 0 else 0.0
+            executed = np.where(trades > 0, trades * scale, trades)
+            units = units + np.where(tradable, executed / np.where(tradable, price, 1), 0)
+            fees += cost
+            traded += np.abs(trades).sum()
+            invested += contribution
+            flows[t - first] = contribution
+
+        segment = np.nan_to_num(prices[t:end]) @ units
+        values[t - first:end - first] = segment
+
+    previous = np.concatenate([[0.0], values[:-1]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.where(previous > 0, (values - flows) / previous - 1, 0.0)
+    return BacktestResult(dates[first:], values, returns[1:] if len(returns) > 1 else returns,
+                          weights, rebalance_idx, invested, fees, traded)
+
+def run_backtest(closes: np.ndarray, dates: np.ndarray, lookback_days: int = None,
+                 max_instruments: int = None, min_allocation_pct: float = None,
+                 contribution: float = DEFAULT_CONTRIBUTION, rebalance: bool = False,
+                 processes: int = None) -> BacktestResult:
+    """Backtest the strategy on a (dates x instruments) close matrix"""
+    lookback_days = lookback_days or settings.scoring_lookback_days
+    start_idx = int(np.searchsorted(dates, dates[0] + np.timedelta64(lookback_days, 'D')))
+    rebalance_idx = monthly_rebalance_dates(dates, start_idx)
+    metrics = rebalance_metrics(closes, dates, rebalance_idx, lookback_days, processes)
+    weights = target_weights(metrics, max_instruments, min_allocation_pct)
+    return simulate(closes, dates, rebalance_idx, weights, contribution, rebalance=rebalance)
+
+def load_closes(db, years: int) -> tuple:
+    """(dates, instrument_ids, dates x instruments closes) of every ETF from the price store"""
+    from sqlalchemy import text
+    from price_store import load_window
+
+    instrument_ids = [row[0] for row in db.execute(text("SELECT id FROM instrument WHERE type = 'ETF'")).fetchall()]
+    end = datetime.now()
+    window = load_window(db, instrument_ids, end - timedelta(days=int(years * 365.25)), end)
+    dates, closes = window.close_matrix(instrument_ids)
+    return dates.to_numpy(), instrument_ids, closes
+
+def synthetic_closes(years: int, instruments: int, seed: int = 0) -> tuple:
+    """Factor-model price paths with staggered listings, for benchmarks"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=datetime.now().date(), periods=int(years * TRADING_DAYS)).to_numpy()
+    loadings = rng.normal(1, 0.5, (instruments, 3))
+    factors = rng.normal(0.0002, 0.007, (len(dates), 3))
+    drift = rng.normal(0.0002, 0.0003, instruments)
+    returns = factors @ loadings.T + drift + rng.normal(0, 0.008, (len(dates), instruments))
+    closes = 100 * np.cumprod(1 + returns, axis=0)
+    listed = rng.integers(0, len(dates) // 2, instruments)
+    closes[np.arange(len(dates))[:, None] < listed] = np.nan
+    closes[rng.random(closes.shape) < 0.01] = np.nan
+    return dates, closes
+
+def _window_metrics(closes: np.ndarray, task: tuple) -> np.ndarray:
+    start, end, min_rows = task
+    window = closes[start:end]
+    metrics = np.array(batch_metrics(window))
+    metrics[:, (~np.isnan(window)).sum(axis=0) < min_rows] = np.nan
+    return metrics
+
+def _init_worker(path: str):
+    global _closes
+    _closes = np.load(path, mmap_mode='r')
+
+def _metrics_chunk(tasks: list) -> np.ndarray:
+    return np.stack([_window_metrics(_closes, task) for task in tasks], axis=1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest the scoring + PAC strategy")
+    parser.add_argument("--synthetic", nargs=2, type=int, metavar=("YEARS", "INSTRUMENTS"))
+    parser.add_argument("--years", type=int, default=20)
+    parser.add_argument("--contribution", type=float, default=DEFAULT_CONTRIBUTION)
+    parser.add_argument("--rebalance", action="store_true")
+    parser.add_argument("--processes", type=int)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.synthetic:
+        dates, closes = synthetic_closes(*args.synthetic)
+    else:
+        from database import SessionLocal
+        db = SessionLocal()
+        try:
+            dates, _, closes = load_closes(db, args.years)
+        finally:
+            db.close()
+    print(f"📈 Backtesting {closes.shape[1]} instruments x {closes.shape[0]} days")
+
+    result = run_backtest(closes, dates, contribution=args.contribution,
+                          rebalance=args.rebalance, processes=args.processes)
+    for name, value in result.summary().items():
+        print(f"  {name}: {value}")
+    print(f"✅ Backtest completed in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
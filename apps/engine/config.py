@@ -7,14 +7,100 @@ class Settings(BaseSettings):
     redis_port: int = 6379
     redis_db: int = 0
 
+    # Connection pools (per process)
+    db_pool_size: int = 5
+    db_max_overflow: int = 5
+    db_pool_timeout: float = 30.0
+    db_pool_pre_ping: bool = True
+    db_pool_recycle_seconds: int = 1800
+    db_statement_timeout_ms: int = 0  # 0 = server default
+    db_pgbouncer: bool = False  # no client-side pool, no startup options
+    redis_max_connections: int = 20
+    redis_health_check_interval: int = 30
+
+    # Worker settings
+    worker_embedded: bool = True  # Start workers from the FastAPI lifespan
+    worker_processes: int = 1  # 0 = single worker thread inside the API process
+    worker_restart_delay: float = 1.0
+    worker_shutdown_timeout: float = 300.0
+    job_lease_seconds: float = 30.0
+    job_stalled_check_interval: float = 30.0
+    job_max_stalled_count: int = 2
+
     # Engine settings
     scoring_lookback_days: int = 365
     scoring_min_volume: int = 100000
     scoring_min_age_days: int = 730
+    scoring_batch_mode: bool = True
+    scoring_verify_batch: bool = False
+    scoring_incremental: bool = False
+    scoring_verify_incremental: bool = False
+    scoring_write_chunk_size: int = 500  # rows per savepoint, one commit per run; 0 = one savepoint for all rows
+    scoring_cache_enabled: bool = True
+    scoring_cache_ttl_seconds: int = 6 * 3600
+    scoring_cache_max_entries: int = 20
+    scoring_cache_lock_seconds: float = 600.0
+    scoring_cache_poll_seconds: float = 0.5
+
+    # Red flags on scoring results (also scoring_min_volume, scoring_min_age_days)
+    red_flag_max_ter: float = 0.5  # %
+    red_flag_min_aum: float = 100_000_000  # EUR
+    red_flag_max_spread: float = 0.5  # %
+    red_flag_max_tracking_error: float = 1.0  # %
+    red_flag_max_gap_days: int = 10  # calendar days between consecutive bars
+    red_flag_max_daily_move: float = 25.0  # % close-to-close
+    red_flag_stale_days: int = 7  # calendar days since the last bar
+
+    # Startup: import the analytics stack in the background once ready
+    # (otherwise the first job imports it)
+    engine_prewarm: bool = False
+
+    # Market data fetcher settings
+    market_data_cache_dir: str = ".cache/market_data"
+    market_data_batch_size: int = 20
+    market_data_max_workers: int = 4
+    market_data_rate_per_sec: float = 2.0
+    market_data_max_retries: int = 3
+
+    # Local memory-mapped price store
+    price_store_enabled: bool = True
+    price_store_dir: str = ".cache/price_store"
+    price_store_history_days: int = 5 * 365
+    price_store_spare_days: int = 260  # date columns appended in place before a rewrite
+    price_store_rebuild_hours: int = 24
+    price_store_resync_days: int = 7  # trailing days re-read in place when late bars arrive
 
     # PAC settings
     pac_max_instruments: int = 8
     pac_min_allocation_pct: float = 5.0
+    pac_batch_chunk_size: int = 500
+    pac_optimizer: str = "score"  # score | mean_variance | min_variance | risk_parity
+    pac_optimizer_candidates: int = 50
+    optimizer_risk_aversion: float = 4.0
+    optimizer_cache_size: int = 16
+
+    # Position snapshots
+    snapshot_chunk_size: int = 200  # portfolios per chunk
+    snapshot_write_chunk_size: int = 500  # snapshot rows per INSERT
+
+    # Run progress streams
+    progress_stream_max_events: int = 5000
+    progress_stream_ttl_seconds: int = 24 * 3600
+    progress_heartbeat_seconds: float = 15.0
+    adhoc_scoring_max_tickers: int = 50
+
+    # Profiling (runs enqueued with profile=true)
+    profile_dir: str = ".cache/profiles"
+    profile_top: int = 30  # entries printed to the log
+
+    # Backtesting
+    backtest_processes: int = 0  # 0 = one per CPU
+    backtest_fee_pct: float = 0.1  # % of every trade
+    backtest_fee_fixed: float = 0.0  # EUR per order
+
+    # Return matrix cache (one entry per lookback window)
+    return_cache_windows: int = 4
+    return_cache_rebuild_every: int = 20  # appended days before a full rebuild
 
     class Config:
         env_file = "../../.env.local"
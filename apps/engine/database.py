@@ -1,10 +1,81 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import re
+import threading
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
 from config import settings
 
-engine = create_engine(settings.database_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The statements every job runs are module-level text() constants in the engines,
+# so their bind parameters are parsed once per process and SQLAlchemy reuses their
+# compiled form. They are not server-side prepared statements: psycopg2 sends each
+# execution as plain SQL, and PgBouncer in transaction mode could not share them.
+
+def _engine_options() -> dict:
+    if not settings.database_url.startswith("postgresql"):
+        return {}
+    if settings.db_pgbouncer:
+        # PgBouncer already pools server connections: hold none client-side, and
+        # skip startup options, which PgBouncer rejects
+        return {"poolclass": NullPool}
+    options = {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+    }
+    if settings.db_statement_timeout_ms:
+        options["connect_args"] = {"options": f"-c statement_timeout={settings.db_statement_timeout_ms}"}
+    return options
+
+_engine = None
+_engine_lock = threading.Lock()
+
+# Connection churn counters, reported by pool_stats()
+_pool_events = {"connects": 0, "checkouts": 0, "invalidations": 0}
+
+def get_engine():
+    """
+    The process's engine, built on first use: importing this module neither
+    loads the DB driver nor touches the database, so the API answers health
+    checks and an idle worker polls Redis without paying for it
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = _create_engine()
+    return _engine
+
+def _create_engine():
+    engine = create_engine(settings.database_url, **_engine_options())
+    event.listen(engine, "connect", _on_connect)
+    event.listen(engine, "checkout", _on_checkout)
+    event.listen(engine, "invalidate", _on_invalidate)
+    if settings.db_pgbouncer and settings.db_statement_timeout_ms and engine.dialect.name == "postgresql":
+        event.listen(engine, "begin", _set_statement_timeout)
+    return engine
+
+def _on_connect(dbapi_connection, connection_record):
+    _pool_events["connects"] += 1
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    _pool_events["checkouts"] += 1
+
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    _pool_events["invalidations"] += 1
+
+def _set_statement_timeout(conn):
+    # Transaction-scoped, so it never leaks to another client's server connection
+    conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(settings.db_statement_timeout_ms)}")
+
+class _Session(Session):
+    """Session on get_engine() unless given another bind"""
+
+    def __init__(self, bind=None, **kwargs):
+        super().__init__(bind=bind or get_engine(), **kwargs)
+
+SessionLocal = sessionmaker(class_=_Session, autocommit=False, autoflush=False)
 Base = declarative_base()
 
 def get_db():
@@ -13,3 +84,38 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def __getattr__(name: str):
+    # database.engine, as before the engine was built lazily
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def pool_stats() -> dict:
+    """Connection pool occupancy and churn for this process (no pool until the engine is built)"""
+    engine = _engine
+    stats = {"pool": type(engine.pool).__name__ if engine else None, **_pool_events}
+    if engine and isinstance(engine.pool, QueuePool):
+        stats.update(
+            size=engine.pool.size(),
+            checked_in=engine.pool.checkedin(),
+            checked_out=engine.pool.checkedout(),
+            overflow=engine.pool.overflow(),
+        )
+    return stats
+
+def insert_values(db, insert_sql: str, value_template: str, rows: list, suffix: str = ""):
+    """
+    Insert many rows with a single multi-row VALUES statement.
+    value_template uses :name placeholders, e.g. "(gen_random_uuid(), :run_id, :score)";
+    each row is a dict with those names. suffix is appended after the VALUES
+    list (e.g. an ON CONFLICT clause).
+    """
+    if not rows:
+        return
+    values = []
+    params = {}
+    for n, row in enumerate(rows):
+        values.append(re.sub(r"(?<![:\w\\]):(\w+)(?!:)", rf":\1_{n}", value_template))
+        params.update({f"{name}_{n}": value for name, value in row.items()})
+    db.execute(text(f"{insert_sql} VALUES {', '.join(values)} {suffix}"), params)
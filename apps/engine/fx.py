@@ -0,0 +1,127 @@
+"""
+EUR conversion of ingested prices.
+
+price_history stores prices in EUR, with the quoted prices in original* and
+their currency in originalCurrency. FxRates loads one daily rate series per
+currency through the market data fetcher (and its Parquet cache) and keeps it
+for the process, so ingesting many USD or GBP instruments costs one lookup per
+currency. convert_to_eur aligns the rates to the bars' dates with the last
+known rate (forward-filled over weekends and holidays) and converts all OHLC
+columns of a currency's rows in one array operation.
+"""
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from market_data import MarketDataFetcher, get_fetcher
+
+BASE_CURRENCY = "EUR"
+
+# Currencies quoted in minor units: code -> (currency, minor units per unit)
+MINOR_UNITS = {
+    "GBp": ("GBP", 100),
+    "GBX": ("GBP", 100),
+    "ZAc": ("ZAR", 100),
+    "ILA": ("ILS", 100),
+}
+
+# Rates loaded before the first bar, so that bar has a last known rate
+LEAD_DAYS = 10
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+ORIGINAL_COLUMNS = ['originalOpen', 'originalHigh', 'originalLow', 'originalClose']
+
+def fx_ticker(currency: str) -> str:
+    """Ticker of the daily <currency> per EUR rate"""
+    return f"{BASE_CURRENCY}{currency}=X"
+
+class FxRates:
+    """Daily <currency> per EUR rate series, loaded once per currency and kept in memory"""
+
+    def __init__(self, fetcher: MarketDataFetcher = None):
+        self.fetcher = fetcher
+        self._series = {}
+
+    def rates(self, currency: str, dates: np.ndarray) -> np.ndarray:
+        """
+        Units of currency per EUR on each date: the rate of that date or the
+        last one before it, NaN before the series starts
+        """
+        days = np.asarray(dates).astype('datetime64[D]')
+        if not len(days):
+            return np.empty(0)
+        fx_days, fx_rates = self._load(currency, days.min(), days.max())
+        idx = np.searchsorted(fx_days, days, side='right') - 1
+        result = np.full(len(days), np.nan)
+        found = idx >= 0
+        result[found] = fx_rates[idx[found]]
+        return result
+
+    def _load(self, currency: str, start: np.datetime64, end: np.datetime64) -> tuple:
+        cached = self._series.get(currency)
+        if cached is not None:
+            fx_days, fx_rates, cached_start, cached_end = cached
+            if cached_start <= start and end <= cached_end:
+                return fx_days, fx_rates
+            start, end = min(start, cached_start), max(end, cached_end)
+
+        ticker = fx_ticker(currency)
+        fetcher = self.fetcher or get_fetcher()
+        df = fetcher.fetch([ticker], pd.Timestamp(start).date() - timedelta(days=LEAD_DAYS), pd.Timestamp(end).date())
+        df = df.get(ticker)
+        if df is None or df.empty:
+            raise ValueError(f"No {ticker} rates available")
+
+        close = df['Close'].dropna()
+        close = close[close > 0].sort_index()
+        fx_days = close.index.to_numpy().astype('datetime64[D]')
+        fx_rates = close.to_numpy(dtype=np.float64)
+        self._series[currency] = (fx_days, fx_rates, start, end)
+        print(f"  💱 Loaded {len(fx_rates)} {currency}/EUR rates")
+        return fx_days, fx_rates
+
+def convert_to_eur(frame: pd.DataFrame, currencies: dict, fx: FxRates = None) -> pd.DataFrame:
+    """
+    Convert a price_history frame (see prepare_price_frame) to EUR.
+    currencies maps instrumentId to its quote currency (missing: EUR).
+    Converted rows keep their quoted prices in the original* columns and
+    their currency in originalCurrency; rows dated before the first available
+    rate are dropped.
+    """
+    fx = fx or get_fx_rates()
+    quoted = frame['instrumentId'].map(currencies).fillna(BASE_CURRENCY).to_numpy(dtype=object)
+    dates = frame['date'].to_numpy()
+
+    prices = frame[PRICE_COLUMNS].to_numpy(dtype=np.float64)
+    converted = prices.copy()
+    originals = np.full(prices.shape, np.nan)
+    original_currency = np.full(len(frame), BASE_CURRENCY, dtype=object)
+    keep = np.ones(len(frame), dtype=bool)
+
+    for code in pd.unique(quoted):
+        if code == BASE_CURRENCY:
+            continue
+        currency, units = MINOR_UNITS.get(code, (code, 1))
+        rows = quoted == code
+        divisor = units * (fx.rates(currency, dates[rows]) if currency != BASE_CURRENCY else 1.0)
+        converted[rows] = prices[rows] / np.reshape(divisor, (-1, 1))
+        originals[rows] = prices[rows]
+        original_currency[rows] = code
+        keep[rows] = ~np.isnan(divisor)
+
+    result = frame.copy()
+    result[PRICE_COLUMNS] = converted
+    result[ORIGINAL_COLUMNS] = originals
+    result['originalCurrency'] = original_currency
+    if not keep.all():
+        print(f"  ⚠️ Dropped {int((~keep).sum())} rows dated before the first available FX rate")
+        result = result[keep]
+    return result
+
+_fx_rates = None
+
+def get_fx_rates() -> FxRates:
+    """Process-wide FX rate cache"""
+    global _fx_rates
+    if _fx_rates is None:
+        _fx_rates = FxRates()
+    return _fx_rates
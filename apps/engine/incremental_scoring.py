@@ -0,0 +1,290 @@
+"""
+Incremental scoring: per-instrument rolling state persisted in scoring_state.
+
+Each instrument's window is the scoring lookback ending today (lookback_window),
+the same window run_scoring's full path scores. A run only touches instruments
+whose window moved: returns that fall out of the window are removed from the
+running mean/variance (Welford), new bars are appended, and peak/max drawdown
+are carried forward. When an evicted bar held the peak behind the stored
+drawdown the instrument is recomputed from its window.
+"""
+from datetime import date
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+from config import settings
+from price_loader import latest_price_dates
+from price_store import load_window
+from scoring_engine import RISK_FREE_RATE, TRADING_DAYS, calculate_etf_score, lookback_window, score_metrics
+
+MIN_ROWS = 200
+
+STATE_COLUMNS = ['instrumentId', 'lookbackDays', 'firstDate', 'lastDate', 'firstClose', 'lastClose',
+                 'count', 'mean', 'm2', 'peak', 'peakDate', 'maxDrawdown', 'mddPeakDate']
+
+def state_from_closes(instrument_id: str, dates: np.ndarray, closes: np.ndarray) -> dict:
+    """Build the rolling state for one instrument from its full window"""
+    returns = closes[1:] / closes[:-1] - 1
+    count = len(returns)
+    mean = returns.mean() if count else 0.0
+    m2 = ((returns - mean) ** 2).sum() if count else 0.0
+
+    # Drawdown path starts at the first return, as in calculate_etf_score
+    path = closes[1:] if count else closes
+    path_dates = dates[1:] if count else dates
+    running_max = np.maximum.accumulate(path)
+    drawdown = 1 - path / running_max
+    trough = int(np.argmax(drawdown))
+    max_drawdown = float(drawdown[trough])
+    peak_idx = int(np.argmax(path))
+    mdd_peak_idx = int(np.argmax(path[:trough + 1]))
+
+    return {
+        'instrumentId': instrument_id,
+        'lookbackDays': settings.scoring_lookback_days,
+        'firstDate': _to_date(dates[0]),
+        'lastDate': _to_date(dates[-1]),
+        'firstClose': float(closes[0]),
+        'lastClose': float(closes[-1]),
+        'count': count,
+        'mean': float(mean),
+        'm2': float(m2),
+        'peak': float(path[peak_idx]),
+        'peakDate': _to_date(path_dates[peak_idx]),
+        'maxDrawdown': max_drawdown,
+        'mddPeakDate': _to_date(path_dates[mdd_peak_idx]) if max_drawdown > 0 else None,
+    }
+
+def update_state(state: dict, evicted: list, boundary: tuple, new_rows: list):
+    """
+    Slide one instrument's state forward.
+    evicted: (date, close) rows leaving the window, oldest first
+    boundary: (date, close) first row remaining in the window, None when empty
+    new_rows: (date, close) rows after state['lastDate'], oldest first
+    Returns the updated state, or None when it must be rebuilt from the window.
+    """
+    state = dict(state)
+
+    if evicted:
+        if boundary is None:
+            return None
+        boundary_date, boundary_close = boundary
+        if boundary_date > state['lastDate']:
+            return None
+        # The new first close leaves the drawdown path: if it (or anything before it)
+        # was the peak, the carried drawdown is no longer valid
+        if state['peakDate'] <= boundary_date:
+            return None
+        if state['mddPeakDate'] is not None and state['mddPeakDate'] <= boundary_date:
+            return None
+
+        closes = [close for _, close in evicted] + [boundary_close]
+        for prev, cur in zip(closes[:-1], closes[1:]):
+            _welford_remove(state, cur / prev - 1)
+        state['firstDate'] = boundary_date
+        state['firstClose'] = boundary_close
+
+    for row_date, close in new_rows:
+        _welford_add(state, close / state['lastClose'] - 1)
+        if close > state['peak']:
+            state['peak'] = close
+            state['peakDate'] = row_date
+        drawdown = 1 - close / state['peak']
+        if drawdown > state['maxDrawdown']:
+            state['maxDrawdown'] = drawdown
+            state['mddPeakDate'] = state['peakDate']
+        state['lastDate'] = row_date
+        state['lastClose'] = close
+
+    return state
+
+def metrics_from_states(states: list) -> tuple:
+    """Metric arrays (in percent, as in calculate_etf_score) for a list of states"""
+    first_close = np.array([s['firstClose'] for s in states], dtype=np.float64)
+    last_close = np.array([s['lastClose'] for s in states], dtype=np.float64)
+    count = np.array([s['count'] for s in states], dtype=np.float64)
+    mean = np.array([s['mean'] for s in states], dtype=np.float64)
+    m2 = np.array([s['m2'] for s in states], dtype=np.float64)
+    max_drawdown = np.array([s['maxDrawdown'] for s in states], dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns_1y = (last_close / first_close - 1) * 100
+        std = np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+        volatility = std * np.sqrt(TRADING_DAYS) * 100
+        sharpe_ratio = (mean * TRADING_DAYS - RISK_FREE_RATE) / (std * np.sqrt(TRADING_DAYS))
+    return returns_1y, volatility, sharpe_ratio, max_drawdown * 100
+
+def run_incremental(db: Session, instrument_ids: list, today: date = None) -> dict:
+    """
+    Bring scoring_state up to date for the given instruments and score them.
+    Returns {instrument_id: score_data} for instruments with enough history.
+    """
+    first_day, today = lookback_window(today)
+    # Instruments without a bar in the window are left to the full path
+    latest = {i: d for i, d in latest_price_dates(db, instrument_ids).items() if d >= first_day}
+    states = load_states(db, list(latest.keys()))
+
+    unchanged, delta, rebuild = [], [], []
+    for instrument_id, last_date in latest.items():
+        state = states.get(instrument_id)
+        if state is None or state['lookbackDays'] != settings.scoring_lookback_days:
+            rebuild.append(instrument_id)
+        elif last_date > state['lastDate'] or state['firstDate'] < first_day:
+            delta.append(instrument_id)
+        else:
+            unchanged.append(instrument_id)
+
+    print(f"  Incremental scoring: {len(unchanged)} unchanged, {len(delta)} updated, {len(rebuild)} rebuilt")
+
+    changed = {}
+    if delta:
+        for instrument_id, new_state in _apply_deltas(db, [states[i] for i in delta], first_day).items():
+            if new_state is None:
+                rebuild.append(instrument_id)
+            else:
+                changed[instrument_id] = new_state
+    if rebuild:
+        changed.update(_rebuild_states(db, rebuild, first_day, today))
+
+    save_states(db, list(changed.values()))
+    states.update(changed)
+
+    scored = [states[i] for i in latest if i in states and states[i]['count'] + 1 >= MIN_ROWS]
+    if not scored:
+        return {}
+    results = score_metrics(*metrics_from_states(scored))
+    return {state['instrumentId']: result for state, result in zip(scored, results)}
+
+def verify_incremental(db: Session, instrument_ids: list, today: date = None) -> list:
+    """
+    Recompute stored states from scratch with calculate_etf_score over the
+    full path's window and return the instruments whose incremental result differs
+    """
+    states = load_states(db, instrument_ids)
+    if not states:
+        return []
+    incremental = score_metrics(*metrics_from_states(list(states.values())))
+    windows = _load_windows(db, list(states.keys()), *lookback_window(today))
+
+    mismatches = []
+    for (instrument_id, state), result in zip(states.items(), incremental):
+        series = windows.get(instrument_id)
+        if series is None:
+            continue
+        expected = calculate_etf_score(instrument_id, series.to_frame())
+        if any(expected[k] != result[k] for k in ('performance_score', 'volatility_score',
+                                                  'sharpe_score', 'drawdown_score')):
+            mismatches.append(instrument_id)
+        elif any(abs(expected['metrics'][k] - result['metrics'][k]) > 0.01 for k in expected['metrics']):
+            mismatches.append(instrument_id)
+    return mismatches
+
+def load_states(db: Session, instrument_ids: list) -> dict:
+    if not instrument_ids:
+        return {}
+    rows = db.execute(
+        text(f"""
+        SELECT {', '.join(f'"{c}"' for c in STATE_COLUMNS)}
+        FROM scoring_state
+        WHERE "instrumentId" IN :instrument_ids
+        """).bindparams(bindparam("instrument_ids", expanding=True)),
+        {"instrument_ids": instrument_ids}
+    ).fetchall()
+    return {row[0]: dict(zip(STATE_COLUMNS, row)) for row in rows}
+
+def save_states(db: Session, states: list):
+    if not states:
+        return
+    db.execute(
+        text(f"""
+        INSERT INTO scoring_state ({', '.join(f'"{c}"' for c in STATE_COLUMNS)}, "updatedAt")
+        VALUES ({', '.join(f':{c}' for c in STATE_COLUMNS)}, now())
+        ON CONFLICT ("instrumentId")
+        DO UPDATE SET {', '.join(f'"{c}" = EXCLUDED."{c}"' for c in STATE_COLUMNS[1:])}, "updatedAt" = now()
+        """),
+        states
+    )
+    db.commit()
+
+def _apply_deltas(db: Session, states: list, first_day: date) -> dict:
+    """
+    Fetch only the rows that leave or enter each window (plus the new first row)
+    in one query, and slide every state forward to the window starting first_day
+    """
+    params = {
+        "ids": [s['instrumentId'] for s in states],
+        "old_starts": [s['firstDate'] for s in states],
+        "new_starts": [first_day] * len(states),
+        "last_dates": [s['lastDate'] for s in states],
+    }
+    rows = db.execute(
+        text("""
+        SELECT ph."instrumentId", ph.date, ph.close, ph.date < s.new_start AS evicted, ph.date > s.last_date AS added
+        FROM unnest(CAST(:ids AS text[]), CAST(:old_starts AS date[]),
+                    CAST(:new_starts AS date[]), CAST(:last_dates AS date[]))
+             AS s(id, old_start, new_start, last_date)
+        JOIN price_history ph ON ph."instrumentId" = s.id
+        WHERE ph.date >= s.old_start
+          AND (ph.date < s.new_start
+               OR ph.date > s.last_date
+               OR ph.date = (SELECT MIN(p2.date) FROM price_history p2
+                             WHERE p2."instrumentId" = s.id AND p2.date >= s.new_start))
+        ORDER BY ph."instrumentId", ph.date
+        """),
+        params
+    ).fetchall()
+
+    grouped = {s['instrumentId']: ([], None, []) for s in states}
+    for instrument_id, row_date, close, evicted, added in rows:
+        evicted_rows, boundary, new_rows = grouped[instrument_id]
+        row = (_to_date(row_date), float(close))
+        if evicted:
+            evicted_rows.append(row)
+        else:
+            if boundary is None:
+                boundary = row
+            if added:
+                new_rows.append(row)
+        grouped[instrument_id] = (evicted_rows, boundary, new_rows)
+
+    return {
+        s['instrumentId']: update_state(s, *grouped[s['instrumentId']])
+        for s in states
+    }
+
+def _rebuild_states(db: Session, instrument_ids: list, first_day: date, today: date) -> dict:
+    windows = _load_windows(db, instrument_ids, first_day, today)
+    return {
+        instrument_id: state_from_closes(instrument_id, series.index.to_numpy(), series.to_numpy())
+        for instrument_id, series in windows.items()
+    }
+
+def _load_windows(db: Session, instrument_ids: list, first_day: date, today: date) -> dict:
+    """Close series per instrument for the window [first_day, today]"""
+    window = load_window(db, instrument_ids, first_day, today)
+    return {
+        instrument_id: window.close_series(instrument_id)
+        for instrument_id in instrument_ids
+        if window.count(instrument_id)
+    }
+
+def _welford_add(state: dict, x: float):
+    state['count'] += 1
+    delta = x - state['mean']
+    state['mean'] += delta / state['count']
+    state['m2'] += delta * (x - state['mean'])
+
+def _welford_remove(state: dict, x: float):
+    if state['count'] <= 1:
+        state['count'], state['mean'], state['m2'] = 0, 0.0, 0.0
+        return
+    delta = x - state['mean']
+    state['count'] -= 1
+    state['mean'] -= delta / state['count']
+    state['m2'] -= delta * (x - state['mean'])
+
+def _to_date(value) -> date:
+    if isinstance(value, date) and not isinstance(value, pd.Timestamp):
+        return value if type(value) is date else value.date()
+    return pd.Timestamp(value).date()
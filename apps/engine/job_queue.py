@@ -0,0 +1,168 @@
+"""
+Job leases and stalled-job recovery for the aurora-jobs queue.
+
+A worker holds a lease (bull:aurora-jobs:<id>:lock, with a TTL) for every job
+in the active list and renews it from a heartbeat thread while the job runs.
+If the process dies the lease expires; the reaper then moves the job back to
+the wait list, or fails it once it has stalled too many times.
+"""
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+from sqlalchemy import text
+from config import settings
+from database import SessionLocal
+from redis_client import release_lock
+
+QUEUE_PREFIX = "bull:aurora-jobs"
+WAIT_KEY = f"{QUEUE_PREFIX}:wait"
+ACTIVE_KEY = f"{QUEUE_PREFIX}:active"
+STALLED_CHECK_KEY = f"{QUEUE_PREFIX}:stalled-check"
+REAPER_LOCK_KEY = f"{QUEUE_PREFIX}:stalled-check-lock"
+
+# Move a job from active back to wait only if it is still in active,
+# so a job finished by its worker in the meantime is not requeued
+_REQUEUE_SCRIPT = """
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) > 0 then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# engine_run.status per job type, as set by the API
+RUN_STATUS = {
+    "scoring": "ETF_SCORING",
+    "pac": "MONTHLY_PAC",
+    "full": "FULL_ANALYSIS",
+    "pac_batch": "MONTHLY_PAC_BATCH",
+    "pac_drift": "MONTHLY_PAC_DRIFT",
+    "snapshot": "POSITION_SNAPSHOT",
+    "snapshot_backfill": "POSITION_SNAPSHOT_BACKFILL",
+}
+
+def job_hash_key(job_key: str) -> str:
+    return f"{QUEUE_PREFIX}:{job_key}"
+
+def lock_key(job_key: str) -> str:
+    return f"{QUEUE_PREFIX}:{job_key}:lock"
+
+class JobLease:
+    """Hold and periodically renew the lease on an active job"""
+
+    def __init__(self, r, job_key: str, lease_seconds: float = None):
+        self.r = r
+        self.job_key = job_key
+        self.lease_ms = int((lease_seconds or settings.job_lease_seconds) * 1000)
+        self.token = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.r.set(lock_key(self.job_key), self.token, px=self.lease_ms)
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        # Only release the lease if it is still ours (the reaper may have requeued the job)
+        release_lock(self.r, lock_key(self.job_key), self.token)
+        return False
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_ms / 3000):
+            try:
+                self.r.set(lock_key(self.job_key), self.token, px=self.lease_ms)
+            except Exception as e:
+                print(f"⚠️ Could not renew lease for job {self.job_key}: {e}")
+
+def create_run(db, user_id: str, run_type: str) -> str:
+    """Insert a queued engine_run row and return its runId"""
+    run_id = f"run_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}"
+    db.execute(
+        text("""
+        INSERT INTO engine_run (id, "runId", "userId", type, status, "inputParams")
+        VALUES (gen_random_uuid(), :run_id, :user_id, 'queued', :status, CAST('{}' AS jsonb))
+        """),
+        {"run_id": run_id, "user_id": user_id, "status": RUN_STATUS[run_type]}
+    )
+    db.commit()
+    return run_id
+
+def enqueue_job(r, run_id: str, user_id: str, run_type: str, profile: bool = False):
+    """Add a job the way the API's BullMQ queue does (job id = runId)"""
+    data = {"runId": run_id, "userId": user_id, "type": run_type}
+    if profile:
+        data["profile"] = True
+    pipe = r.pipeline()
+    pipe.hset(job_hash_key(run_id), mapping={
+        "name": "engine-run",
+        "data": json.dumps(data),
+        "opts": json.dumps({"jobId": run_id, "attempts": 3}),
+        "timestamp": int(time.time() * 1000),
+    })
+    pipe.lpush(WAIT_KEY, run_id)
+    pipe.execute()
+
+def reap_stalled_jobs(r) -> int:
+    """
+    Requeue active jobs whose lease has expired.
+    A job must be seen without a lease on two consecutive checks before it is
+    reclaimed, which covers the short gap between BRPOPLPUSH and taking the lease.
+    Returns the number of jobs requeued.
+    """
+    # One reaper at a time across all workers
+    if not r.set(REAPER_LOCK_KEY, "1", nx=True, px=int(settings.job_stalled_check_interval * 1000)):
+        return 0
+
+    requeue = r.register_script(_REQUEUE_SCRIPT)
+    suspects = set(r.smembers(STALLED_CHECK_KEY))
+    requeued = 0
+
+    for job_key in r.lrange(ACTIVE_KEY, 0, -1):
+        if r.exists(lock_key(job_key)):
+            r.srem(STALLED_CHECK_KEY, job_key)
+            continue
+
+        if job_key not in suspects:
+            r.sadd(STALLED_CHECK_KEY, job_key)
+            continue
+
+        r.srem(STALLED_CHECK_KEY, job_key)
+        stalled_count = r.hincrby(job_hash_key(job_key), "stalledCounter", 1)
+        if stalled_count > settings.job_max_stalled_count:
+            if r.lrem(ACTIVE_KEY, 1, job_key):
+                print(f"💀 Job {job_key} stalled {stalled_count} times, marking as failed")
+                _fail_run(r, job_key, f"Job stalled {stalled_count} times")
+            continue
+
+        if requeue(keys=[ACTIVE_KEY, WAIT_KEY], args=[job_key]):
+            print(f"♻️ Requeued stalled job {job_key}")
+            requeued += 1
+
+    # Forget suspects that are no longer active
+    active = set(r.lrange(ACTIVE_KEY, 0, -1))
+    for job_key in suspects - active:
+        r.srem(STALLED_CHECK_KEY, job_key)
+
+    return requeued
+
+def _fail_run(r, job_key: str, error: str):
+    data = json.loads(r.hget(job_hash_key(job_key), "data") or "{}")
+    run_id = data.get("runId")
+    if not run_id:
+        return
+
+    db = SessionLocal()
+    try:
+        db.execute(
+            text("UPDATE engine_run SET type = 'failed', error = :error, \"completedAt\" = :now WHERE \"runId\" = :run_id"),
+            {"error": error, "now": datetime.utcnow(), "run_id": run_id}
+        )
+        db.commit()
+    finally:
+        db.close()
@@ -1,17 +1,49 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
 from contextlib import asynccontextmanager
-import uvicorn
-from worker import start_worker
+import asyncio
+import json
+from config import settings
+from database import SessionLocal, pool_stats
+from worker import engines_loaded, execute_run, mark_run_failed, prewarm_in_background, start_worker
+from supervisor import WorkerSupervisor
+from job_queue import ACTIVE_KEY, WAIT_KEY, create_run, enqueue_job
+from metrics import render
+from progress import FINAL_STAGES, stream_key
+from redis_client import get_async_redis, get_redis, redis_pool_stats
 import threading
+import traceback
+
+# Inline runs still executing, awaited on shutdown
+_inline_runs = set()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Start worker in background thread
-    worker_thread = threading.Thread(target=start_worker, daemon=True)
-    worker_thread.start()
+    # With WORKER_EMBEDDED=false workers run standalone (python supervisor.py)
+    supervisor = None
+    if settings.worker_embedded and settings.worker_processes > 0:
+        # Start worker processes and restart them if they crash
+        supervisor = WorkerSupervisor()
+        supervisor.start()
+        threading.Thread(target=supervisor.monitor, daemon=True).start()
+    elif settings.worker_embedded:
+        # Start worker in background thread
+        worker_thread = threading.Thread(target=start_worker, daemon=True)
+        worker_thread.start()
+    if settings.engine_prewarm:
+        # Ready now; inline runs and adhoc scoring find the analytics stack loaded later
+        prewarm_in_background()
     yield
-    # Cleanup if needed
+    if _inline_runs:
+        print(f"⏳ Waiting for {len(_inline_runs)} inline runs")
+    # A failed run adds the future marking it failed
+    while _inline_runs:
+        await asyncio.gather(*_inline_runs, return_exceptions=True)
+    if supervisor:
+        # Let in-flight jobs finish before exiting
+        await asyncio.get_running_loop().run_in_executor(None, supervisor.stop)
 
 app = FastAPI(
     title="AURORA Engine",
@@ -28,19 +60,157 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class RunRequest(BaseModel):
+    userId: str
+    # Run in this process instead of queueing it for the workers
+    inline: bool = False
+    # Profile the run with cProfile (see PROFILE_DIR)
+    profile: bool = False
+
+class AdhocScoringRequest(BaseModel):
+    tickers: list[str]
+
+def _create_run(user_id: str, run_type: str) -> str:
+    db = SessionLocal()
+    try:
+        return create_run(db, user_id, run_type)
+    finally:
+        db.close()
+
+def _score_tickers(tickers: list) -> list:
+    from scoring_engine import score_tickers
+
+    db = SessionLocal()
+    try:
+        return score_tickers(db, tickers)
+    finally:
+        db.close()
+
+async def _start_run(request: RunRequest, run_type: str) -> dict:
+    loop = asyncio.get_running_loop()
+    run_id = await loop.run_in_executor(None, _create_run, request.userId, run_type)
+    if request.inline:
+        # Not awaited: the client follows the run through its event stream
+        future = loop.run_in_executor(None, execute_run, run_id, request.userId, run_type, request.profile)
+        _inline_runs.add(future)
+        future.add_done_callback(lambda f: _inline_run_done(f, run_id))
+    else:
+        await loop.run_in_executor(None, enqueue_job, get_redis(), run_id, request.userId, run_type,
+                                   request.profile)
+    return {"runId": run_id, "events": f"/runs/{run_id}/events"}
+
+def _inline_run_done(future: asyncio.Future, run_id: str):
+    _inline_runs.discard(future)
+    if future.cancelled() or future.exception() is None:
+        return
+    # execute_run records engine failures itself; this is a failure around them
+    error = future.exception()
+    print(f"❌ Inline run {run_id} failed: {error}")
+    traceback.print_exception(error)
+    marking = asyncio.get_running_loop().run_in_executor(None, mark_run_failed, run_id, str(error))
+    _inline_runs.add(marking)
+    marking.add_done_callback(_inline_runs.discard)
+
 @app.get("/health")
 async def health():
-    return {"status": "ok", "service": "engine"}
+    # Ready as soon as the app is up; "warm" tells whether the analytics stack is loaded yet
+    return {"status": "ok", "service": "engine", "warm": engines_loaded()}
+
+@app.get("/health/pools")
+async def health_pools():
+    """Database and Redis connection pool usage of the API process"""
+    return {"database": pool_stats(), "redis": redis_pool_stats()}
+
+def _render_metrics() -> str:
+    r = get_redis()
+    database = pool_stats()
+    return render({
+        "aurora_queue_depth": {'state="wait"': r.llen(WAIT_KEY), 'state="active"': r.llen(ACTIVE_KEY)},
+        "aurora_db_pool_connections": {
+            f'state="{state}"': database[state]
+            for state in ("checked_in", "checked_out", "overflow") if state in database
+        },
+        "aurora_redis_pool_connections": {
+            f'state="{state}"': value for state, value in redis_pool_stats().items()
+            if state in ("in_use", "available")
+        },
+    })
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: engine phase and job histograms, queue depth, API pool usage"""
+    body = await asyncio.get_running_loop().run_in_executor(None, _render_metrics)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def root():
     return {
         "service": "AURORA Engine",
         "version": "0.1.0",
-        "endpoints": ["/health", "/scoring", "/pac"]
+        "endpoints": ["/health", "/health/pools", "/metrics", "/scoring", "/scoring/adhoc", "/pac",
+                      "/snapshots", "/snapshots/backfill", "/runs/{run_id}/events"]
     }
 
+@app.post("/scoring")
+async def start_scoring(request: RunRequest):
+    return await _start_run(request, "scoring")
+
+@app.post("/pac")
+async def start_pac(request: RunRequest):
+    return await _start_run(request, "pac")
+
+@app.post("/snapshots")
+async def start_snapshots(request: RunRequest):
+    """Rebuild positions and write today's snapshot of every portfolio"""
+    return await _start_run(request, "snapshot")
+
+@app.post("/snapshots/backfill")
+async def start_snapshot_backfill(request: RunRequest):
+    """Rebuild the user's positions and snapshot every trading day since their first transaction"""
+    return await _start_run(request, "snapshot_backfill")
+
+@app.post("/scoring/adhoc")
+async def adhoc_scoring(request: AdhocScoringRequest):
+    """Score the given tickers now; nothing is saved"""
+    tickers = list(dict.fromkeys(t.strip().upper() for t in request.tickers if t.strip()))
+    if not tickers:
+        raise HTTPException(status_code=400, detail="No tickers given")
+    if len(tickers) > settings.adhoc_scoring_max_tickers:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {settings.adhoc_scoring_max_tickers} tickers per request")
+    results = await asyncio.get_running_loop().run_in_executor(None, _score_tickers, tickers)
+    return {"results": results}
+
+@app.get("/runs/{run_id}/events")
+async def run_events(run_id: str, request: Request):
+    """
+    Server-Sent Events stream of a run's progress, replayed from the start
+    (or from Last-Event-ID) and closed after the completed/failed event
+    """
+    r = get_async_redis()
+    key = stream_key(run_id)
+    heartbeat_ms = int(settings.progress_heartbeat_seconds * 1000)
+
+    async def events():
+        last_id = request.headers.get("last-event-id", "0-0")
+        while not await request.is_disconnected():
+            response = await r.xread({key: last_id}, count=100, block=heartbeat_ms)
+            if not response:
+                yield ": keep-alive\n\n"
+                continue
+            for _, entries in response:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    yield f"id: {entry_id}\nevent: progress\ndata: {fields['event']}\n\n"
+                    if json.loads(fields['event']).get("stage") in FINAL_STAGES:
+                        return
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
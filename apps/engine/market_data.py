@@ -0,0 +1,258 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from config import settings
+
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+class MarketDataProvider:
+    """
+    Source of daily OHLCV bars. download() returns {ticker: DataFrame} with a
+    naive DatetimeIndex and OHLCV_COLUMNS, for the inclusive range [start, end].
+    Tickers with no data are simply missing from the result.
+    """
+
+    def download(self, tickers: list, start: date, end: date) -> dict:
+        raise NotImplementedError
+
+class YFinanceProvider(MarketDataProvider):
+    """Multi-ticker downloads through yfinance"""
+
+    def download(self, tickers: list, start: date, end: date) -> dict:
+        import yfinance as yf
+
+        df = yf.download(
+            tickers,
+            start=start,
+            end=end + timedelta(days=1),  # yfinance end is exclusive
+            progress=False,
+            auto_adjust=True,
+            actions=False,
+            repair=True,
+            keepna=False,
+            group_by='ticker',
+            threads=False
+        )
+        if df is None or df.empty:
+            return {}
+
+        result = {}
+        for ticker in tickers:
+            if isinstance(df.columns, pd.MultiIndex):
+                if ticker not in df.columns.get_level_values(0):
+                    continue
+                frame = df[ticker]
+            else:
+                frame = df
+            frame = frame[OHLCV_COLUMNS].dropna(subset=['Close'])
+            if frame.empty:
+                continue
+            if getattr(frame.index, 'tz', None) is not None:
+                frame.index = frame.index.tz_localize(None)
+            result[ticker] = frame
+        return result
+
+class SyntheticProvider(MarketDataProvider):
+    """
+    Offline provider for tests and benchmarks: deterministic synthetic bars
+    per ticker, so repeated downloads of the same range return the same data
+    """
+
+    def __init__(self, seed: int = 0, fail_tickers: set = None):
+        self.seed = seed
+        self.fail_tickers = set(fail_tickers or ())
+        self.calls = []
+
+    def download(self, tickers: list, start: date, end: date) -> dict:
+        from seed_historical_data import generate_synthetic_universe
+
+        self.calls.append((list(tickers), start, end))
+        result = {}
+        for ticker in tickers:
+            if ticker in self.fail_tickers:
+                continue
+            # Generate from a fixed origin so overlapping ranges agree
+            origin = date(2000, 1, 1)
+            days = (end - origin).days + 1
+            ticker_seed = self.seed + sum(ord(c) for c in ticker)
+            df = generate_synthetic_universe([ticker], days, seed=ticker_seed, end_date=end + timedelta(days=1))
+            df = df.drop(columns='Ticker').set_index('Date')
+            df.index = pd.DatetimeIndex(df.index)
+            result[ticker] = df.loc[pd.Timestamp(start):pd.Timestamp(end), OHLCV_COLUMNS]
+        return result
+
+class TokenBucket:
+    """Thread-safe token bucket: at most `rate` acquisitions per second, bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class ParquetCache:
+    """
+    Local Parquet cache, one file per ticker plus the date range it covers.
+    The covered range can start before the stored bars and span gaps (weekends,
+    holidays), but ends at the last bar downloaded: trailing days without bars
+    yet (today's bar before the close) are requested again by the next fetch.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, ticker: str) -> tuple:
+        name = ticker.replace('/', '_')
+        return (os.path.join(self.cache_dir, f"{name}.parquet"),
+                os.path.join(self.cache_dir, f"{name}.json"))
+
+    def coverage(self, ticker: str):
+        _, meta_path = self._paths(ticker)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        return date.fromisoformat(meta['start']), date.fromisoformat(meta['end'])
+
+    def read(self, ticker: str, start: date, end: date) -> pd.DataFrame:
+        data_path, _ = self._paths(ticker)
+        if not os.path.exists(data_path):
+            return None
+        df = pd.read_parquet(data_path)
+        return df.loc[pd.Timestamp(start):pd.Timestamp(end)]
+
+    def write(self, ticker: str, df: pd.DataFrame, start: date, end: date):
+        """Merge freshly downloaded bars for [start, end] into the cached history"""
+        data_path, meta_path = self._paths(ticker)
+        if df is not None and not df.empty:
+            end = min(end, df.index.max().date())
+        with self.lock:
+            coverage = self.coverage(ticker)
+            if os.path.exists(data_path):
+                cached = pd.read_parquet(data_path)
+                df = pd.concat([cached, df]) if df is not None else cached
+                df = df[~df.index.duplicated(keep='last')].sort_index()
+            if df is not None:
+                df.to_parquet(data_path)
+            if coverage:
+                start, end = min(start, coverage[0]), max(end, coverage[1])
+            with open(meta_path, 'w') as f:
+                json.dump({'start': start.isoformat(), 'end': end.isoformat()}, f)
+
+class MarketDataFetcher:
+    """
+    Batched, concurrent, rate-limited downloads with a local cache.
+    Only the part of [start, end] not already cached is requested from the provider.
+    """
+
+    def __init__(self, provider: MarketDataProvider = None, cache_dir: str = None,
+                 batch_size: int = None, max_workers: int = None, rate_per_sec: float = None,
+                 max_retries: int = None, backoff_base: float = 1.0):
+        self.provider = provider or YFinanceProvider()
+        self.cache = ParquetCache(cache_dir or settings.market_data_cache_dir)
+        self.batch_size = batch_size or settings.market_data_batch_size
+        self.max_workers = max_workers or settings.market_data_max_workers
+        self.bucket = TokenBucket(rate_per_sec or settings.market_data_rate_per_sec)
+        self.max_retries = settings.market_data_max_retries if max_retries is None else max_retries
+        self.backoff_base = backoff_base
+
+    def fetch(self, tickers: list, start, end) -> dict:
+        """Return {ticker: DataFrame} for [start, end]; tickers without data are omitted"""
+        start, end = _as_date(start), _as_date(end)
+        tickers = list(dict.fromkeys(t for t in tickers if t))
+
+        # Group tickers by the range still missing from the cache
+        missing = {}
+        for ticker in tickers:
+            for missing_range in self._missing_ranges(ticker, start, end):
+                missing.setdefault(missing_range, []).append(ticker)
+
+        batches = []
+        for (range_start, range_end), range_tickers in missing.items():
+            for i in range(0, len(range_tickers), self.batch_size):
+                batches.append((range_tickers[i:i + self.batch_size], range_start, range_end))
+
+        if batches:
+            print(f"  📡 Fetching {sum(len(b[0]) for b in batches)} ticker ranges in {len(batches)} batches")
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = [pool.submit(self._download_batch, *batch) for batch in batches]
+                for future in as_completed(futures):
+                    future.result()
+
+        result = {}
+        for ticker in tickers:
+            df = self.cache.read(ticker, start, end)
+            if df is not None and not df.empty:
+                result[ticker] = df
+        return result
+
+    def _missing_ranges(self, ticker: str, start: date, end: date) -> list:
+        coverage = self.cache.coverage(ticker)
+        if coverage is None:
+            return [(start, end)]
+        cached_start, cached_end = coverage
+        ranges = []
+        if start < cached_start:
+            ranges.append((start, min(end, cached_start - timedelta(days=1))))
+        if end > cached_end:
+            ranges.append((max(start, cached_end + timedelta(days=1)), end))
+        return ranges
+
+    def _download_batch(self, tickers: list, start: date, end: date):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                frames = self.provider.download(tickers, start, end)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"    ✗ Download failed for {', '.join(tickers)}: {str(e)[:100]}")
+                    return
+                delay = self.backoff_base * (2 ** attempt) * (1 + random.random())
+                print(f"    ✗ Download attempt {attempt + 1} failed, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+        for ticker in tickers:
+            df = frames.get(ticker)
+            if df is None or df.empty:
+                # Don't record coverage for tickers the provider had nothing for,
+                # so a later run can retry them
+                continue
+            self.cache.write(ticker, df, start, end)
+
+def _as_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).date()
+    return value
+
+_fetcher = None
+
+def get_fetcher() -> MarketDataFetcher:
+    """Process-wide fetcher using the configured provider settings"""
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = MarketDataFetcher()
+    return _fetcher
@@ -0,0 +1,144 @@
+"""
+Timing spans and Prometheus-style metrics for the engine.
+
+Histograms and counters live in Redis hashes (aurora:metrics:*), so the
+spans recorded by every worker process show up on the API's /metrics
+endpoint. Spans also print a timing line and are collected per run while
+a run is being traced (see trace_run), which is how execute_run stores a
+run's phase breakdown. Recording is best-effort: a Redis outage never
+fails a run.
+"""
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import time
+from contextlib import contextmanager
+import redis
+from config import settings
+from redis_client import get_redis
+
+METRICS_PREFIX = "aurora:metrics"
+
+# Upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+HELP = {
+    "aurora_phase_duration_seconds": "Duration of engine phases",
+    "aurora_job_duration_seconds": "Duration of engine jobs from start to completion",
+    "aurora_job_wait_seconds": "Time jobs spent queued before a worker picked them up",
+    "aurora_jobs_total": "Engine jobs finished, by type and status",
+}
+
+# Phase timings of the run traced in this context, or None
+_run_spans = contextvars.ContextVar("run_spans", default=None)
+
+def _labels(labels: dict) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+def _sample(name: str, label_str: str, value) -> str:
+    return f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}"
+
+def observe(name: str, seconds: float, **labels):
+    """Record one histogram sample"""
+    label_str = _labels(labels)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        key = f"{METRICS_PREFIX}:histogram:{name}"
+        for bound in BUCKETS:
+            if seconds <= bound:
+                pipe.hincrby(key, f"{label_str}|{bound}", 1)
+        pipe.hincrby(key, f"{label_str}|+Inf", 1)
+        pipe.hincrbyfloat(key, f"{label_str}|sum", seconds)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        print(f"  ⚠️ Could not record metric {name}: {e}")
+
+def increment(name: str, value: int = 1, **labels):
+    """Increment a counter"""
+    try:
+        get_redis().hincrby(f"{METRICS_PREFIX}:counter:{name}", _labels(labels), value)
+    except redis.exceptions.RedisError as e:
+        print(f"  ⚠️ Could not record metric {name}: {e}")
+
+@contextmanager
+def span(phase: str, **fields):
+    """
+    Time a phase of a run: prints it, records it in the phase histogram and
+    adds it to the traced run's breakdown. Extra fields are only printed.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        details = "".join(f" {name}={value}" for name, value in fields.items())
+        print(f"  ⏱️ {phase}: {seconds * 1000:.0f} ms{details}")
+        observe("aurora_phase_duration_seconds", seconds, phase=phase)
+        spans = _run_spans.get()
+        if spans is not None:
+            spans[phase] = round(spans.get(phase, 0) + seconds * 1000, 1)
+
+@contextmanager
+def trace_run(run_id: str, profile: bool = False):
+    """
+    Collect the spans of one run into the yielded dict (phase -> ms). With
+    profile=True the run is also profiled with cProfile: the stats are
+    written to PROFILE_DIR/<run_id>.prof and the top entries printed.
+    """
+    spans = {}
+    token = _run_spans.set(spans)
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        yield spans
+    finally:
+        _run_spans.reset(token)
+        if profiler:
+            profiler.disable()
+            _save_profile(profiler, run_id)
+
+def _save_profile(profiler: cProfile.Profile, run_id: str):
+    os.makedirs(settings.profile_dir, exist_ok=True)
+    path = os.path.join(settings.profile_dir, f"{run_id.replace(':', '_')}.prof")
+    profiler.dump_stats(path)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(settings.profile_top)
+    print(f"  🔍 Profile for run {run_id} written to {path}")
+    print(out.getvalue())
+
+def render(gauges: dict = None) -> str:
+    """
+    All recorded metrics in the Prometheus text exposition format, followed
+    by the given gauges ({name: {label_str: value}})
+    """
+    r = get_redis()
+    lines = []
+    for key in sorted(r.scan_iter(f"{METRICS_PREFIX}:*")):
+        _, _, kind, name = key.split(":", 3)
+        values = r.hgetall(key)
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for label_str, value in sorted(values.items()):
+                lines.append(_sample(name, label_str, value))
+            continue
+
+        series = {}
+        for field, value in values.items():
+            label_str, bucket = field.rsplit("|", 1)
+            series.setdefault(label_str, {})[bucket] = value
+        for label_str, buckets in sorted(series.items()):
+            sep = "," if label_str else ""
+            for bound in [str(b) for b in BUCKETS] + ["+Inf"]:
+                lines.append(f'{name}_bucket{{{label_str}{sep}le="{bound}"}} {buckets.get(bound, 0)}')
+            lines.append(_sample(f"{name}_sum", label_str, buckets.get('sum', 0)))
+            lines.append(_sample(f"{name}_count", label_str, buckets.get('+Inf', 0)))
+
+    for name, values in (gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        for label_str, value in values.items():
+            lines.append(_sample(name, label_str, value))
+    return "\n".join(lines) + "\n"
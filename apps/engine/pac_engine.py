@@ -1,9 +1,65 @@
+import uuid
 from datetime import datetime
+import numpy as np
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from config import settings
+from database import insert_values
+from optimizer import BUCKETS, DEFAULT_ALLOCATION, estimate_covariance, instrument_bucket, optimize
+from snapshots import PORTFOLIOS_SQL, current_bucket_values, ips_bucket_targets, load_holdings
+from metrics import span
 import json
 
+DEFAULT_CONTRIBUTION = 500
+
+ACTIVE_IPS_SQL = text("""
+    SELECT ipv.config, ipv.id
+    FROM ips_policy ip
+    JOIN ips_policy_version ipv ON ip.id = ipv."policyId"
+    WHERE ip."userId" = :user_id AND ipv."isActive" = true
+    LIMIT 1
+""")
+TOP_ETFS_SQL = text("""
+    SELECT sr."instrumentId", i.ticker, i.name, i.type, sr.score, sr.breakdown, i.category
+    FROM etf_scoring_result sr
+    JOIN instrument i ON sr."instrumentId" = i.id
+    WHERE sr."runId" = :run_id
+    ORDER BY sr.score DESC
+    LIMIT :max_instruments
+""")
+BATCH_USERS_SQL = text("""
+    SELECT DISTINCT ON (ip."userId") ip."userId", ipv.config,
+           (SELECT p.id FROM portfolio p WHERE p."userId" = ip."userId" LIMIT 1)
+    FROM ips_policy ip
+    JOIN ips_policy_version ipv ON ip.id = ipv."policyId"
+    WHERE ipv."isActive" = true AND ip."userId" > :after
+    ORDER BY ip."userId"
+    LIMIT :limit
+""")
+INSERT_PROPOSAL_SQL = text("""
+    INSERT INTO proposal
+    (id, "runId", "portfolioId", type, "proposalDate", "monthlyAmount", "targetAllocation", status, metadata)
+    VALUES (gen_random_uuid(), :run_id, (SELECT id FROM portfolio WHERE "userId" = :user_id LIMIT 1),
+            'MONTHLY_PAC', :proposal_date, :monthly_amount, CAST(:target_allocation AS jsonb), 'PENDING', CAST('{}' AS jsonb))
+    RETURNING id
+""")
+DELETE_PROPOSED_SQL = text("""
+    DELETE FROM proposed_instrument
+    WHERE "proposalId" IN (SELECT id FROM proposal WHERE "runId" = :run_id)
+""")
+DELETE_PROPOSAL_SQL = text('DELETE FROM proposal WHERE "runId" = :run_id')
+DELETE_BATCH_PROPOSED_SQL = text("""
+    DELETE FROM proposed_instrument
+    WHERE "proposalId" IN (SELECT id FROM proposal WHERE "runId" = ANY(:run_ids))
+""")
+DELETE_BATCH_PROPOSAL_SQL = text('DELETE FROM proposal WHERE "runId" = ANY(:run_ids)')
+PROPOSED_INSTRUMENT_INSERT = """
+    INSERT INTO proposed_instrument
+    (id, "proposalId", "instrumentId", "allocationPct", "allocationEur", score, metadata)
+"""
+PROPOSED_INSTRUMENT_VALUES = ("(gen_random_uuid(), :proposal_id, :instrument_id, :allocation_pct, :allocation_eur, "
+                              ":score, CAST(:metadata AS jsonb))")
+
 def run_pac(db: Session, run_id: str, user_id: str):
     """
     Execute PAC (Piano di Accumulo Capitale) proposal generation
@@ -13,40 +69,28 @@ def run_pac(db: Session, run_id: str, user_id: str):
 
     # Get user's IPS policy
     ips_result = db.execute(
-        text("""
-        SELECT ipv.config, ipv.id
-        FROM ips_policy ip
-        JOIN ips_policy_version ipv ON ip.id = ipv."policyId"
-        WHERE ip."userId" = :user_id AND ipv."isActive" = true
-        LIMIT 1
-        """),
+        ACTIVE_IPS_SQL,
         {"user_id": user_id}
     ).fetchone()
 
     if not ips_result:
         print("⚠️ No active IPS found, using default settings")
-        monthly_contribution = 500
-        target_allocation = {"equity": 80, "bonds": 20, "cash": 0}
+        monthly_contribution = DEFAULT_CONTRIBUTION
+        target_allocation = DEFAULT_ALLOCATION
     else:
         config = ips_result[0]
-        monthly_contribution = config.get("monthlyContribution", 500)
-        target_allocation = config.get("assetAllocation", {"equity": 80, "bonds": 20, "cash": 0})
+        monthly_contribution = config.get("monthlyContribution", DEFAULT_CONTRIBUTION)
+        target_allocation = config.get("assetAllocation", DEFAULT_ALLOCATION)
 
     print(f"  Monthly contribution: €{monthly_contribution}")
     print(f"  Target allocation: {target_allocation}")
 
-    # Get top scoring ETFs from latest scoring run
-    top_etfs = db.execute(
-        text("""
-        SELECT sr."instrumentId", i.ticker, i.name, i.type, sr.score, sr.breakdown
-        FROM etf_scoring_result sr
-        JOIN instrument i ON sr."instrumentId" = i.id
-        WHERE sr."runId" = :run_id
-        ORDER BY sr.score DESC
-        LIMIT :max_instruments
-        """),
-        {"run_id": run_id, "max_instruments": settings.pac_max_instruments}
-    ).fetchall()
+    method = _ips_method(ips_result[0] if ips_result else None)
+
+    # Get top scoring ETFs from latest scoring run; optimizers choose among a wider candidate set
+    candidates = settings.pac_max_instruments if method == "score" else settings.pac_optimizer_candidates
+    with span("pac_load"):
+        top_etfs = _load_top_etfs(db, run_id, candidates)
 
     if not top_etfs:
         print("⚠️ No scoring results found for this run")
@@ -54,56 +98,28 @@ def run_pac(db: Session, run_id: str, user_id: str):
 
     print(f"  Found {len(top_etfs)} top-scoring ETFs")
 
-    # Calculate allocations
-    total_score = sum(etf[4] for etf in top_etfs)  # score is at index 4
-    proposals = []
-
-    for etf in top_etfs:
-        instrument_id, ticker, name, etf_type, score_val, breakdown_json = etf
-
-        # Parse breakdown JSON
-        breakdown = json.loads(breakdown_json) if isinstance(breakdown_json, str) else breakdown_json
-
-        # Allocate proportionally to score
-        allocation_pct = (score_val / total_score) * 100
-        allocation_eur = (allocation_pct / 100) * monthly_contribution
-
-        # Apply minimum allocation threshold
-        if allocation_pct < settings.pac_min_allocation_pct:
-            continue
+    with span("pac_allocate", method=method):
+        if method == "score":
+            proposals = _score_proposals(top_etfs, monthly_contribution)
+        else:
+            proposals = _optimized_proposals(db, top_etfs, method, target_allocation, monthly_contribution)
 
-        proposals.append({
-            "instrument_id": instrument_id,
-            "ticker": ticker,
-            "name": name,
-            "allocation_pct": round(allocation_pct, 2),
-            "allocation_eur": round(allocation_eur, 2),
-            "score": score_val,
-            "metrics": {
-                "performance": breakdown.get('performance', 0),
-                "volatility": breakdown.get('volatility', 0),
-                "sharpe": breakdown.get('sharpe', 0),
-                "drawdown": breakdown.get('drawdown', 0)
-            }
-        })
+    print(f"  Generated {len(proposals)} proposals")
 
-    # Normalize allocations to 100%
-    total_allocation_pct = sum(p["allocation_pct"] for p in proposals)
-    for p in proposals:
-        p["allocation_pct"] = round((p["allocation_pct"] / total_allocation_pct) * 100, 2)
-        p["allocation_eur"] = round((p["allocation_pct"] / 100) * monthly_contribution, 2)
+    with span("pac_write", instruments=len(proposals)):
+        pac_id = _save_proposal(db, run_id, user_id, monthly_contribution, target_allocation, proposals)
+    print(f"✅ PAC proposal created: {pac_id}")
 
-    print(f"  Generated {len(proposals)} proposals")
+def _save_proposal(db: Session, run_id: str, user_id: str, monthly_contribution: float,
+                   target_allocation: dict, proposals: list) -> str:
+    """Replace the run's proposal with one holding the given instruments; returns its id"""
+    # Replayed jobs replace the run's previous proposal instead of duplicating it
+    db.execute(DELETE_PROPOSED_SQL, {"run_id": run_id})
+    db.execute(DELETE_PROPOSAL_SQL, {"run_id": run_id})
 
     # Save PAC proposal
     pac_id = db.execute(
-        text("""
-        INSERT INTO proposal
-        (id, "runId", "portfolioId", type, "proposalDate", "monthlyAmount", "targetAllocation", status, metadata)
-        VALUES (gen_random_uuid(), :run_id, (SELECT id FROM portfolio WHERE "userId" = :user_id LIMIT 1),
-                'MONTHLY_PAC', :proposal_date, :monthly_amount, CAST(:target_allocation AS jsonb), 'PENDING', CAST('{}' AS jsonb))
-        RETURNING id
-        """),
+        INSERT_PROPOSAL_SQL,
         {
             "run_id": run_id,
             "user_id": user_id,
@@ -114,13 +130,11 @@ def run_pac(db: Session, run_id: str, user_id: str):
     ).scalar()
 
     # Save proposed instruments
-    for proposal in proposals:
-        db.execute(
-            text("""
-            INSERT INTO proposed_instrument
-            (id, "proposalId", "instrumentId", "allocationPct", "allocationEur", score, metadata)
-            VALUES (gen_random_uuid(), :proposal_id, :instrument_id, :allocation_pct, :allocation_eur, :score, CAST(:metadata AS jsonb))
-            """),
+    insert_values(
+        db,
+        PROPOSED_INSTRUMENT_INSERT,
+        PROPOSED_INSTRUMENT_VALUES,
+        [
             {
                 "proposal_id": pac_id,
                 "instrument_id": proposal["instrument_id"],
@@ -129,9 +143,425 @@ def run_pac(db: Session, run_id: str, user_id: str):
                 "score": proposal["score"],
                 "metadata": json.dumps(proposal["metrics"])
             }
-        )
-
+            for proposal in proposals
+        ]
+    )
+    for proposal in proposals:
         print(f"    {proposal['ticker']}: {proposal['allocation_pct']}% (€{proposal['allocation_eur']})")
 
     db.commit()
-    print(f"✅ PAC proposal created: {pac_id}")
+    return pac_id
+
+def _proposal(etf, allocation_pct: float, allocation_eur: float) -> dict:
+    instrument_id, ticker, name, etf_type, score_val, breakdown_json = etf[:6]
+
+    # Parse breakdown JSON
+    breakdown = json.loads(breakdown_json) if isinstance(breakdown_json, str) else breakdown_json
+
+    return {
+        "instrument_id": instrument_id,
+        "ticker": ticker,
+        "name": name,
+        "allocation_pct": allocation_pct,
+        "allocation_eur": allocation_eur,
+        "score": score_val,
+        "metrics": {
+            "performance": breakdown.get('performance', 0),
+            "volatility": breakdown.get('volatility', 0),
+            "sharpe": breakdown.get('sharpe', 0),
+            "drawdown": breakdown.get('drawdown', 0)
+        }
+    }
+
+def _score_proposals(top_etfs: list, monthly_contribution: float) -> list:
+    """Allocate proportionally to score, drop small allocations and normalize to 100%"""
+    scores = [etf[4] for etf in top_etfs]  # score is at index 4
+    total_score = sum(scores)
+    if not total_score > 0:
+        # Equal weights, as in allocation_weights
+        scores, total_score = [1] * len(top_etfs), len(top_etfs)
+    proposals = []
+
+    for etf, score in zip(top_etfs, scores):
+        # Allocate proportionally to score
+        allocation_pct = (score / total_score) * 100
+        allocation_eur = (allocation_pct / 100) * monthly_contribution
+
+        # Apply minimum allocation threshold
+        if allocation_pct < settings.pac_min_allocation_pct:
+            continue
+
+        proposals.append(_proposal(etf, round(allocation_pct, 2), round(allocation_eur, 2)))
+
+    # Normalize allocations to 100%
+    total_allocation_pct = sum(p["allocation_pct"] for p in proposals)
+    for p in proposals:
+        p["allocation_pct"] = round((p["allocation_pct"] / total_allocation_pct) * 100, 2)
+        p["allocation_eur"] = round((p["allocation_pct"] / 100) * monthly_contribution, 2)
+    return proposals
+
+def _optimized_proposals(db: Session, top_etfs: list, method: str, target_allocation: dict,
+                         monthly_contribution: float) -> list:
+    """Allocate with one of the optimizer methods over the candidate ETFs"""
+    weights = _optimized_weights(db, top_etfs, method, target_allocation)
+    print(f"  Optimizer: {method}")
+
+    return [
+        _proposal(etf, round(weight * 100, 2), round(weight * monthly_contribution, 2))
+        for etf, weight in zip(top_etfs, weights)
+        if weight > 0
+    ]
+
+def _optimized_weights(db: Session, top_etfs: list, method: str, target_allocation: dict) -> np.ndarray:
+    instrument_ids = [etf[0] for etf in top_etfs]
+    buckets = [instrument_bucket(etf[3], etf[6]) for etf in top_etfs]
+    mu, cov = estimate_covariance(db, instrument_ids)
+    return optimize(method, buckets, target_allocation, mu, cov,
+                    warm_key=(method, tuple(instrument_ids)))
+
+def _ips_method(config: dict) -> str:
+    """Allocation method of an IPS config: its optimizer setting, else pac_optimizer"""
+    return (config or {}).get("optimizer", settings.pac_optimizer)
+
+def _load_top_etfs(db: Session, run_id: str, limit: int = None) -> list:
+    return db.execute(
+        TOP_ETFS_SQL,
+        {"run_id": run_id, "max_instruments": limit or settings.pac_max_instruments}
+    ).fetchall()
+
+def allocation_weights(scores: np.ndarray, min_allocation_pct: float = None) -> np.ndarray:
+    """
+    Allocation percentages for a set of scores, with the same rule as run_pac:
+    proportional to score, instruments under pac_min_allocation_pct dropped,
+    the rest normalized to 100%. Dropped instruments get 0. Without a positive
+    total score there is nothing to be proportional to: equal weights.
+    """
+    if min_allocation_pct is None:
+        min_allocation_pct = settings.pac_min_allocation_pct
+    scores = np.asarray(scores, dtype=np.float64)
+    total = scores.sum()
+    if not total > 0:
+        scores, total = np.ones_like(scores), len(scores)
+    raw = scores / total * 100
+    pct = np.round(raw, 2)
+    keep = raw >= min_allocation_pct
+    weights = np.zeros_like(pct)
+    if keep.any():
+        weights[keep] = np.round(pct[keep] / pct[keep].sum() * 100, 2)
+    return weights
+
+def run_pac_batch(db: Session, run_id: str, chunk_size: int = None) -> int:
+    """
+    Generate PAC proposals for every user with an active IPS from one scoring run.
+    Each IPS is allocated with its own method, as in run_pac (optimizer
+    setting, else pac_optimizer). Users sharing a method and, for the
+    optimizers, a target allocation share one set of weights, computed once
+    per batch; users are streamed in chunks (keyset pagination on userId) and
+    each group's euro amounts are a single (users x instruments) product
+    written with multi-row inserts. Each user's proposal is attached to its
+    own engine_run (runId "<run_id>:<user_id>"), since a proposal belongs to
+    exactly one run. Returns the number of proposals written.
+    """
+    chunk_size = chunk_size or settings.pac_batch_chunk_size
+    print(f"💰 Starting batch PAC engine for run {run_id}")
+
+    # The score rule's top-N is a prefix of the optimizers' candidate set
+    top_etfs = _load_top_etfs(db, run_id, max(settings.pac_max_instruments, settings.pac_optimizer_candidates))
+    if not top_etfs:
+        print("⚠️ No scoring results found for this run")
+        return 0
+
+    allocations = {}
+    written = 0
+    after = ""
+    while True:
+        users = db.execute(
+            BATCH_USERS_SQL,
+            {"after": after, "limit": chunk_size}
+        ).fetchall()
+        if not users:
+            break
+        after = users[-1][0]
+
+        with span("pac_allocate", users=len(users)):
+            groups = _group_by_allocation(db, top_etfs, users, allocations)
+        with span("pac_write", users=len(users)):
+            for key, group in groups.items():
+                written += _write_pac_chunk(db, run_id, group, *allocations[key])
+        print(f"  Wrote {written} proposals")
+
+    print(f"✅ Batch PAC completed: {written} proposals")
+    return written
+
+def _group_by_allocation(db: Session, top_etfs: list, users: list, allocations: dict) -> dict:
+    """
+    Users (with a portfolio) grouped by allocation key. allocations maps each
+    key to (method, selected ETFs, instrument metadata, shares summing to 1)
+    and is filled in for keys not seen before in the batch.
+    """
+    groups = {}
+    for user in users:
+        if user[2] is None:
+            continue
+        config = user[1] or {}
+        method = _ips_method(config)
+        target_allocation = config.get("assetAllocation", DEFAULT_ALLOCATION)
+        key = (method,) if method == "score" else (method, json.dumps(target_allocation, sort_keys=True))
+        if key not in allocations:
+            if method == "score":
+                candidates = top_etfs[:settings.pac_max_instruments]
+                shares = allocation_weights([etf[4] for etf in candidates]) / 100
+            else:
+                candidates = top_etfs[:settings.pac_optimizer_candidates]
+                shares = _optimized_weights(db, candidates, method, target_allocation)
+            selected = [(etf, share) for etf, share in zip(candidates, shares) if share > 0]
+            allocations[key] = (
+                method,
+                [etf for etf, _ in selected],
+                [_instrument_metadata(etf) for etf, _ in selected],
+                np.array([share for _, share in selected], dtype=np.float64),
+            )
+            print(f"  {method}: allocating across {len(selected)} ETFs: "
+                  + ", ".join(f"{etf[1]} {round(share * 100, 2)}%" for etf, share in selected))
+        groups.setdefault(key, []).append(user)
+    return groups
+
+def drift_bucket_weights(top_etfs: list) -> tuple:
+    """
+    (selected ETFs, (buckets x selected) weights) for drift-correcting PAC:
+    each bucket's money goes to its pac_max_instruments best-scoring ETFs
+    with the allocation_weights rule, so every row sums to 1, or to 0 for a
+    bucket without scored ETFs
+    """
+    buckets = np.array([BUCKETS.index(instrument_bucket(etf[3], etf[6])) for etf in top_etfs])
+    scores = np.array([etf[4] for etf in top_etfs], dtype=np.float64)
+    selected, columns = [], []
+    for b in range(len(BUCKETS)):
+        idx = np.flatnonzero(buckets == b)[:settings.pac_max_instruments]
+        if not len(idx):
+            continue
+        weights = allocation_weights(scores[idx]) / 100
+        for i, weight in zip(idx, weights):
+            if weight > 0:
+                selected.append(top_etfs[i])
+                columns.append((b, weight))
+    bucket_weights = np.zeros((len(BUCKETS), len(selected)))
+    for j, (b, weight) in enumerate(columns):
+        bucket_weights[b, j] = weight
+    return selected, bucket_weights
+
+def drift_contributions(bucket_values: np.ndarray, targets: np.ndarray, contributions: np.ndarray,
+                        available: np.ndarray) -> np.ndarray:
+    """
+    Split each portfolio's contribution over the buckets, underweight buckets first.
+    bucket_values: (portfolios x buckets) current EUR values, targets: (portfolios x buckets)
+    target weights, available: buckets that can receive money. Each bucket gets its share of
+    the gaps between its target value after the contribution and its current value; those gaps
+    add up to at least the contribution, so overweight buckets receive nothing. Portfolios
+    already on target split by target weight. Returns (portfolios x buckets) EUR amounts.
+    """
+    totals = bucket_values.sum(axis=1) + contributions
+    gaps = np.maximum(targets * totals[:, None] - bucket_values, 0) * available
+    fallback = targets * available
+    fallback = np.where(fallback.sum(axis=1, keepdims=True) > 0, fallback, available.astype(np.float64))
+    fallback = fallback / fallback.sum(axis=1, keepdims=True)
+    gap_total = gaps.sum(axis=1, keepdims=True)
+    shares = np.divide(gaps, gap_total, out=fallback, where=gap_total > 0)
+    return shares * contributions[:, None]
+
+def run_pac_drift_batch(db: Session, run_id: str, chunk_size: int = None) -> int:
+    """
+    Drift-correcting PAC proposals for every portfolio whose user has an
+    active IPS, from one scoring run. Current holdings (rebuilt from
+    transactions and valued at the latest close, see snapshots) are grouped
+    into the IPS assetAllocation buckets by instrument category, and each
+    contribution goes to the underweight buckets first (drift_contributions),
+    then to the bucket's top-scoring ETFs (drift_bucket_weights). Portfolios
+    are streamed in chunks; each chunk costs the same few queries and one
+    (portfolios x buckets) @ (buckets x ETFs) product whatever its size.
+    Each proposal is attached to its own engine_run ("<run_id>:<portfolio_id>").
+    Returns the number of proposals written.
+    """
+    chunk_size = chunk_size or settings.pac_batch_chunk_size
+    print(f"💰 Starting drift-correcting batch PAC engine for run {run_id}")
+
+    top_etfs = _load_top_etfs(db, run_id, settings.pac_optimizer_candidates)
+    selected, bucket_weights = drift_bucket_weights(top_etfs)
+    if not selected:
+        print("⚠️ No scoring results found for this run")
+        return 0
+    available = bucket_weights.sum(axis=1) > 0
+    instrument_metadata = [_instrument_metadata(etf) for etf in selected]
+    print(f"  Allocating across {len(selected)} ETFs in buckets "
+          + ", ".join(b for b, ok in zip(BUCKETS, available) if ok))
+
+    written = 0
+    after = ""
+    while True:
+        portfolios = db.execute(
+            PORTFOLIOS_SQL,
+            {"user_id": None, "after": after, "limit": chunk_size}
+        ).fetchall()
+        if not portfolios:
+            break
+        after = portfolios[-1][0]
+        portfolios = [p for p in portfolios if p[2] is not None]
+        if not portfolios:
+            continue
+
+        with span("pac_load", portfolios=len(portfolios)):
+            holdings = load_holdings(db, [p[0] for p in portfolios])
+            held = current_bucket_values(db, holdings)
+
+        with span("pac_allocate", method="drift"):
+            row = {portfolio_id: k for k, portfolio_id in enumerate(holdings.portfolio_ids)}
+            bucket_values = np.zeros((len(portfolios), len(BUCKETS)))
+            for k, (portfolio_id, _, _) in enumerate(portfolios):
+                if portfolio_id in row:
+                    bucket_values[k] = held[row[portfolio_id]]
+            targets = np.array([ips_bucket_targets(config) for _, _, config in portfolios])
+            contributions = np.array(
+                [config.get("monthlyContribution", DEFAULT_CONTRIBUTION) for _, _, config in portfolios],
+                dtype=np.float64
+            )
+            bucket_amounts = drift_contributions(bucket_values, targets, contributions, available)
+            amounts = np.round(bucket_amounts @ bucket_weights, 2)
+            pct = np.round(np.divide(amounts * 100, contributions[:, None], out=np.zeros_like(amounts),
+                                     where=contributions[:, None] > 0), 2)
+
+        with span("pac_write", portfolios=len(portfolios)):
+            written += _write_proposals(
+                db,
+                [
+                    {
+                        "run_id": f"{run_id}:{portfolio_id}",
+                        "user_id": user_id,
+                        "portfolio_id": portfolio_id,
+                        "monthly_amount": float(contributions[k]),
+                        "target_allocation": config.get("assetAllocation", DEFAULT_ALLOCATION),
+                        "input_params": {"batchRunId": run_id, "mode": "drift"},
+                        "metadata": _drift_metadata(bucket_values[k], bucket_amounts[k]),
+                    }
+                    for k, (portfolio_id, user_id, config) in enumerate(portfolios)
+                ],
+                selected, pct, amounts, instrument_metadata
+            )
+        print(f"  Wrote {written} proposals")
+
+    print(f"✅ Drift-correcting batch PAC completed: {written} proposals")
+    return written
+
+def _drift_metadata(bucket_values: np.ndarray, bucket_amounts: np.ndarray) -> dict:
+    total = bucket_values.sum()
+    return {
+        "mode": "drift",
+        "holdingsValueEur": round(float(total), 2),
+        "currentAllocation": {
+            b: round(float(v / total * 100), 2) if total > 0 else 0.0 for b, v in zip(BUCKETS, bucket_values)
+        },
+        "bucketContributions": {b: round(float(a), 2) for b, a in zip(BUCKETS, bucket_amounts)},
+    }
+
+def _instrument_metadata(etf) -> str:
+    breakdown = json.loads(etf[5]) if isinstance(etf[5], str) else etf[5]
+    return json.dumps({
+        "performance": breakdown.get('performance', 0),
+        "volatility": breakdown.get('volatility', 0),
+        "sharpe": breakdown.get('sharpe', 0),
+        "drawdown": breakdown.get('drawdown', 0)
+    })
+
+def _write_pac_chunk(db: Session, run_id: str, users: list, method: str, selected: list,
+                     instrument_metadata: list, shares: np.ndarray) -> int:
+    contributions = np.array(
+        [(config or {}).get("monthlyContribution", DEFAULT_CONTRIBUTION) for _, config, _ in users],
+        dtype=np.float64
+    )
+    # Rounded as in run_pac: percentages and euro amounts both from the unrounded share
+    amounts = np.round(np.outer(contributions, shares), 2)
+    proposals = [
+        {
+            "run_id": f"{run_id}:{user_id}",
+            "user_id": user_id,
+            "portfolio_id": portfolio_id,
+            "monthly_amount": float(contribution),
+            "target_allocation": (config or {}).get("assetAllocation", DEFAULT_ALLOCATION),
+            "input_params": {"batchRunId": run_id, "optimizer": method},
+            "metadata": {},
+        }
+        for (user_id, config, portfolio_id), contribution in zip(users, contributions)
+    ]
+    pct = np.broadcast_to(np.round(shares * 100, 2), amounts.shape)
+    return _write_proposals(db, proposals, selected, pct, amounts, instrument_metadata)
+
+def _write_proposals(db: Session, proposals: list, selected: list, pct: np.ndarray,
+                     amounts: np.ndarray, instrument_metadata: list) -> int:
+    """
+    Write batch proposals, each attached to its own completed engine_run.
+    proposals: dicts with run_id, user_id, portfolio_id, monthly_amount,
+    target_allocation, input_params and metadata; pct and amounts are
+    (proposals x selected ETFs), instruments with pct 0 are left out.
+    """
+    now = datetime.utcnow()
+    child_runs = [proposal["run_id"] for proposal in proposals]
+    proposal_ids = [str(uuid.uuid4()) for _ in proposals]
+
+    insert_values(
+        db,
+        """
+        INSERT INTO engine_run (id, "runId", "userId", type, status, "inputParams", "startedAt", "completedAt")
+        """,
+        "(gen_random_uuid(), :run_id, :user_id, 'completed', 'MONTHLY_PAC', CAST(:input_params AS jsonb), :now, :now)",
+        [
+            {"run_id": proposal["run_id"], "user_id": proposal["user_id"],
+             "input_params": json.dumps(proposal["input_params"]), "now": now}
+            for proposal in proposals
+        ],
+        suffix='ON CONFLICT ("runId") DO NOTHING'
+    )
+
+    # Replayed chunks replace the previous proposals instead of duplicating them
+    db.execute(DELETE_BATCH_PROPOSED_SQL, {"run_ids": child_runs})
+    db.execute(DELETE_BATCH_PROPOSAL_SQL, {"run_ids": child_runs})
+
+    insert_values(
+        db,
+        """
+        INSERT INTO proposal
+        (id, "runId", "portfolioId", type, "proposalDate", "monthlyAmount", "targetAllocation", status, metadata)
+        """,
+        "(:id, :run_id, :portfolio_id, 'MONTHLY_PAC', :proposal_date, :monthly_amount, "
+        "CAST(:target_allocation AS jsonb), 'PENDING', CAST(:metadata AS jsonb))",
+        [
+            {
+                "id": proposal_id,
+                "run_id": proposal["run_id"],
+                "portfolio_id": proposal["portfolio_id"],
+                "proposal_date": now,
+                "monthly_amount": proposal["monthly_amount"],
+                "target_allocation": json.dumps(proposal["target_allocation"]),
+                "metadata": json.dumps(proposal["metadata"])
+            }
+            for proposal_id, proposal in zip(proposal_ids, proposals)
+        ]
+    )
+
+    insert_values(
+        db,
+        PROPOSED_INSTRUMENT_INSERT,
+        PROPOSED_INSTRUMENT_VALUES,
+        [
+            {
+                "proposal_id": proposal_ids[u],
+                "instrument_id": selected[j][0],
+                "allocation_pct": float(pct[u, j]),
+                "allocation_eur": float(amounts[u, j]),
+                "score": selected[j][4],
+                "metadata": instrument_metadata[j]
+            }
+            for u, j in zip(*np.nonzero(pct > 0))
+        ]
+    )
+
+    db.commit()
+    return len(proposals)
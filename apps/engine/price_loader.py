@@ -0,0 +1,187 @@
+import io
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+
+PRICE_COLUMNS = ['instrumentId', 'date', 'open', 'high', 'low', 'close', 'volume']
+
+DEFAULT_CHUNK_SIZE = 500
+
+LATEST_DATES_SQL = text("""
+    SELECT "instrumentId", MAX(date)
+    FROM price_history
+    WHERE "instrumentId" IN :instrument_ids
+    GROUP BY "instrumentId"
+""").bindparams(bindparam("instrument_ids", expanding=True))
+PRICE_WINDOW_SQL = text("""
+    SELECT "instrumentId", date, open, high, low, close, volume
+    FROM price_history
+    WHERE "instrumentId" IN :instrument_ids
+      AND date >= :start_date
+      AND date <= :end_date
+""").bindparams(bindparam("instrument_ids", expanding=True))
+
+class PriceWindow:
+    """
+    Columnar price_history window for many instruments.
+    Rows are grouped by instrument (in the order requested) and sorted by date;
+    offsets[i]:offsets[i+1] is the row range of instrument_ids[i].
+    """
+
+    def __init__(self, instrument_ids: list, offsets: np.ndarray, dates: np.ndarray,
+                 open: np.ndarray, high: np.ndarray, low: np.ndarray,
+                 close: np.ndarray, volume: np.ndarray):
+        self.instrument_ids = list(instrument_ids)
+        self.offsets = offsets
+        self.dates = dates
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self._index = {instrument_id: i for i, instrument_id in enumerate(self.instrument_ids)}
+
+    def __len__(self):
+        return len(self.close)
+
+    def count(self, instrument_id: str) -> int:
+        i = self._index.get(instrument_id)
+        if i is None:
+            return 0
+        return int(self.offsets[i + 1] - self.offsets[i])
+
+    def rows(self, instrument_id: str) -> slice:
+        i = self._index[instrument_id]
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def slice(self, instrument_id: str) -> dict:
+        """Return views (no copy) of every column for one instrument"""
+        sl = self.rows(instrument_id)
+        return {
+            'date': self.dates[sl],
+            'open': self.open[sl],
+            'high': self.high[sl],
+            'low': self.low[sl],
+            'close': self.close[sl],
+            'volume': self.volume[sl],
+        }
+
+    def close_series(self, instrument_id: str) -> pd.Series:
+        """Close prices for one instrument as a Series backed by the window arrays"""
+        sl = self.rows(instrument_id)
+        return pd.Series(self.close[sl], index=pd.DatetimeIndex(self.dates[sl]), name='Close', copy=False)
+
+    def close_matrix(self, instrument_ids: list = None) -> tuple:
+        """
+        Build an aligned (dates x instruments) close matrix, NaN where an
+        instrument has no bar for a date
+        """
+        instrument_ids = self.instrument_ids if instrument_ids is None else instrument_ids
+        idx = np.array([self._index[i] for i in instrument_ids], dtype=np.int64)
+        counts = self.offsets[idx + 1] - self.offsets[idx]
+        rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in idx]) \
+            if len(idx) else np.empty(0, dtype=np.int64)
+        cols = np.repeat(np.arange(len(idx)), counts)
+
+        all_dates, date_pos = np.unique(self.dates[rows], return_inverse=True)
+        matrix = np.full((len(all_dates), len(idx)), np.nan)
+        matrix[date_pos, cols] = self.close[rows]
+        return pd.DatetimeIndex(all_dates), matrix
+
+def load_price_window(db: Session, instrument_ids: list, start_date: datetime, end_date: datetime,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> PriceWindow:
+    """
+    Load price_history for many instruments in a few chunked queries.
+    Uses COPY ... TO STDOUT on PostgreSQL and a streamed query elsewhere.
+    """
+    instrument_ids = list(instrument_ids)
+    frames = []
+    for i in range(0, len(instrument_ids), chunk_size):
+        chunk = instrument_ids[i:i + chunk_size]
+        raw = db.connection().connection
+        cursor = raw.cursor()
+        try:
+            if hasattr(cursor, 'copy_expert'):
+                frames.append(_copy_chunk(cursor, chunk, start_date, end_date))
+            else:
+                frames.append(_stream_chunk(db, chunk, start_date, end_date))
+        finally:
+            cursor.close()
+
+    return _build_window(instrument_ids, frames)
+
+def latest_price_dates(db: Session, instrument_ids: list) -> dict:
+    """Most recent price_history date per instrument, in one query"""
+    if not instrument_ids:
+        return {}
+    rows = db.execute(
+        LATEST_DATES_SQL,
+        {"instrument_ids": instrument_ids}
+    ).fetchall()
+    return {instrument_id: pd.Timestamp(last_date).date() for instrument_id, last_date in rows}
+
+def _copy_chunk(cursor, instrument_ids: list, start_date: datetime, end_date: datetime) -> pd.DataFrame:
+    query = cursor.mogrify(
+        """
+        SELECT "instrumentId", date, open, high, low, close, volume
+        FROM price_history
+        WHERE "instrumentId" = ANY(%s)
+          AND date >= %s
+          AND date <= %s
+        """,
+        (instrument_ids, start_date, end_date)
+    ).decode()
+
+    buffer = io.StringIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV", buffer)
+    buffer.seek(0)
+    return pd.read_csv(
+        buffer,
+        names=PRICE_COLUMNS,
+        dtype={'instrumentId': str, 'open': np.float64, 'high': np.float64, 'low': np.float64,
+               'close': np.float64, 'volume': np.float64},
+        parse_dates=['date'],
+    )
+
+def _stream_chunk(db: Session, instrument_ids: list, start_date: datetime, end_date: datetime,
+                  partition_size: int = 10000) -> pd.DataFrame:
+    result = db.execute(
+        PRICE_WINDOW_SQL,
+        {"instrument_ids": instrument_ids, "start_date": start_date, "end_date": end_date},
+        execution_options={"stream_results": True}
+    )
+    parts = [pd.DataFrame(rows, columns=PRICE_COLUMNS) for rows in result.partitions(partition_size)]
+    if not parts:
+        return pd.DataFrame(columns=PRICE_COLUMNS)
+    df = pd.concat(parts, ignore_index=True)
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+def _build_window(instrument_ids: list, frames: list) -> PriceWindow:
+    frames = [f for f in frames if len(f)]
+    if frames:
+        df = pd.concat(frames, ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=PRICE_COLUMNS)
+
+    codes = pd.Categorical(df['instrumentId'], categories=instrument_ids).codes.astype(np.int64)
+    dates = pd.to_datetime(df['date']).to_numpy(dtype='datetime64[ns]')
+    order = np.lexsort((dates, codes))
+    codes = codes[order]
+    offsets = np.searchsorted(codes, np.arange(len(instrument_ids) + 1))
+
+    def column(name):
+        return pd.to_numeric(df[name]).to_numpy(dtype=np.float64)[order]
+
+    return PriceWindow(
+        instrument_ids,
+        offsets,
+        dates[order],
+        column('open'),
+        column('high'),
+        column('low'),
+        column('close'),
+        column('volume'),
+    )
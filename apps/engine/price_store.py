@@ -0,0 +1,311 @@
+"""
+Local memory-mapped columnar copy of price_history.
+
+Each column (open, high, low, close, volume) is a .npy file laid out as
+(instrument, date) with spare date capacity, plus a shared int64 date axis and
+a small meta.json. Readers map the files read-only, so every worker process
+shares the same page cache and slicing an instrument or a date range copies
+nothing. Every read first checks freshness with one aggregate over
+price_history (newest date, row counts); only when it doesn't match the store
+does it take the write lock. New bars, and late bars for the last
+PRICE_STORE_RESYNC_DAYS, are written in place (new dates into the spare
+columns); the files are rewritten (as a new version, swapped in through
+meta.json) when the instruments or the older history changed (backfills,
+deletions), the capacity runs out, or the store is older than
+PRICE_STORE_REBUILD_HOURS, which also picks up corrected bars.
+"""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from config import settings
+from price_loader import PriceWindow, load_price_window
+
+COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+INSTRUMENT_IDS_SQL = text("SELECT id FROM instrument ORDER BY id")
+# What the store must match: instruments, newest bar, rows since its start and in the trailing window
+FRESHNESS_SQL = text("""
+    SELECT (SELECT COUNT(*) FROM instrument), MAX(date), COUNT(*),
+           COALESCE(SUM(CASE WHEN date >= :since THEN 1 ELSE 0 END), 0)
+    FROM price_history
+    WHERE date >= :start
+""")
+
+class PriceStore:
+    """Read-only view of one version of the store"""
+
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+        self.version = meta['version']
+        self.instrument_ids = meta['instrument_ids']
+        self.index = {instrument_id: i for i, instrument_id in enumerate(self.instrument_ids)}
+        n_dates = meta['dates']
+        self.dates = np.load(_file(path, 'dates', self.version), mmap_mode='r')[:n_dates]
+        self.columns = {
+            column: np.load(_file(path, column, self.version), mmap_mode='r')[:, :n_dates]
+            for column in COLUMNS
+        }
+
+    def __len__(self):
+        return len(self.dates)
+
+    def date_range(self, start_date, end_date) -> slice:
+        # Same bounds as "date >= start AND date <= end" against timestamps:
+        # a start with a time of day excludes its own date
+        start = _day(start_date)
+        if isinstance(start_date, datetime) and start_date.time() != datetime.min.time():
+            start += 1
+        return slice(int(np.searchsorted(self.dates, start, side='left')),
+                     int(np.searchsorted(self.dates, _day(end_date), side='right')))
+
+    def matrix(self, column: str, instrument_ids: list = None, start_date=None, end_date=None) -> tuple:
+        """
+        (dates, instruments x dates array) for one column, NaN where there is
+        no bar. A view on the mapped file when instrument_ids is None.
+        """
+        sl = self.date_range(start_date or date.min, end_date or date.max)
+        data = self.columns[column][:, sl]
+        if instrument_ids is not None:
+            data = data[[self.index[i] for i in instrument_ids]]
+        return (_EPOCH + self.dates[sl]).astype('datetime64[ns]'), data
+
+    def window(self, instrument_ids: list, start_date, end_date) -> PriceWindow:
+        """The same PriceWindow load_price_window would return, gathered from the mapped columns"""
+        sl = self.date_range(start_date, end_date)
+        known = [self.index[i] for i in instrument_ids if i in self.index]
+        rows = np.array([self.index.get(i, -1) for i in instrument_ids])
+
+        close = np.full((len(instrument_ids), sl.stop - sl.start), np.nan)
+        close[rows >= 0] = self.columns['close'][known, sl]
+        valid = ~np.isnan(close)
+        offsets = np.concatenate([[0], np.cumsum(valid.sum(axis=1))])
+        day_index = np.broadcast_to(np.arange(sl.start, sl.stop), close.shape)[valid]
+
+        def column(name):
+            if name == 'close':
+                return close[valid]
+            data = np.full(close.shape, np.nan)
+            data[rows >= 0] = self.columns[name][known, sl]
+            return data[valid]
+
+        return PriceWindow(
+            instrument_ids,
+            offsets,
+            (_EPOCH + self.dates[day_index]).astype('datetime64[ns]'),
+            column('open'),
+            column('high'),
+            column('low'),
+            close[valid],
+            column('volume'),
+        )
+
+def open_store(path: str = None) -> PriceStore:
+    """Map the current version of the store, or None if it was never built"""
+    path = path or settings.price_store_dir
+    for _ in range(3):
+        meta = _read_meta(path)
+        if meta is None:
+            return None
+        try:
+            return PriceStore(path, meta)
+        except FileNotFoundError:
+            # A rebuild swapped versions between reading meta.json and mapping the files
+            continue
+    return None
+
+def sync_store(db: Session, path: str = None) -> PriceStore:
+    """Bring the store up to date with price_history and return it"""
+    path = path or settings.price_store_dir
+    os.makedirs(path, exist_ok=True)
+
+    store = open_store(path)
+    action, _ = _check(db, store)
+    if action is None:
+        return store
+
+    with _write_lock(path):
+        # Another process may have synced while we waited for the lock
+        store = open_store(path)
+        action, newest = _check(db, store)
+        if action == 'rebuild':
+            instrument_ids = [row[0] for row in db.execute(INSTRUMENT_IDS_SQL).fetchall()]
+            return PriceStore(path, _rebuild(db, path, instrument_ids, newest, store and store.meta))
+        if action == 'resync':
+            return PriceStore(path, _resync(db, path, store, newest))
+        return store
+
+def _check(db: Session, store: PriceStore) -> tuple:
+    """
+    (action, newest bar in price_history): action is None when the store
+    matches price_history, 'resync' when only the trailing window changed,
+    'rebuild' otherwise
+    """
+    if store is None or 'rows' not in store.meta:
+        _, newest, _, _ = db.execute(FRESHNESS_SQL, {"start": date.min, "since": date.max}).one()
+        return 'rebuild', _as_date(newest) or date.today()
+
+    meta = store.meta
+    synced_through = date.fromisoformat(meta['synced_through'])
+    since = synced_through - timedelta(days=settings.price_store_resync_days)
+    instruments, newest, rows, trailing = db.execute(
+        FRESHNESS_SQL, {"start": date.fromisoformat(meta['start']), "since": since}
+    ).one()
+    newest = _as_date(newest) or synced_through
+    stored_trailing = _stored_rows(store, since)
+
+    if datetime.fromisoformat(meta['built_at']) < datetime.utcnow() - timedelta(hours=settings.price_store_rebuild_hours) \
+            or instruments != len(meta['instrument_ids']) \
+            or rows - trailing != meta['rows'] - stored_trailing \
+            or trailing < stored_trailing:
+        return 'rebuild', max(newest, synced_through)
+    if newest > synced_through or trailing != stored_trailing:
+        return 'resync', newest
+    return None, newest
+
+def load_window(db: Session, instrument_ids: list, start_date, end_date) -> PriceWindow:
+    """
+    Price window for the given instruments: from the synced store when it is
+    enabled and holds the range, straight from price_history otherwise or if
+    the store fails
+    """
+    history_start = date.today() - timedelta(days=settings.price_store_history_days)
+    if settings.price_store_enabled and _day(start_date) >= _day(history_start):
+        try:
+            return sync_store(db).window(instrument_ids, start_date, end_date)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"  ⚠️ Price store unavailable ({e}), reading from database")
+    return load_price_window(db, instrument_ids, start_date, end_date)
+
+def _rebuild(db: Session, path: str, instrument_ids: list, newest: date, old_meta: dict) -> dict:
+    start = newest - timedelta(days=settings.price_store_history_days)
+    window = load_price_window(db, instrument_ids, start, newest)
+    days = _days(window.dates)
+    unique_days, day_pos = np.unique(days, return_inverse=True)
+    rows = np.repeat(np.arange(len(instrument_ids)), np.diff(window.offsets))
+
+    version = (old_meta['version'] + 1) if old_meta else 1
+    capacity = len(unique_days) + settings.price_store_spare_days
+    dates_file = np.lib.format.open_memmap(_file(path, 'dates', version), mode='w+',
+                                           dtype=np.int64, shape=(capacity,))
+    dates_file[:len(unique_days)] = unique_days
+    dates_file.flush()
+    for column in COLUMNS:
+        data = np.lib.format.open_memmap(_file(path, column, version), mode='w+',
+                                         dtype=np.float64, shape=(len(instrument_ids), capacity))
+        data[:] = np.nan
+        data[rows, day_pos] = getattr(window, column)
+        data.flush()
+
+    meta = {
+        'version': version,
+        'instrument_ids': instrument_ids,
+        'dates': len(unique_days),
+        'capacity': capacity,
+        'built_at': datetime.utcnow().isoformat(),
+        'start': start.isoformat(),
+        'synced_through': newest.isoformat(),
+        'rows': len(window),
+    }
+    _write_meta(path, meta)
+    if old_meta:
+        # Readers that still map the old files keep them alive until they let go
+        for name in ('dates',) + COLUMNS:
+            try:
+                os.remove(_file(path, name, old_meta['version']))
+            except FileNotFoundError:
+                pass
+    print(f"  🗄️ Price store rebuilt: {len(instrument_ids)} instruments x {len(unique_days)} days")
+    return meta
+
+def _resync(db: Session, path: str, store: PriceStore, newest: date) -> dict:
+    """Re-read the trailing window and everything after it, writing the bars in place"""
+    meta = store.meta
+    synced_through = date.fromisoformat(meta['synced_through'])
+    since = synced_through - timedelta(days=settings.price_store_resync_days)
+    instrument_ids = meta['instrument_ids']
+    # Counted before the writes below, which the mapped columns see
+    replaced = _stored_rows(store, since)
+    window = load_price_window(db, instrument_ids, since, max(newest, synced_through))
+    days = _days(window.dates)
+
+    # Late bars land in existing date columns, later ones in the spare columns
+    last_day = store.dates[-1] if len(store.dates) else np.iinfo(np.int64).min
+    later = days > last_day
+    new_days, new_pos = np.unique(days[later], return_inverse=True)
+    existing = np.searchsorted(store.dates, days[~later])
+    if meta['dates'] + len(new_days) > meta['capacity'] \
+            or np.any(store.dates[np.minimum(existing, len(store.dates) - 1)] != days[~later]):
+        # A late bar on a day no instrument had a bar for needs a new date column
+        return _rebuild(db, path, instrument_ids, max(newest, synced_through), meta)
+
+    rows = np.repeat(np.arange(len(instrument_ids)), np.diff(window.offsets))
+    cols = np.empty(len(days), dtype=np.int64)
+    cols[~later] = existing
+    cols[later] = meta['dates'] + new_pos
+
+    # Writes land past the published date count, which readers never look at
+    dates_file = np.load(_file(path, 'dates', meta['version']), mmap_mode='r+')
+    dates_file[meta['dates']:meta['dates'] + len(new_days)] = new_days
+    dates_file.flush()
+    for column in COLUMNS:
+        data = np.load(_file(path, column, meta['version']), mmap_mode='r+')
+        data[rows, cols] = getattr(window, column)
+        data.flush()
+
+    meta = dict(meta, dates=meta['dates'] + len(new_days),
+                synced_through=max(newest, synced_through).isoformat(),
+                rows=meta['rows'] - replaced + len(window))
+    _write_meta(path, meta)
+    print(f"  🗄️ Price store synced {len(window)} rows since {since} ({len(new_days)} new days)")
+    return meta
+
+def _stored_rows(store: PriceStore, since: date) -> int:
+    """Bars held by the store from since onwards"""
+    return int((~np.isnan(store.columns['close'][:, store.date_range(since, date.max)])).sum())
+
+def _file(path: str, name: str, version: int) -> str:
+    return os.path.join(path, f"{name}-{version}.npy")
+
+def _read_meta(path: str):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _write_meta(path: str, meta: dict):
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+@contextmanager
+def _write_lock(path: str):
+    with open(os.path.join(path, 'lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _as_date(value):
+    return pd.Timestamp(value).date() if value is not None else None
+
+def _days(dates: np.ndarray) -> np.ndarray:
+    return (dates.astype('datetime64[D]') - _EPOCH).astype(np.int64)
+
+def _day(value) -> int:
+    if value == date.min:
+        return np.iinfo(np.int64).min
+    if value == date.max:
+        return np.iinfo(np.int64).max
+    return int((np.datetime64(value, 'D') - _EPOCH).astype(np.int64))
@@ -0,0 +1,46 @@
+"""
+Run progress events.
+
+Engines append events to a Redis stream per run (aurora:run-progress:<runId>),
+so they reach the API process whichever worker runs the job, and a client that
+subscribes late still replays the run from its first event. Publishing is
+best-effort: a Redis outage never fails a run.
+"""
+import json
+import time
+import redis
+from config import settings
+from redis_client import get_redis
+
+STREAM_PREFIX = "aurora:run-progress"
+
+FINAL_STAGES = ("completed", "failed")
+
+def stream_key(run_id: str) -> str:
+    return f"{STREAM_PREFIX}:{run_id}"
+
+class RunProgress:
+    """Publish progress events for one run"""
+
+    def __init__(self, run_id: str, r=None):
+        self.run_id = run_id
+        self.r = r
+
+    def emit(self, stage: str, **fields):
+        self.emit_many([dict(fields, stage=stage)])
+
+    def emit_many(self, events: list):
+        if not self.run_id or not events:
+            return
+        try:
+            r = self.r or get_redis()
+            key = stream_key(self.run_id)
+            pipe = r.pipeline(transaction=False)
+            for event in events:
+                event = dict(event, runId=self.run_id, ts=time.time())
+                pipe.xadd(key, {"event": json.dumps(event, default=str)},
+                          maxlen=settings.progress_stream_max_events, approximate=True)
+            pipe.expire(key, settings.progress_stream_ttl_seconds)
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            print(f"  ⚠️ Could not publish progress for run {self.run_id}: {e}")
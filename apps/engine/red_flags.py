@@ -0,0 +1,142 @@
+"""
+Red flags on scoring results.
+
+Every rule is a vectorized predicate over one DataFrame with a row per
+instrument: the etf_metrics fundamentals joined with stats of the
+instrument's price_history over the scoring lookback window. All rules are
+evaluated for all instruments at once, so a new rule is a new entry in
+RULES (and, if it needs one, a new column in flag_frame), never a new query
+per instrument. Missing data never raises a flag: without an inceptionDate
+an instrument is never too_young (our first stored bar is not the fund's
+launch), and without any stored bar (e.g. scored on downloaded data) it is
+never stale_data.
+"""
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+from config import settings
+from price_loader import PriceWindow
+from price_store import load_window
+
+FLAG_METRICS_SQL = text("""
+    SELECT i.id, m.ter, m.aum, m."avgDailyVolume", m."avgSpread", m."trackingError", m."inceptionDate",
+           (SELECT MAX(ph.date) FROM price_history ph WHERE ph."instrumentId" = i.id)
+    FROM instrument i
+    LEFT JOIN etf_metrics m ON m."instrumentId" = i.id
+    WHERE i.id IN :instrument_ids
+""").bindparams(bindparam("instrument_ids", expanding=True))
+
+FLAG_METRICS_COLUMNS = ['ter', 'aum', 'avg_daily_volume', 'avg_spread', 'tracking_error',
+                        'inception_date', 'last_price_date']
+
+# code -> predicate over the flag frame (a boolean Series); thresholds are read at evaluation time
+RULES = {
+    "low_liquidity": lambda f: f['volume'] < settings.scoring_min_volume,
+    "too_young": lambda f: f['age_days'] < settings.scoring_min_age_days,
+    "high_ter": lambda f: f['ter'] > settings.red_flag_max_ter,
+    "small_fund": lambda f: f['aum'] < settings.red_flag_min_aum,
+    "wide_spread": lambda f: f['avg_spread'] > settings.red_flag_max_spread,
+    "high_tracking_error": lambda f: f['tracking_error'] > settings.red_flag_max_tracking_error,
+    "price_gaps": lambda f: f['max_gap_days'] > settings.red_flag_max_gap_days,
+    "price_jump": lambda f: f['max_daily_move'] > settings.red_flag_max_daily_move,
+    "stale_data": lambda f: f['stale_days'] > settings.red_flag_stale_days,
+}
+
+def detect_red_flags(db: Session, instrument_ids: list, window: PriceWindow = None) -> dict:
+    """
+    Red flag codes of every instrument ({instrument_id: [code, ...]}).
+    window: the instruments' lookback price window, loaded if not given.
+    """
+    if not instrument_ids:
+        return {}
+    frame = flag_frame(db, instrument_ids, window)
+    flags = evaluate_rules(frame)
+    counts = {code: int(flags[code].sum()) for code in RULES if flags[code].any()}
+    print(f"  🚩 Red flags: {counts or 'none'}")
+    codes = np.array(list(RULES))
+    return {instrument_id: list(codes[row]) for instrument_id, row in zip(frame.index, flags.to_numpy())}
+
+def evaluate_rules(frame: pd.DataFrame) -> pd.DataFrame:
+    """(instruments x rules) boolean frame, one column per RULES code"""
+    return pd.DataFrame(
+        {code: predicate(frame).fillna(False).astype(bool) for code, predicate in RULES.items()},
+        index=frame.index
+    )
+
+def flag_frame(db: Session, instrument_ids: list, window: PriceWindow = None, today: date = None) -> pd.DataFrame:
+    """
+    One row per instrument: etf_metrics fundamentals, price stats over the
+    lookback window (price_stats) and the derived columns the rules use
+    (volume, age_days since inception, stale_days since the last stored bar)
+    """
+    today = today or date.today()
+    if window is None:
+        end_date = datetime.now()
+        window = load_window(db, instrument_ids, end_date - timedelta(days=settings.scoring_lookback_days), end_date)
+
+    rows = db.execute(FLAG_METRICS_SQL, {"instrument_ids": list(instrument_ids)}).fetchall()
+    metrics = pd.DataFrame([row[1:] for row in rows], index=[row[0] for row in rows], columns=FLAG_METRICS_COLUMNS)
+    frame = price_stats(window, instrument_ids).join(metrics)
+
+    for column in FLAG_METRICS_COLUMNS[:5]:
+        frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    today_ts = pd.Timestamp(today)
+    frame['age_days'] = (today_ts - pd.to_datetime(frame['inception_date'])).dt.days
+    frame['volume'] = frame['avg_daily_volume'].fillna(frame['avg_volume'])
+    frame['stale_days'] = (today_ts - pd.to_datetime(frame['last_price_date'])).dt.days
+    return frame
+
+def price_stats(window: PriceWindow, instrument_ids: list) -> pd.DataFrame:
+    """
+    Per-instrument stats of a price window, computed over all rows at once:
+    bars, avg_volume, max_gap_days (calendar days between consecutive bars),
+    max_daily_move (largest close-to-close change, %) and last_bar_date
+    """
+    index = {instrument_id: i for i, instrument_id in enumerate(window.instrument_ids)}
+    n = len(window.instrument_ids)
+    starts, ends = window.offsets[:-1], window.offsets[1:]
+    bars = ends - starts
+    filled = np.flatnonzero(bars > 0)
+
+    days = np.asarray(window.dates).astype('datetime64[D]').astype(np.int64)
+    close = np.asarray(window.close, dtype=np.float64)
+    volume = np.asarray(window.volume, dtype=np.float64)
+    follows = np.ones(len(days), dtype=bool)
+    follows[starts[filled]] = False  # first bar of each instrument
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gap = np.where(follows, days - np.roll(days, 1), 0)
+        move = np.where(follows, np.abs(close / np.roll(close, 1) - 1) * 100, 0)
+    move = np.nan_to_num(move, nan=0.0, posinf=0.0)
+
+    max_gap = np.full(n, np.nan)
+    max_move = np.full(n, np.nan)
+    avg_volume = np.full(n, np.nan)
+    last_day = np.full(n, np.datetime64('NaT'), dtype='datetime64[D]')
+    if len(filled):
+        first = starts[filled]
+        max_gap[filled] = np.maximum.reduceat(gap, first)
+        max_move[filled] = np.maximum.reduceat(move, first)
+        known = ~np.isnan(volume)
+        volume_sum = np.add.reduceat(np.where(known, volume, 0), first)
+        volume_count = np.add.reduceat(known.astype(np.int64), first)
+        avg_volume[filled] = np.divide(volume_sum, volume_count, out=np.full(len(filled), np.nan),
+                                       where=volume_count > 0)
+        last_day[filled] = days[ends[filled] - 1].astype('datetime64[D]')
+
+    rows = [index.get(instrument_id, -1) for instrument_id in instrument_ids]
+    present = np.array([r >= 0 for r in rows], dtype=bool)
+    take = np.array([max(r, 0) for r in rows], dtype=np.int64)
+
+    def column(values):
+        values = values[take] if n else np.full(len(rows), np.nan, dtype=values.dtype)
+        return np.where(present, values, np.array(np.nan).astype(values.dtype))
+
+    return pd.DataFrame({
+        'bars': np.where(present, bars[take], 0) if n else np.zeros(len(rows), dtype=np.int64),
+        'avg_volume': column(avg_volume),
+        'max_gap_days': column(max_gap),
+        'max_daily_move': column(max_move),
+        'last_bar_date': pd.to_datetime(column(last_day)),
+    }, index=list(instrument_ids))
@@ -0,0 +1,59 @@
+import redis
+from config import settings
+
+_pool = None
+
+# Delete a lock only if it still holds our token, so a holder whose lock expired
+# doesn't release the lock another process has taken since
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def get_redis() -> redis.Redis:
+    """Redis client backed by a process-wide connection pool"""
+    global _pool
+    if _pool is None:
+        _pool = redis.ConnectionPool(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=settings.redis_db,
+            decode_responses=True,
+            max_connections=settings.redis_max_connections,
+            health_check_interval=settings.redis_health_check_interval
+        )
+    return redis.Redis(connection_pool=_pool)
+
+def release_lock(r, key: str, token: str) -> bool:
+    """Atomically delete key if its value is still token; True if it was deleted"""
+    return bool(r.register_script(_RELEASE_LOCK_SCRIPT)(keys=[key], args=[token]))
+
+def redis_pool_stats() -> dict:
+    """Occupancy of this process's Redis connection pool"""
+    if _pool is None:
+        return {"created": 0, "in_use": 0, "available": 0}
+    return {
+        "created": _pool._created_connections,
+        "in_use": len(_pool._in_use_connections),
+        "available": len(_pool._available_connections),
+        "max": _pool.max_connections,
+    }
+
+_async_pool = None
+
+def get_async_redis():
+    """asyncio Redis client for the API's event loop, backed by its own pool"""
+    global _async_pool
+    from redis import asyncio as aioredis
+    if _async_pool is None:
+        _async_pool = aioredis.ConnectionPool(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=settings.redis_db,
+            decode_responses=True,
+            max_connections=settings.redis_max_connections,
+            health_check_interval=settings.redis_health_check_interval
+        )
+    return aioredis.Redis(connection_pool=_async_pool)
@@ -0,0 +1,216 @@
+"""
+In-process cache of the aligned daily return matrix of the ETF universe and
+its covariance, one entry per lookback window (LRU).
+
+Each entry keeps running sums of r, r·rᵀ and r²·r²ᵀ over the window, so a new
+daily bar is a rank-one update and an evicted bar a rank-one downdate instead
+of an O(T·N²) recompute. Readers get read-only NumPy arrays: the return matrix
+is a view on the window buffer and every update publishes new covariance
+arrays, so a reader's arrays never change under it.
+
+Gaps are forward-filled, so an instrument without a bar on a date has a zero
+return for it; instruments with a shorter history have zero returns before
+their first bar. Bars backfilled for dates already in the window are picked up
+by the periodic rebuild (RETURN_CACHE_REBUILD_EVERY updates) or when the
+universe changes.
+"""
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from config import settings
+from price_loader import latest_price_dates
+from price_store import load_window
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+class ReturnMatrix:
+    """Rolling (dates x instruments) daily return window with running moment sums"""
+
+    def __init__(self, instrument_ids: list, lookback_days: int):
+        self.instrument_ids = list(instrument_ids)
+        self.lookback_days = lookback_days
+        self.index = {instrument_id: i for i, instrument_id in enumerate(self.instrument_ids)}
+        self.lock = threading.Lock()
+        self.updates = 0
+        n = len(self.instrument_ids)
+        self._dates = np.empty(0, dtype='datetime64[ns]')
+        self._buffer = np.empty((0, n))
+        self._start = 0
+        self._end = 0
+        self.last_close = np.full(n, np.nan)
+        self.last_date = None
+        self._sum = np.zeros(n)
+        self._cross = np.zeros((n, n))
+        self._fourth = np.zeros((n, n))
+        self._published = None
+
+    @property
+    def count(self) -> int:
+        return self._end - self._start
+
+    @property
+    def returns(self) -> np.ndarray:
+        """Read-only view of the (dates x instruments) return window"""
+        view = self._buffer[self._start:self._end]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def dates(self) -> np.ndarray:
+        view = self._dates[self._start:self._end]
+        view.flags.writeable = False
+        return view
+
+    def moments(self) -> tuple:
+        """
+        (mean, covariance, fourth) of daily returns as read-only arrays:
+        fourth is the mean of r²·r²ᵀ, used for the Ledoit-Wolf intensity
+        """
+        if self._published is None:
+            t = max(self.count, 1)
+            mean = self._sum / t
+            covariance = (self._cross - np.outer(self._sum, self._sum) / t) / max(t - 1, 1)
+            fourth = self._fourth / t
+            for array in (mean, covariance, fourth):
+                array.flags.writeable = False
+            self._published = (mean, covariance, fourth)
+        return self._published
+
+    def rebuild(self, dates: np.ndarray, closes: np.ndarray):
+        """Reset the window from a (dates x instruments) close matrix"""
+        closes = ffill(closes)
+        returns = np.nan_to_num(closes[1:] / closes[:-1] - 1) if len(closes) > 1 else np.empty((0, closes.shape[1]))
+        keep = dates[1:] >= dates[-1] - np.timedelta64(self.lookback_days, 'D') if len(dates) > 1 else []
+        returns, return_dates = returns[keep], dates[1:][keep]
+
+        self._buffer = np.empty((max(2 * len(returns), 64), len(self.instrument_ids)))
+        self._dates = np.empty(len(self._buffer), dtype='datetime64[ns]')
+        self._buffer[:len(returns)] = returns
+        self._dates[:len(returns)] = return_dates
+        self._start, self._end = 0, len(returns)
+        self._sum = returns.sum(axis=0)
+        self._cross = returns.T @ returns
+        squared = returns ** 2
+        self._fourth = squared.T @ squared
+        self.last_close = closes[-1] if len(closes) else self.last_close
+        self.last_date = pd.Timestamp(dates[-1]).date() if len(dates) else None
+        self.updates = 0
+        self._published = None
+
+    def append(self, dates: np.ndarray, closes: np.ndarray):
+        """
+        Slide the window over new bars (dates after last_date, x instruments,
+        NaN where an instrument has no bar)
+        """
+        for day, row in zip(dates, closes):
+            close = np.where(np.isnan(row), self.last_close, row)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r = np.nan_to_num(close / self.last_close - 1)
+            self._push(day, r)
+            self.last_close = close
+            self.last_date = pd.Timestamp(day).date()
+
+            cutoff = day - np.timedelta64(self.lookback_days, 'D')
+            while self.count and self._dates[self._start] < cutoff:
+                self._pop()
+        self.updates += len(dates)
+        self._published = None
+
+    def _push(self, day, r: np.ndarray):
+        if self._end == len(self._buffer):
+            # Compact the live window to the front, growing the buffer if it is mostly full
+            live = self.count
+            size = max(2 * live, 64)
+            buffer = np.empty((size, self._buffer.shape[1]))
+            dates = np.empty(size, dtype='datetime64[ns]')
+            buffer[:live] = self._buffer[self._start:self._end]
+            dates[:live] = self._dates[self._start:self._end]
+            self._buffer, self._dates = buffer, dates
+            self._start, self._end = 0, live
+        self._buffer[self._end] = r
+        self._dates[self._end] = day
+        self._end += 1
+        self._sum += r
+        self._cross += np.outer(r, r)
+        squared = r * r
+        self._fourth += np.outer(squared, squared)
+
+    def _pop(self):
+        r = self._buffer[self._start]
+        self._sum -= r
+        self._cross -= np.outer(r, r)
+        squared = r * r
+        self._fourth -= np.outer(squared, squared)
+        self._start += 1
+
+def get_return_matrix(db: Session, lookback_days: int = None) -> ReturnMatrix:
+    """
+    Return matrix of the ETF universe for lookback_days, brought up to date
+    with only the bars newer than the cached window
+    """
+    lookback_days = lookback_days or settings.scoring_lookback_days
+    instrument_ids = [row[0] for row in db.execute(
+        text("SELECT id FROM instrument WHERE type = 'ETF' ORDER BY id")
+    ).fetchall()]
+
+    with _cache_lock:
+        matrix = _cache.get(lookback_days)
+        if matrix is None or matrix.instrument_ids != instrument_ids:
+            matrix = ReturnMatrix(instrument_ids, lookback_days)
+            _cache[lookback_days] = matrix
+        _cache.move_to_end(lookback_days)
+        while len(_cache) > settings.return_cache_windows:
+            _cache.popitem(last=False)
+
+    with matrix.lock:
+        _refresh(db, matrix)
+    return matrix
+
+def shrunk_covariance(matrix: ReturnMatrix, instrument_ids: list = None) -> tuple:
+    """
+    (mean, Ledoit-Wolf shrunk covariance) of daily returns for instrument_ids
+    (default: the whole universe), from the cached moment sums
+    """
+    mean, covariance, fourth = matrix.moments()
+    if instrument_ids is not None:
+        idx = np.array([matrix.index[i] for i in instrument_ids], dtype=np.int64)
+        mean, covariance, fourth = mean[idx], covariance[np.ix_(idx, idx)], fourth[np.ix_(idx, idx)]
+
+    n = len(mean)
+    t = max(matrix.count, 1)
+    target = np.trace(covariance) / n if n else 0.0
+    delta = np.sum((covariance - target * np.eye(n)) ** 2) / n if n else 0.0
+    # Returns are close to zero-mean, so raw fourth moments stand in for centered ones
+    beta = min(np.sum(fourth - covariance ** 2) / (n * t), delta) if n else 0.0
+    shrinkage = beta / delta if delta > 0 else 1.0
+    return mean, shrinkage * target * np.eye(n) + (1 - shrinkage) * covariance
+
+def _refresh(db: Session, matrix: ReturnMatrix):
+    latest = latest_price_dates(db, matrix.instrument_ids)
+    if not latest:
+        return
+    newest = max(latest.values())
+
+    if matrix.last_date is None or matrix.updates >= settings.return_cache_rebuild_every:
+        start = newest - timedelta(days=matrix.lookback_days + 10)
+        window = load_window(db, matrix.instrument_ids, start, newest)
+        dates, closes = window.close_matrix(matrix.instrument_ids)
+        matrix.rebuild(dates.to_numpy(), closes)
+        print(f"  📐 Return matrix rebuilt: {matrix.count} days x {len(matrix.instrument_ids)} instruments")
+    elif newest > matrix.last_date:
+        window = load_window(db, matrix.instrument_ids, matrix.last_date + timedelta(days=1), newest)
+        dates, closes = window.close_matrix(matrix.instrument_ids)
+        matrix.append(dates.to_numpy(), closes)
+        print(f"  📐 Return matrix updated with {len(dates)} new days")
+
+def ffill(matrix: np.ndarray) -> np.ndarray:
+    """Forward-fill NaNs down each column of a (dates x instruments) matrix; leading NaNs stay NaN"""
+    valid = ~np.isnan(matrix)
+    idx = np.where(valid, np.arange(len(matrix))[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return matrix[idx, np.arange(matrix.shape[1])]
@@ -0,0 +1,97 @@
+"""
+Run-level scoring cache.
+
+Scoring output doesn't depend on the user: only on the instrument universe,
+the price data as-of date of every instrument and the scoring settings. Results
+are stored in Redis under a hash of those inputs, so concurrent or repeated runs
+copy them instead of recomputing. Two runs racing on the same key compute it
+once: the first takes a lock, the others wait for its result.
+"""
+import hashlib
+import json
+import time
+import uuid
+from datetime import date
+import redis
+from sqlalchemy.orm import Session
+from config import settings
+from price_loader import latest_price_dates
+from redis_client import release_lock
+import scoring_engine
+
+CACHE_PREFIX = "aurora:scoring-cache"
+INDEX_KEY = f"{CACHE_PREFIX}:index"
+
+def scoring_input_hash(db: Session, instruments: list, incremental: bool) -> str:
+    """Content hash of everything the scoring output depends on"""
+    latest = latest_price_dates(db, [i[0] for i in instruments])
+    payload = {
+        "universe": sorted(
+            [instrument_id, ticker, latest[instrument_id].isoformat() if instrument_id in latest else None]
+            for instrument_id, ticker, _ in instruments
+        ),
+        # The full window ends today and missing history is downloaded on the fly
+        "asof": date.today().isoformat(),
+        "incremental": incremental,
+        "lookback_days": settings.scoring_lookback_days,
+        "thresholds": [
+            scoring_engine.PERFORMANCE_THRESHOLDS, scoring_engine.PERFORMANCE_POINTS,
+            scoring_engine.VOLATILITY_THRESHOLDS, scoring_engine.VOLATILITY_POINTS,
+            scoring_engine.SHARPE_THRESHOLDS, scoring_engine.SHARPE_POINTS,
+            scoring_engine.DRAWDOWN_THRESHOLDS, scoring_engine.DRAWDOWN_POINTS,
+        ],
+        "risk_free_rate": scoring_engine.RISK_FREE_RATE,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def get_or_compute(r, key: str, compute) -> list:
+    """
+    Return the cached scoring results for key, or run compute() once across
+    all runs racing on it and cache what it returns
+    """
+    data_key = f"{CACHE_PREFIX}:{key}"
+    lock_key = f"{data_key}:lock"
+    lock_ms = int(settings.scoring_cache_lock_seconds * 1000)
+    deadline = time.monotonic() + settings.scoring_cache_lock_seconds
+
+    while True:
+        cached = r.get(data_key)
+        if cached is not None:
+            print(f"  ♻️ Reusing cached scoring results ({key[:12]})")
+            return [tuple(item) for item in json.loads(cached)]
+
+        token = uuid.uuid4().hex
+        if r.set(lock_key, token, nx=True, px=lock_ms):
+            try:
+                scored = compute()
+                try:
+                    _store(r, key, data_key, scored)
+                except redis.exceptions.RedisError as e:
+                    print(f"  ⚠️ Could not cache scoring results: {e}")
+                return scored
+            finally:
+                # Not a plain delete: our lock may have expired and been taken by another run
+                release_lock(r, lock_key, token)
+
+        # Another run is computing this key: wait for its result. If it dies
+        # the lock expires and one of the waiters takes over.
+        if time.monotonic() > deadline:
+            print("  ⚠️ Timed out waiting for concurrent scoring, computing locally")
+            return compute()
+        time.sleep(settings.scoring_cache_poll_seconds)
+
+def _store(r, key: str, data_key: str, scored: list):
+    now = time.time()
+    pipe = r.pipeline()
+    pipe.set(data_key, json.dumps(scored), ex=settings.scoring_cache_ttl_seconds)
+    pipe.zadd(INDEX_KEY, {key: now})
+    # Drop index entries whose data already expired
+    pipe.zremrangebyscore(INDEX_KEY, 0, now - settings.scoring_cache_ttl_seconds)
+    pipe.execute()
+
+    # Keep at most scoring_cache_max_entries result sets, evicting the oldest
+    excess = r.zcard(INDEX_KEY) - settings.scoring_cache_max_entries
+    if excess > 0:
+        for old_key in r.zrange(INDEX_KEY, 0, excess - 1):
+            r.delete(f"{CACHE_PREFIX}:{old_key}")
+        r.zremrangebyrank(INDEX_KEY, 0, excess - 1)
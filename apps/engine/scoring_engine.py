@@ -1,10 +1,57 @@
-from datetime import datetime, timedelta
-import yfinance as yf
+from datetime import date, datetime, timedelta
+import json
+import redis
 import pandas as pd
 import numpy as np
-from sqlalchemy import text
+from sqlalchemy import text, bindparam
 from config import settings
 from sqlalchemy.orm import Session
+from database import insert_values
+from price_loader import PriceWindow
+from price_store import load_window
+from market_data import get_fetcher
+from progress import RunProgress
+from red_flags import detect_red_flags
+from metrics import span
+
+# Threshold ladders used by calculate_etf_score, expressed as digitize bins.
+# "Higher is better" metrics use right-closed bins (value > threshold),
+# "lower is better" metrics use left-closed bins (value < threshold).
+PERFORMANCE_THRESHOLDS = (0, 10, 20, 30)
+PERFORMANCE_POINTS = (0, 10, 15, 20, 25)
+VOLATILITY_THRESHOLDS = (10, 15, 20, 25)
+VOLATILITY_POINTS = (25, 20, 15, 10, 5)
+SHARPE_THRESHOLDS = (0, 0.5, 1.0, 1.5)
+SHARPE_POINTS = (0, 10, 15, 20, 25)
+DRAWDOWN_THRESHOLDS = (10, 15, 20, 25)
+DRAWDOWN_POINTS = (25, 20, 15, 10, 5)
+
+RISK_FREE_RATE = 0.04  # 4% annual
+TRADING_DAYS = 252
+
+# Instruments per batch of progress events
+PROGRESS_BATCH = 25
+
+ETF_INSTRUMENTS_SQL = text("SELECT id, ticker, name FROM instrument WHERE type = 'ETF'")
+DELETE_RUN_SCORES_SQL = text('DELETE FROM etf_scoring_result WHERE "runId" = :run_id')
+
+def lookback_window(today: date = None) -> tuple:
+    """
+    (first, last) day of the scoring window, both included: the lookback
+    ending today. The full and the incremental path both score this window.
+    """
+    today = today or date.today()
+    return today - timedelta(days=settings.scoring_lookback_days - 1), today
+
+def score_bucket(total_score: float) -> str:
+    """Map a total score (0-100) to its A/B/C/D bucket"""
+    if total_score >= 80:
+        return 'A'
+    elif total_score >= 60:
+        return 'B'
+    elif total_score >= 40:
+        return 'C'
+    return 'D'
 
 def calculate_etf_score(ticker: str, data: pd.DataFrame) -> dict:
     """
@@ -12,9 +59,11 @@ def calculate_etf_score(ticker: str, data: pd.DataFrame) -> dict:
     Returns score breakdown and total score (0-100)
     """
     scores = {}
+    # A NaN close is a missing bar, as in the batch path (not a zero return)
+    close = data['Close'].dropna()
 
     # 1. Performance Score (0-25 points)
-    returns_1y = (data['Close'].iloc[-1] / data['Close'].iloc[0] - 1) * 100
+    returns_1y = (close.iloc[-1] / close.iloc[0] - 1) * 100
     if returns_1y > 30:
         scores['performance'] = 25
     elif returns_1y > 20:
@@ -27,7 +76,7 @@ def calculate_etf_score(ticker: str, data: pd.DataFrame) -> dict:
         scores['performance'] = 0
 
     # 2. Volatility Score (0-25 points) - Lower is better
-    daily_returns = data['Close'].pct_change().dropna()
+    daily_returns = close.pct_change().dropna()
     volatility = daily_returns.std() * np.sqrt(252) * 100  # Annualized
     if volatility < 10:
         scores['volatility'] = 25
@@ -87,115 +136,414 @@ def calculate_etf_score(ticker: str, data: pd.DataFrame) -> dict:
         }
     }
 
-def run_scoring(db: Session, run_id: str, user_id: str):
+def _bucket_points(values: np.ndarray, thresholds, points, higher_is_better: bool) -> np.ndarray:
+    """
+    Vectorized equivalent of the if/elif ladders in calculate_etf_score.
+    NaN metrics fall through to the ladder's else branch, as they do there.
+    """
+    idx = np.digitize(values, thresholds, right=higher_is_better)
+    result = np.asarray(points)[idx]
+    fallback = points[0] if higher_is_better else points[-1]
+    return np.where(np.isnan(values), fallback, result)
+
+def build_close_matrix(closes: list) -> tuple:
+    """
+    Align a list of close price Series (indexed by date) into one
+    (dates x instruments) float64 matrix. Missing dates are NaN.
+    """
+    frame = pd.concat(closes, axis=1, join='outer', ignore_index=True).sort_index()
+    return frame.index, frame.to_numpy(dtype=np.float64)
+
+def calculate_scores_batch(closes: np.ndarray) -> list:
+    """
+    Score every column of a (dates x instruments) close matrix at once.
+    Returns one dict per column, in the same format as calculate_etf_score.
+    """
+    return score_metrics(*batch_metrics(closes))
+
+def batch_metrics(closes: np.ndarray) -> tuple:
+    """
+    calculate_etf_score's metrics (in percent) for every column of a
+    (dates x instruments) close matrix: (returns_1y, volatility, sharpe_ratio, max_drawdown)
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    valid = ~np.isnan(closes)
+    n_dates, n_instruments = closes.shape
+    rows = np.arange(n_dates)[:, None]
+    cols = np.arange(n_instruments)
+
+    # First/last available close per instrument
+    first_idx = np.where(valid, rows, n_dates).min(axis=0)
+    last_idx = np.where(valid, rows, -1).max(axis=0)
+    has_data = last_idx >= 0
+    first_close = closes[np.minimum(first_idx, n_dates - 1), cols]
+    last_close = closes[np.maximum(last_idx, 0), cols]
+
+    # Daily returns between consecutive available closes (pct_change on each
+    # instrument's own series): divide by the forward-filled previous close
+    prev_idx = np.maximum.accumulate(np.where(valid, rows, -1), axis=0)
+    prev_close = np.full_like(closes, np.nan)
+    prev_close[1:] = np.where(prev_idx[:-1] >= 0, closes[np.maximum(prev_idx[:-1], 0), cols], np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns_1y = np.where(has_data, (last_close / first_close - 1) * 100, np.nan)
+        daily_returns = np.where(valid, closes / prev_close - 1, np.nan)
+        ret_valid = ~np.isnan(daily_returns)
+        count = ret_valid.sum(axis=0)
+
+        mean = np.where(ret_valid, daily_returns, 0).sum(axis=0) / count
+        sq_dev = np.where(ret_valid, (daily_returns - mean) ** 2, 0)
+        std = np.sqrt(sq_dev.sum(axis=0) / (count - 1))
+        std = np.where(count > 1, std, np.nan)
+
+        volatility = std * np.sqrt(TRADING_DAYS) * 100
+        excess_returns = mean * TRADING_DAYS - RISK_FREE_RATE
+        sharpe_ratio = excess_returns / (std * np.sqrt(TRADING_DAYS))
+
+        # Max drawdown on the cumulative return path, ignoring leading gaps
+        cumulative = np.cumprod(np.where(ret_valid, 1 + daily_returns, 1), axis=0)
+        cumulative = np.where(ret_valid, cumulative, np.nan)
+        running_max = np.fmax.accumulate(cumulative, axis=0)
+        drawdown = (cumulative - running_max) / running_max * 100
+        min_drawdown = np.min(np.where(ret_valid, drawdown, np.inf), axis=0)
+        max_drawdown = np.where(count > 0, np.abs(min_drawdown), np.nan)
+
+    return returns_1y, volatility, sharpe_ratio, max_drawdown
+
+def metric_points(returns_1y: np.ndarray, volatility: np.ndarray,
+                  sharpe_ratio: np.ndarray, max_drawdown: np.ndarray, thresholds: dict = None) -> tuple:
+    """
+    Points per component for metric arrays of any shape.
+    thresholds optionally overrides the ladders by component name
+    ('performance', 'volatility', 'sharpe', 'drawdown').
+    """
+    thresholds = thresholds or {}
+    return (
+        _bucket_points(returns_1y, thresholds.get('performance', PERFORMANCE_THRESHOLDS), PERFORMANCE_POINTS, True),
+        _bucket_points(volatility, thresholds.get('volatility', VOLATILITY_THRESHOLDS), VOLATILITY_POINTS, False),
+        _bucket_points(sharpe_ratio, thresholds.get('sharpe', SHARPE_THRESHOLDS), SHARPE_POINTS, True),
+        _bucket_points(max_drawdown, thresholds.get('drawdown', DRAWDOWN_THRESHOLDS), DRAWDOWN_POINTS, False),
+    )
+
+def score_metrics(returns_1y: np.ndarray, volatility: np.ndarray,
+                  sharpe_ratio: np.ndarray, max_drawdown: np.ndarray) -> list:
+    """
+    Turn per-instrument metric arrays (in percent, as in calculate_etf_score)
+    into score dicts
+    """
+    n_instruments = len(returns_1y)
+    performance_pts, volatility_pts, sharpe_pts, drawdown_pts = metric_points(
+        returns_1y, volatility, sharpe_ratio, max_drawdown
+    )
+    total = performance_pts + volatility_pts + sharpe_pts + drawdown_pts
+
+    results = []
+    for j in range(n_instruments):
+        results.append({
+            'performance_score': int(performance_pts[j]),
+            'volatility_score': int(volatility_pts[j]),
+            'sharpe_score': int(sharpe_pts[j]),
+            'drawdown_score': int(drawdown_pts[j]),
+            'total_score': int(total[j]),
+            'metrics': {
+                'return_1y': round(returns_1y[j], 2),
+                'volatility': round(volatility[j], 2),
+                'sharpe_ratio': round(sharpe_ratio[j], 2),
+                'max_drawdown': round(max_drawdown[j], 2)
+            }
+        })
+    return results
+
+def check_batch_parity(frames: dict) -> list:
+    """
+    Compare calculate_scores_batch against calculate_etf_score for a
+    {ticker: DataFrame} mapping. Returns the tickers whose results differ.
+    """
+    tickers = list(frames.keys())
+    _, matrix = build_close_matrix([frames[t]['Close'] for t in tickers])
+    batch_results = calculate_scores_batch(matrix)
+
+    mismatches = []
+    for ticker, batch_result in zip(tickers, batch_results):
+        expected = calculate_etf_score(ticker, frames[ticker])
+        if not _same_score(expected, batch_result):
+            mismatches.append(ticker)
+    return mismatches
+
+def _same_score(a: dict, b: dict) -> bool:
+    keys = ('performance_score', 'volatility_score', 'sharpe_score', 'drawdown_score', 'total_score')
+    if any(a[k] != b[k] for k in keys):
+        return False
+    for name, value in a['metrics'].items():
+        other = b['metrics'][name]
+        if not (value == other or (pd.isna(value) and pd.isna(other))):
+            return False
+    return True
+
+def run_scoring(db: Session, run_id: str, user_id: str, incremental: bool = None):
     """
     Execute ETF scoring algorithm for all instruments
+    With incremental=True (default: SCORING_INCREMENTAL) only instruments with
+    new price data are recomputed; the rest reuse their stored scoring_state
     """
     print(f"🎯 Starting scoring engine for run {run_id}")
 
     # Get all ETF instruments
-    instruments = db.execute(
-        text("SELECT id, ticker, name FROM instrument WHERE type = 'ETF'")
-    ).fetchall()
+    instruments = db.execute(ETF_INSTRUMENTS_SQL).fetchall()
 
     print(f"📊 Found {len(instruments)} ETFs to score")
 
-    for instrument in instruments:
+    progress = RunProgress(run_id)
+    progress.emit("scoring", total=len(instruments))
+
+    incremental = settings.scoring_incremental if incremental is None else incremental
+    # The price window scoring loaded, reused by the red flags (none on a cache hit)
+    loaded = {}
+
+    def compute() -> list:
+        scored, loaded['window'] = _compute_scores(db, instruments, incremental, progress)
+        return scored
+
+    if settings.scoring_cache_enabled:
+        from redis_client import get_redis
+        from scoring_cache import get_or_compute, scoring_input_hash
+
+        try:
+            input_hash = scoring_input_hash(db, instruments, incremental)
+            scored = get_or_compute(get_redis(), input_hash, compute)
+        except redis.exceptions.RedisError as e:
+            print(f"  ⚠️ Scoring cache unavailable ({e}), computing directly")
+            scored = compute()
+    else:
+        scored = compute()
+
+    for _, ticker, score_data in scored:
+        print(f"  ✅ {ticker}: {score_data['total_score']}/100")
+    progress.emit_many([
+        {"stage": "scored", "ticker": ticker, "score": score_data['total_score'],
+         "bucket": score_bucket(score_data['total_score']), "done": n + 1, "total": len(scored)}
+        for n, (_, ticker, score_data) in enumerate(scored)
+    ])
+
+    with span("red_flags", instruments=len(scored)):
+        red_flags = detect_red_flags(db, [instrument_id for instrument_id, _, _ in scored], loaded.get('window'))
+
+    progress.emit("saving", total=len(scored))
+    with span("persist_scores", rows=len(scored)):
+        saved_count = save_scores(db, run_id, scored, red_flags=red_flags)
+    print(f"✅ Scoring completed for run {run_id} ({saved_count}/{len(scored)} results saved)")
+
+def score_tickers(db: Session, tickers: list) -> list:
+    """
+    Score the given tickers now, without creating a run or saving results.
+    Tickers that are not in the instrument table are scored on downloaded data.
+    """
+    rows = db.execute(
+        text("SELECT id, ticker, name FROM instrument WHERE ticker IN :tickers")
+        .bindparams(bindparam("tickers", expanding=True)),
+        {"tickers": list(tickers)}
+    ).fetchall() if tickers else []
+    known = {ticker: (instrument_id, ticker, name) for instrument_id, ticker, name in rows}
+    instruments = [known.get(ticker, (f"adhoc:{ticker}", ticker, ticker)) for ticker in tickers]
+
+    scored, window = _score_full(db, instruments)
+    red_flags = detect_red_flags(db, [instrument_id for instrument_id, _, _ in scored
+                                      if not instrument_id.startswith("adhoc:")], window)
+    results = []
+    for instrument_id, ticker, score_data in scored:
+        results.append(dict(
+            score_data,
+            ticker=ticker,
+            instrumentId=None if instrument_id.startswith("adhoc:") else instrument_id,
+            bucket=score_bucket(score_data['total_score']),
+            redFlags=red_flags.get(instrument_id, [])
+        ))
+    return results
+
+def _compute_scores(db: Session, instruments: list, incremental: bool, progress: RunProgress = None) -> tuple:
+    """
+    Score every instrument. Returns ((instrument_id, ticker, score_data) tuples,
+    the price window they were scored on), the window being None unless every
+    instrument went through the full path.
+    """
+    scored = []
+    window = None
+    if incremental:
+        from incremental_scoring import run_incremental, verify_incremental
+
+        with span("incremental_scoring", instruments=len(instruments)):
+            incremental_scores = run_incremental(db, [i[0] for i in instruments])
+        scored = [(instrument_id, ticker, incremental_scores[instrument_id])
+                  for instrument_id, ticker, _ in instruments if instrument_id in incremental_scores]
+
+        if settings.scoring_verify_incremental:
+            mismatches = verify_incremental(db, list(incremental_scores.keys()))
+            if mismatches:
+                print(f"  ⚠️ Incremental scoring differs from full recompute for: {', '.join(mismatches)}")
+
+        # Instruments without enough stored history go through the full path
+        instruments = [i for i in instruments if i[0] not in incremental_scores]
+
+    if instruments:
+        full_scored, full_window = _score_full(db, instruments, progress)
+        # Reusable by the red flags only if it holds every scored instrument
+        window = None if scored else full_window
+        scored += full_scored
+
+    return scored, window
+
+def _score_full(db: Session, instruments: list, progress: RunProgress = None) -> list:
+    """
+    Score instruments over the full lookback window ending today.
+    Returns (instrument_id, ticker, score_data) for every instrument scored,
+    and the price window loaded for them.
+    """
+    # Load the lookback window for every ETF in one pass, then score them together
+    start_date, end_date = lookback_window()
+    with span("db_load", instruments=len(instruments)):
+        window = load_window(db, [i[0] for i in instruments], start_date, end_date)
+    print(f"  Loaded {len(window)} price rows from database")
+
+    # Download every instrument lacking history in one batched fetch
+    fallback_tickers = [ticker for instrument_id, ticker, _ in instruments if window.count(instrument_id) < 200]
+    fallback = {}
+    if fallback_tickers:
+        with span("market_data_fallback", tickers=len(fallback_tickers)):
+            fallback = get_fetcher().fetch(fallback_tickers, start_date, end_date)
+
+    loaded = []
+    events = []
+    for n, instrument in enumerate(instruments):
         instrument_id, ticker, name = instrument
 
         try:
-            print(f"  Scoring {ticker}...")
-
-            # Get historical data from database (already fetched by API)
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=settings.scoring_lookback_days)
-
-            price_records = db.execute(
-                text("""
-                SELECT date, open, high, low, close, volume
-                FROM price_history
-                WHERE "instrumentId" = :instrument_id
-                  AND date >= :start_date
-                  AND date <= :end_date
-                ORDER BY date ASC
-                """),
-                {"instrument_id": instrument_id, "start_date": start_date, "end_date": end_date}
-            ).fetchall()
-
-            if not price_records or len(price_records) < 200:
-                print(f"  ⚠️ Insufficient data for {ticker} in database (got {len(price_records) if price_records else 0} rows), trying yfinance...")
-
-                # Fallback to yfinance download
-                df = yf.download(
-                    ticker,
-                    start=start_date,
-                    end=end_date,
-                    progress=False,
-                    auto_adjust=True,
-                    actions=False,
-                    repair=True,
-                    keepna=False
-                )
-
-                if df is None or df.empty or len(df) < 200:
-                    print(f"  ⚠️ Yfinance also failed for {ticker}, skipping")
-                    continue
-            else:
-                # Convert database records to pandas DataFrame
-                df = pd.DataFrame(price_records, columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
-                df['Date'] = pd.to_datetime(df['Date'])
-                df.set_index('Date', inplace=True)
-                print(f"    Loaded {len(df)} days from database: {df.index[0].date()} to {df.index[-1].date()}")
-
-            # Calculate score
-            score_data = calculate_etf_score(ticker, df)
-
-            # Save scoring result
-            import json
-
-            # Determine bucket based on total score
-            total_score = score_data['total_score']
-            if total_score >= 80:
-                bucket = 'A'
-            elif total_score >= 60:
-                bucket = 'B'
-            elif total_score >= 40:
-                bucket = 'C'
-            else:
-                bucket = 'D'
-
-            # Prepare breakdown with all metrics
-            breakdown = {
-                'performance': score_data['performance_score'],
-                'volatility': score_data['volatility_score'],
-                'sharpe': score_data['sharpe_score'],
-                'drawdown': score_data['drawdown_score'],
-                'metrics': score_data['metrics']
-            }
+            df = _load_prices(window, fallback, ticker, instrument_id)
+            if df is not None:
+                loaded.append((instrument_id, ticker, df))
+            events.append({"stage": "loaded", "ticker": ticker, "ok": df is not None,
+                           "done": n + 1, "total": len(instruments)})
+        except Exception as e:
+            print(f"  ❌ Error loading {ticker}: {e}")
+            events.append({"stage": "loaded", "ticker": ticker, "ok": False, "error": str(e),
+                           "done": n + 1, "total": len(instruments)})
 
-            db.execute(
-                text("""
-                INSERT INTO etf_scoring_result
-                (id, "runId", "instrumentId", bucket, score, breakdown, "redFlags", "dataAsof")
-                VALUES (gen_random_uuid(), :run_id, :instrument_id, :bucket, :score,
-                        CAST(:breakdown AS jsonb), CAST(:red_flags AS jsonb), :data_asof)
-                """),
-                {
-                    "run_id": run_id,
-                    "instrument_id": instrument_id,
-                    "bucket": bucket,
-                    "score": float(total_score),
-                    "breakdown": json.dumps(breakdown),
-                    "red_flags": json.dumps([]),  # No red flags for now
-                    "data_asof": datetime.utcnow().date()
-                }
-            )
-            db.commit()
-
-            print(f"  ✅ {ticker}: {score_data['total_score']}/100")
+        if progress and (len(events) >= PROGRESS_BATCH or n == len(instruments) - 1):
+            progress.emit_many(events)
+            events = []
 
+    with span("metrics", instruments=len(loaded)):
+        if settings.scoring_batch_mode and loaded:
+            _, matrix = build_close_matrix([df['Close'] for _, _, df in loaded])
+            score_results = calculate_scores_batch(matrix)
+
+            if settings.scoring_verify_batch:
+                mismatches = check_batch_parity({ticker: df for _, ticker, df in loaded})
+                if mismatches:
+                    print(f"  ⚠️ Batch scoring differs from per-ticker scoring for: {', '.join(mismatches)}")
+        else:
+            score_results = []
+            for _, ticker, df in loaded:
+                try:
+                    score_results.append(calculate_etf_score(ticker, df))
+                except Exception as e:
+                    print(f"  ❌ Error scoring {ticker}: {e}")
+                    score_results.append(None)
+
+    return [(instrument_id, ticker, score_data)
+            for (instrument_id, ticker, _), score_data in zip(loaded, score_results)
+            if score_data is not None], window
+
+def _load_prices(window: PriceWindow, fallback: dict, ticker: str, instrument_id: str):
+    """
+    Get one instrument's lookback window from the preloaded price window,
+    or from the market data fetcher when the database doesn't have enough history
+    """
+    print(f"  Scoring {ticker}...")
+
+    count = window.count(instrument_id)
+    if count < 200:
+        print(f"  ⚠️ Insufficient data for {ticker} in database (got {count} rows), using downloaded data...")
+
+        df = fallback.get(ticker)
+        if df is None or df.empty or len(df) < 200:
+            print(f"  ⚠️ Yfinance also failed for {ticker}, skipping")
+            return None
+    else:
+        # Wrap the window's close column for this instrument (no copy)
+        df = window.close_series(instrument_id).to_frame()
+        print(f"    Loaded {len(df)} days from database: {df.index[0].date()} to {df.index[-1].date()}")
+
+    return df
+
+def _score_row(run_id: str, instrument_id: str, score_data: dict, data_asof, red_flags: list = None) -> dict:
+    """Build the etf_scoring_result parameters for one instrument"""
+    total_score = score_data['total_score']
+
+    # Prepare breakdown with all metrics
+    breakdown = {
+        'performance': score_data['performance_score'],
+        'volatility': score_data['volatility_score'],
+        'sharpe': score_data['sharpe_score'],
+        'drawdown': score_data['drawdown_score'],
+        'metrics': score_data['metrics']
+    }
+
+    return {
+        "run_id": run_id,
+        "instrument_id": instrument_id,
+        "bucket": score_bucket(total_score),
+        "score": float(total_score),
+        "breakdown": json.dumps(breakdown),
+        "red_flags": json.dumps(red_flags or []),
+        "data_asof": data_asof
+    }
+
+def _insert_scores(db: Session, rows: list):
+    """Insert many scoring results with a single multi-row VALUES statement"""
+    insert_values(
+        db,
+        """
+        INSERT INTO etf_scoring_result
+        (id, "runId", "instrumentId", bucket, score, breakdown, "redFlags", "dataAsof")
+        """,
+        "(gen_random_uuid(), :run_id, :instrument_id, :bucket, :score, "
+        "CAST(:breakdown AS jsonb), CAST(:red_flags AS jsonb), :data_asof)",
+        rows
+    )
+
+def save_scores(db: Session, run_id: str, scored: list, chunk_size: int = None, red_flags: dict = None) -> int:
+    """
+    Persist (instrument_id, ticker, score_data) results in one transaction,
+    one savepoint per chunk, replacing any results already stored for run_id.
+    red_flags maps instrument ids to their red flag codes (see detect_red_flags).
+    A failing chunk is retried row by row so one bad instrument doesn't drop
+    the others. Returns the number of rows written.
+    """
+    chunk_size = chunk_size or settings.scoring_write_chunk_size or max(len(scored), 1)
+    data_asof = datetime.utcnow().date()
+
+    # Replayed jobs (e.g. requeued after a worker crash) rewrite the run's results;
+    # the delete commits with the inserts, so a failed save keeps the previous ones
+    db.execute(DELETE_RUN_SCORES_SQL, {"run_id": run_id})
+
+    saved_count = 0
+    for i in range(0, len(scored), chunk_size):
+        chunk = scored[i:i + chunk_size]
+        rows = [_score_row(run_id, instrument_id, score_data, data_asof, (red_flags or {}).get(instrument_id))
+                for instrument_id, _, score_data in chunk]
+        try:
+            with db.begin_nested():
+                _insert_scores(db, rows)
+            saved_count += len(rows)
         except Exception as e:
-            print(f"  ❌ Error scoring {ticker}: {e}")
-            continue
+            print(f"  ⚠️ Bulk insert of {len(rows)} results failed ({e}), retrying one by one")
+            for (_, ticker, _), row in zip(chunk, rows):
+                try:
+                    with db.begin_nested():
+                        _insert_scores(db, [row])
+                    saved_count += 1
+                except Exception as e:
+                    print(f"  ❌ Error saving {ticker}: {e}")
 
-    print(f"✅ Scoring completed for run {run_id}")
+    db.commit()
+    return saved_count
@@ -1,174 +1,249 @@
 """
 Script per popolare il database con dati storici usando scraping
-Usa yfinance con strategie alternative per evitare rate limiting
+Usa yfinance tramite il fetcher batch con rate limiting e cache locale
 """
+import io
 import sys
 import time
 from datetime import datetime, timedelta
 from sqlalchemy import text
 from database import SessionLocal
+from market_data import MarketDataFetcher, get_fetcher
+from fx import BASE_CURRENCY, ORIGINAL_COLUMNS, convert_to_eur
 import pandas as pd
 import numpy as np
 
-def generate_synthetic_prices(ticker: str, days: int = 365) -> pd.DataFrame:
+def generate_synthetic_universe(tickers: list, days: int = 365, seed: int = None,
+                                annual_return=0.12, annual_volatility=0.18,
+                                covariance: np.ndarray = None, base_price: float = 100.0,
+                                end_date: datetime = None) -> pd.DataFrame:
     """
-    Genera dati di prezzo sintetici ma realistici per testing
-    Simula un trend rialzista con volatilità realistica
-    """
-    print(f"  Generating synthetic data for {ticker}...")
+    Genera in un'unica chiamata prezzi sintetici per molti ticker (formato long)
+    Random walk geometrico vettorizzato: prodotto cumulativo dei rendimenti giornalieri
 
-    # Parametri realistici
-    base_price = 100.0
-    annual_return = 0.12  # 12% annuo
-    annual_volatility = 0.18  # 18% volatilità annua
+    Args:
+        tickers: Lista dei ticker da simulare
+        days: Numero di giorni di storico
+        seed: Seed del np.random.Generator, per dataset riproducibili
+        annual_return: Rendimento annuo atteso (scalare o uno per ticker)
+        annual_volatility: Volatilità annua (scalare o una per ticker), ignorata se c'è covariance
+        covariance: Matrice di covarianza annua (n_tickers x n_tickers) per asset correlati
+        base_price: Prezzo iniziale di ogni ticker
+        end_date: Ultima data generata (default: oggi)
+    """
+    rng = np.random.default_rng(seed)
+    n = len(tickers)
 
     # Converti a parametri giornalieri
-    daily_return = annual_return / 252
-    daily_volatility = annual_volatility / np.sqrt(252)
+    daily_return = np.broadcast_to(np.asarray(annual_return, dtype=np.float64), (n,)) / 252
+
+    if covariance is not None:
+        chol = np.linalg.cholesky(np.asarray(covariance, dtype=np.float64) / 252)
+        shocks = rng.standard_normal((days - 1, n)) @ chol.T
+    else:
+        daily_volatility = np.broadcast_to(np.asarray(annual_volatility, dtype=np.float64), (n,)) / np.sqrt(252)
+        shocks = rng.standard_normal((days - 1, n)) * daily_volatility
+
+    # Movimento browniano geometrico: P_t = P_0 * prod(1 + r)
+    prices = np.empty((days, n))
+    prices[0] = base_price
+    np.cumprod(1 + daily_return + shocks, axis=0, out=prices[1:])
+    prices[1:] *= base_price
 
     # Genera date
-    end_date = datetime.now()
-    dates = [end_date - timedelta(days=days-i) for i in range(days)]
-
-    # Genera prezzi usando random walk geometrico
-    prices = [base_price]
-    for _ in range(days - 1):
-        # Movimento browniano geometrico
-        change = np.random.normal(daily_return, daily_volatility)
-        new_price = prices[-1] * (1 + change)
-        prices.append(new_price)
-
-    # Crea DataFrame con OHLC
-    df_data = []
-    for i, date in enumerate(dates):
-        price = prices[i]
-        # Simula OHLC con spread realistico
-        daily_range = price * 0.02  # 2% range giornaliero
-        open_price = price * (1 + np.random.uniform(-0.005, 0.005))
-        high = price + abs(np.random.uniform(0, daily_range))
-        low = price - abs(np.random.uniform(0, daily_range))
-        close = price
-        volume = int(np.random.uniform(100000, 500000))
-
-        df_data.append({
-            'Date': date.date(),
-            'Open': round(open_price, 2),
-            'High': round(high, 2),
-            'Low': round(low, 2),
-            'Close': round(close, 2),
-            'Volume': volume
-        })
-
-    df = pd.DataFrame(df_data)
+    end_date = end_date or datetime.now()
+    dates = pd.date_range(end=pd.Timestamp(end_date).normalize() - pd.Timedelta(days=1), periods=days, freq='D')
+
+    # Simula OHLC con spread realistico (2% range giornaliero)
+    close = prices.ravel()
+    daily_range = close * 0.02
+    open_price = close * (1 + rng.uniform(-0.005, 0.005, close.size))
+    high = close + rng.uniform(0, 1, close.size) * daily_range
+    low = close - rng.uniform(0, 1, close.size) * daily_range
+    volume = rng.integers(100000, 500000, close.size)
+
+    return pd.DataFrame({
+        'Ticker': pd.Categorical.from_codes(np.tile(np.arange(n), days), categories=list(tickers)),
+        'Date': np.repeat(dates.to_numpy(), n),
+        'Open': open_price.round(2),
+        'High': high.round(2),
+        'Low': low.round(2),
+        'Close': close.round(2),
+        'Volume': volume
+    })
+
+def generate_synthetic_prices(ticker: str, days: int = 365, seed: int = None) -> pd.DataFrame:
+    """
+    Genera dati di prezzo sintetici ma realistici per testing
+    Simula un trend rialzista con volatilità realistica
+    """
+    print(f"  Generating synthetic data for {ticker}...")
+
+    df = generate_synthetic_universe([ticker], days, seed=seed).drop(columns='Ticker')
     print(f"    Generated {len(df)} days of synthetic data")
     return df
 
-def try_download_real_data(ticker: str, days: int = 365) -> pd.DataFrame:
+def download_real_data(tickers: list, days: int = 365, fetcher: MarketDataFetcher = None) -> dict:
     """
-    Prova a scaricare dati reali usando strategie multiple
+    Scarica dati reali per più ticker insieme
+    Il fetcher gestisce download multi-ticker, rate limiting, retry e cache locale
     """
-    try:
-        import yfinance as yf
-
-        print(f"  Attempting to download real data for {ticker}...")
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-
-        # Prova con diverse configurazioni
-        attempts = [
-            # Tentativo 1: standard
-            {'auto_adjust': True, 'actions': False},
-            # Tentativo 2: con repair
-            {'auto_adjust': True, 'actions': False, 'repair': True},
-            # Tentativo 3: senza auto_adjust
-            {'auto_adjust': False, 'actions': False},
-        ]
-
-        for i, params in enumerate(attempts):
-            try:
-                print(f"    Attempt {i+1}/{len(attempts)}...")
-                df = yf.download(
-                    ticker,
-                    start=start_date,
-                    end=end_date,
-                    progress=False,
-                    keepna=False,
-                    **params
-                )
-
-                if df is not None and not df.empty and len(df) >= 200:
-                    print(f"    ✓ Successfully downloaded {len(df)} days")
-                    # Rinomina colonne se necessario
-                    if 'Adj Close' in df.columns:
-                        df = df.drop('Adj Close', axis=1)
-                    df.reset_index(inplace=True)
-                    return df
-                else:
-                    print(f"    ✗ Insufficient data (got {len(df) if df is not None else 0} rows)")
+    fetcher = fetcher or get_fetcher()
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days)
 
-            except Exception as e:
-                print(f"    ✗ Attempt {i+1} failed: {str(e)[:100]}")
+    print(f"  Attempting to download real data for {len(tickers)} tickers...")
+    frames = fetcher.fetch(tickers, start_date, end_date)
 
-            # Pausa tra tentativi
-            if i < len(attempts) - 1:
-                time.sleep(2)
+    result = {}
+    for ticker, df in frames.items():
+        if len(df) >= 200:
+            result[ticker] = df
+        else:
+            print(f"    ✗ Insufficient data for {ticker} (got {len(df)} rows)")
+    print(f"    ✓ Downloaded {len(result)}/{len(tickers)} tickers")
+    return result
 
-        print(f"  All download attempts failed for {ticker}")
-        return None
+def try_download_real_data(ticker: str, days: int = 365, fetcher: MarketDataFetcher = None) -> pd.DataFrame:
+    """
+    Prova a scaricare dati reali per un singolo ticker
+    """
+    return download_real_data([ticker], days, fetcher).get(ticker)
 
-    except Exception as e:
-        print(f"  Error in download function: {e}")
-        return None
+STAGING_COLUMNS = ['instrumentId', 'date', 'open', 'high', 'low', 'close', 'volume',
+                   'originalOpen', 'originalHigh', 'originalLow', 'originalClose', 'originalCurrency']
+
+def prepare_price_frame(instrument_id, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converte un DataFrame OHLCV (formato yfinance o sintetico) nelle colonne
+    di price_history, senza iterare sulle righe.
+    instrument_id può essere un singolo id o un array con un id per riga
+    """
+    if 'Date' not in df.columns:
+        df = df.reset_index().rename(columns={'index': 'Date', 'Datetime': 'Date'})
+
+    frame = pd.DataFrame({
+        'instrumentId': instrument_id,
+        'date': pd.to_datetime(df['Date']).to_numpy(dtype='datetime64[D]'),
+        'open': df['Open'].to_numpy(dtype=np.float64),
+        'high': df['High'].to_numpy(dtype=np.float64),
+        'low': df['Low'].to_numpy(dtype=np.float64),
+        'close': df['Close'].to_numpy(dtype=np.float64),
+        'volume': df['Volume'].fillna(0).to_numpy(dtype=np.float64).round(),
+    })
+    # Un solo record per giorno, altrimenti ON CONFLICT aggiorna due volte la stessa riga
+    return frame.drop_duplicates(subset=['instrumentId', 'date'], keep='last')
+
+def save_prices_bulk(db, frame: pd.DataFrame) -> int:
+    """
+    Upsert bulk in price_history: COPY in una tabella temporanea di staging,
+    poi un unico INSERT ... SELECT ... ON CONFLICT DO UPDATE
+    """
+    start = time.perf_counter()
+
+    # Frame non convertiti (già in EUR): nessun prezzo originale
+    if 'originalCurrency' not in frame.columns:
+        frame = frame.assign(**{column: np.nan for column in ORIGINAL_COLUMNS}, originalCurrency=BASE_CURRENCY)
+
+    buffer = io.StringIO()
+    frame[STAGING_COLUMNS].to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d')
+    buffer.seek(0)
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS price_history_staging (
+                "instrumentId" TEXT NOT NULL,
+                date DATE NOT NULL,
+                open DOUBLE PRECISION,
+                high DOUBLE PRECISION,
+                low DOUBLE PRECISION,
+                close DOUBLE PRECISION NOT NULL,
+                volume DOUBLE PRECISION,
+                "originalOpen" DOUBLE PRECISION,
+                "originalHigh" DOUBLE PRECISION,
+                "originalLow" DOUBLE PRECISION,
+                "originalClose" DOUBLE PRECISION,
+                "originalCurrency" TEXT
+            ) ON COMMIT DELETE ROWS
+        """)
+        cursor.copy_expert(
+            'COPY price_history_staging ("instrumentId", date, open, high, low, close, volume, '
+            '"originalOpen", "originalHigh", "originalLow", "originalClose", "originalCurrency") FROM STDIN WITH CSV',
+            buffer
+        )
+        cursor.execute("""
+            INSERT INTO price_history
+            (id, "instrumentId", date, open, high, low, close, volume, "originalClose", "originalOpen",
+             "originalHigh", "originalLow", "originalCurrency")
+            SELECT gen_random_uuid(), "instrumentId", date, open, high, low, close, volume,
+                   "originalClose", "originalOpen", "originalHigh", "originalLow", "originalCurrency"
+            FROM price_history_staging
+            ON CONFLICT ("instrumentId", date)
+            DO UPDATE SET
+                open = EXCLUDED.open,
+                high = EXCLUDED.high,
+                low = EXCLUDED.low,
+                close = EXCLUDED.close,
+                volume = EXCLUDED.volume,
+                "originalClose" = EXCLUDED."originalClose",
+                "originalOpen" = EXCLUDED."originalOpen",
+                "originalHigh" = EXCLUDED."originalHigh",
+                "originalLow" = EXCLUDED."originalLow",
+                "originalCurrency" = EXCLUDED."originalCurrency"
+        """)
+        saved_count = cursor.rowcount
+    finally:
+        cursor.close()
+
+    db.commit()
 
-def save_prices_to_db(db, instrument_id: str, ticker: str, df: pd.DataFrame):
+    elapsed = time.perf_counter() - start
+    rate = saved_count / elapsed if elapsed > 0 else float('inf')
+    print(f"  ✓ Saved {saved_count} records to database in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+    return saved_count
+
+def save_prices_to_db(db, instrument_id: str, ticker: str, df: pd.DataFrame, currency: str = BASE_CURRENCY):
     """
-    Salva i prezzi nel database
+    Salva i prezzi nel database, convertiti in EUR se quotati in un'altra valuta
     """
     print(f"  Saving {len(df)} records to database...")
 
+    try:
+        frame = prepare_price_frame(instrument_id, df)
+        if currency and currency != BASE_CURRENCY:
+            frame = convert_to_eur(frame, {instrument_id: currency})
+        return save_prices_bulk(db, frame)
+    except Exception as e:
+        db.rollback()
+        print(f"    Warning: Could not save records for {ticker}: {e}")
+        return 0
+
+def seed_synthetic_universe(db, instrument_ids: list, days: int = 365, seed: int = None,
+                            chunk_size: int = 100) -> int:
+    """
+    Genera e salva dati sintetici per tutti gli strumenti, a blocchi di chunk_size
+    (pensato per dataset di carico, es. 1.000 ETF x 20 anni)
+    """
+    rng = np.random.default_rng(seed)
     saved_count = 0
-    for _, row in df.iterrows():
-        try:
-            # Usa upsert per evitare duplicati
-            db.execute(
-                text("""
-                INSERT INTO price_history
-                (id, "instrumentId", date, open, high, low, close, volume, "originalClose", "originalOpen",
-                 "originalHigh", "originalLow", "originalCurrency")
-                VALUES (gen_random_uuid(), :instrument_id, :date, :open, :high, :low, :close, :volume, NULL, NULL, NULL, NULL, 'EUR')
-                ON CONFLICT ("instrumentId", date)
-                DO UPDATE SET
-                    open = EXCLUDED.open,
-                    high = EXCLUDED.high,
-                    low = EXCLUDED.low,
-                    close = EXCLUDED.close,
-                    volume = EXCLUDED.volume
-                """),
-                {
-                    'instrument_id': instrument_id,
-                    'date': row['Date'],
-                    'open': float(row['Open']),
-                    'high': float(row['High']),
-                    'low': float(row['Low']),
-                    'close': float(row['Close']),
-                    'volume': int(row['Volume']) if not pd.isna(row['Volume']) else 0
-                }
-            )
-            saved_count += 1
-        except Exception as e:
-            print(f"    Warning: Could not save record for {row['Date']}: {e}")
-            continue
+    for i in range(0, len(instrument_ids), chunk_size):
+        chunk = list(instrument_ids[i:i + chunk_size])
+        print(f"  Generating synthetic data for instruments {i + 1}-{i + len(chunk)}...")
 
-    db.commit()
-    print(f"  ✓ Saved {saved_count} records to database")
+        # Le etichette sono gli id degli strumenti (i ticker possono mancare o ripetersi)
+        df = generate_synthetic_universe(chunk, days, seed=rng.integers(2**32))
+        saved_count += save_prices_bulk(db, prepare_price_frame(df['Ticker'].astype(str).to_numpy(), df))
+    return saved_count
 
-def seed_historical_data(use_synthetic=False, days=365):
+def seed_historical_data(use_synthetic=False, days=365, seed=None):
     """
     Popola il database con dati storici
 
     Args:
         use_synthetic: Se True, usa solo dati sintetici. Se False, prova prima dati reali
         days: Numero di giorni di storico da scaricare
+        seed: Seed per i dati sintetici (dataset riproducibili)
     """
     print(f"🌱 Starting historical data seeding...")
     print(f"   Mode: {'Synthetic' if use_synthetic else 'Real (with synthetic fallback)'}")
@@ -179,7 +254,7 @@ def seed_historical_data(use_synthetic=False, days=365):
     try:
         # Ottieni tutti gli strumenti ETF
         instruments = db.execute(
-            text("SELECT id, ticker, name FROM instrument WHERE type = 'ETF'")
+            text("SELECT id, ticker, name, currency FROM instrument WHERE type = 'ETF'")
         ).fetchall()
 
         if not instruments:
@@ -188,31 +263,36 @@ def seed_historical_data(use_synthetic=False, days=365):
 
         print(f"📊 Found {len(instruments)} ETF instruments\n")
 
-        success_count = 0
-        for i, (instrument_id, ticker, name) in enumerate(instruments, 1):
-            print(f"[{i}/{len(instruments)}] Processing {ticker} - {name}")
+        if use_synthetic:
+            # Modalità solo sintetica: un'unica generazione vettorizzata per tutti gli strumenti
+            seed_synthetic_universe(db, [instrument_id for instrument_id, _, _, _ in instruments], days, seed)
+            success_count = len(instruments)
+        else:
+            # Prova prima con dati reali, scaricati tutti insieme
+            real_data = download_real_data([ticker for _, ticker, _, _ in instruments], days)
+
+            success_count = 0
+            for i, (instrument_id, ticker, name, currency) in enumerate(instruments, 1):
+                print(f"[{i}/{len(instruments)}] Processing {ticker} - {name}")
 
-            df = None
+                df = real_data.get(ticker)
 
-            # Prova prima con dati reali (se richiesto)
-            if not use_synthetic:
-                df = try_download_real_data(ticker, days)
+                # Usa dati sintetici se necessario (già in EUR)
                 if df is None:
                     print(f"  → Falling back to synthetic data")
-                    time.sleep(1)  # Pausa per evitare rate limiting
-
-            # Usa dati sintetici se necessario
-            if df is None or use_synthetic:
-                df = generate_synthetic_prices(ticker, days)
-
-            # Salva nel database
-            if df is not None and len(df) > 0:
-                save_prices_to_db(db, instrument_id, ticker, df)
-                success_count += 1
-            else:
-                print(f"  ✗ No data available for {ticker}")
+                    # Un seed per ticker, altrimenti tutti i fallback avrebbero la stessa serie
+                    ticker_seed = None if seed is None else seed + i
+                    df = generate_synthetic_prices(ticker, days, seed=ticker_seed)
+                    currency = BASE_CURRENCY
+
+                # Salva nel database (i cambi sono caricati una volta per valuta)
+                if df is not None and len(df) > 0:
+                    save_prices_to_db(db, instrument_id, ticker, df, currency)
+                    success_count += 1
+                else:
+                    print(f"  ✗ No data available for {ticker}")
 
-            print()  # Linea vuota per leggibilità
+                print()  # Linea vuota per leggibilità
 
         print(f"\n✅ Seeding completed!")
         print(f"   Success: {success_count}/{len(instruments)} instruments")
@@ -252,4 +332,12 @@ if __name__ == "__main__":
         except (ValueError, IndexError):
             print("Warning: Invalid --days argument, using default 365")
 
-    seed_historical_data(use_synthetic=use_synthetic, days=days)
+    seed = None
+    if '--seed' in sys.argv:
+        try:
+            idx = sys.argv.index('--seed')
+            seed = int(sys.argv[idx + 1])
+        except (ValueError, IndexError):
+            print("Warning: Invalid --seed argument, ignoring")
+
+    seed_historical_data(use_synthetic=use_synthetic, days=days, seed=seed)
@@ -0,0 +1,338 @@
+"""
+Positions, portfolio valuation and position_snapshot generation.
+
+The transactions of many portfolios are loaded in one ordered query and
+grouped by (portfolio, instrument) pair. A pair's quantity is the running
+sum of its signed quantities; its average cost is the weighted average of
+the API (transactions.service): a buy adds its cost, a sell removes its
+units at the average cost, which it therefore doesn't change, and the cost
+restarts once the pair is flat. Positions on any set of days come from a single
+searchsorted over (pair, day) keys, so valuing every portfolio today, or on
+every trading day of a multi-year backfill, is array math over a
+(days x pairs) grid. Prices are the latest close on or before each day,
+falling back to the average cost for instruments without one (as the API
+does). Snapshots and positions are written with multi-row inserts.
+"""
+import json
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+from config import settings
+from database import insert_values
+from optimizer import BUCKETS, DEFAULT_ALLOCATION, instrument_bucket
+from price_store import load_window
+from metrics import span
+
+# Quantities this small are a closed position
+FLAT = 1e-9
+
+# Days of prices loaded before a backfill starts, so its first day has a last close
+PRICE_LEAD_DAYS = 10
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+PORTFOLIOS_SQL = text("""
+    SELECT p.id, p."userId", (
+        SELECT ipv.config
+        FROM ips_policy ip
+        JOIN ips_policy_version ipv ON ip.id = ipv."policyId"
+        WHERE ip."userId" = p."userId" AND ipv."isActive" = true
+        LIMIT 1
+    )
+    FROM portfolio p
+    WHERE (CAST(:user_id AS TEXT) IS NULL OR p."userId" = :user_id) AND p.id > :after
+    ORDER BY p.id
+    LIMIT :limit
+""")
+TRANSACTIONS_SQL = text("""
+    SELECT t."portfolioId", t."instrumentId", t.side, t.quantity, t."totalEur", t."executedAt"
+    FROM "transaction" t
+    WHERE t."portfolioId" IN :portfolio_ids
+    ORDER BY t."portfolioId", t."instrumentId", t."executedAt", t.id
+""").bindparams(bindparam("portfolio_ids", expanding=True))
+INSTRUMENTS_SQL = text("""
+    SELECT id, type, category FROM instrument WHERE id IN :instrument_ids
+""").bindparams(bindparam("instrument_ids", expanding=True))
+LATEST_CLOSES_SQL = text("""
+    SELECT DISTINCT ON ("instrumentId") "instrumentId", close
+    FROM price_history
+    WHERE "instrumentId" IN :instrument_ids
+    ORDER BY "instrumentId", date DESC
+""").bindparams(bindparam("instrument_ids", expanding=True))
+DELETE_POSITIONS_SQL = text("""
+    DELETE FROM position WHERE "portfolioId" IN :portfolio_ids
+""").bindparams(bindparam("portfolio_ids", expanding=True))
+
+class Holdings:
+    """
+    Transactions of many portfolios grouped by (portfolio, instrument) pair,
+    in execution order, with the position of the pair after each of them.
+    Pairs are ordered by portfolio; pair_starts[k]:pair_starts[k+1] are the
+    pairs of portfolio_ids[k].
+    """
+
+    def __init__(self, transactions: pd.DataFrame):
+        portfolio = transactions['portfolioId'].to_numpy(dtype=object)
+        instrument = transactions['instrumentId'].to_numpy(dtype=object)
+        sell = (transactions['side'] == 'SELL').to_numpy()
+        quantity = transactions['quantity'].to_numpy(dtype=np.float64)
+        total = transactions['totalEur'].to_numpy(dtype=np.float64)
+        self.days = _days(pd.to_datetime(transactions['executedAt']).to_numpy())
+
+        n = len(transactions)
+        new_pair = np.ones(n, dtype=bool)
+        new_pair[1:] = (portfolio[1:] != portfolio[:-1]) | (instrument[1:] != instrument[:-1])
+        self.pair = np.cumsum(new_pair) - 1
+        starts = np.flatnonzero(new_pair)
+        self.ends = np.append(starts[1:], n) - 1
+
+        self.quantity = _group_cumsum(np.where(sell, -quantity, quantity), new_pair)
+
+        # Average cost restarts whenever the pair was flat before the transaction
+        new_lot = new_pair.copy()
+        new_lot[1:] |= np.abs(self.quantity[:-1]) <= FLAT
+        # Cost held: cost[k] = cost[k-1] * kept[k] + bought cost[k], where a sell keeps
+        # the fraction of units left. Solved per lot with a running product of kept
+        held_before = np.where(new_lot, 0.0, np.roll(self.quantity, 1))
+        partial = sell & (held_before > FLAT) & (self.quantity > FLAT)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_kept = _group_cumsum(np.where(partial, np.log(self.quantity / held_before), 0.0), new_lot)
+        cost = np.exp(log_kept) * _group_cumsum(np.where(sell, 0.0, total) * np.exp(-log_kept), new_lot)
+        # A sell leaves the average cost of the last buy of the lot (0 before any)
+        last_buy = np.maximum.accumulate(np.where(sell, -1, np.arange(n)))
+        lot_start = np.maximum.accumulate(np.where(new_lot, np.arange(n), 0))
+        bought = ~sell & (self.quantity > FLAT)
+        avg_at_buy = np.divide(cost, self.quantity, out=np.zeros(n), where=bought)
+        self.avg_cost = np.where(last_buy >= lot_start, avg_at_buy[np.maximum(last_buy, 0)], 0.0)
+
+        self.pair_portfolio = portfolio[starts]
+        self.pair_instrument = instrument[starts]
+        new_portfolio = np.ones(len(starts), dtype=bool)
+        new_portfolio[1:] = self.pair_portfolio[1:] != self.pair_portfolio[:-1]
+        self.pair_starts = np.append(np.flatnonzero(new_portfolio), len(starts))
+        self.portfolio_ids = list(self.pair_portfolio[new_portfolio])
+        self.pair_owner = np.cumsum(new_portfolio) - 1
+        # Earliest transaction of each portfolio, across all its pairs
+        pair_first_day = np.minimum.reduceat(self.days, starts) if n else self.days
+        self.first_day = np.minimum.reduceat(pair_first_day, self.pair_starts[:-1]) if n else self.days
+
+    @property
+    def pairs(self) -> int:
+        return len(self.pair_instrument)
+
+    def current(self) -> tuple:
+        """(quantity, average cost) of every pair after its last transaction"""
+        return self.quantity[self.ends], self.avg_cost[self.ends]
+
+    def at(self, days: np.ndarray) -> tuple:
+        """(quantity, average cost) of every pair at the end of each day, as (days x pairs) arrays"""
+        base = min(days.min(), self.days.min())
+        span_days = int(max(days.max(), self.days.max()) - base) + 2
+        keys = self.pair * span_days + (self.days - base)
+        pairs = np.arange(self.pairs)
+        queries = pairs[None, :] * span_days + (days - base)[:, None]
+        idx = np.searchsorted(keys, queries, side='right') - 1
+        found = (idx >= 0) & (self.pair[np.maximum(idx, 0)] == pairs[None, :])
+        idx = np.maximum(idx, 0)
+        return np.where(found, self.quantity[idx], 0.0), np.where(found, self.avg_cost[idx], 0.0)
+
+def load_holdings(db: Session, portfolio_ids: list) -> Holdings:
+    """Holdings of the given portfolios from their transactions, in one query"""
+    rows = db.execute(TRANSACTIONS_SQL, {"portfolio_ids": portfolio_ids}).fetchall() if portfolio_ids else []
+    return Holdings(pd.DataFrame(
+        rows, columns=['portfolioId', 'instrumentId', 'side', 'quantity', 'totalEur', 'executedAt']
+    ))
+
+def latest_closes(db: Session, instrument_ids: list) -> np.ndarray:
+    """Latest price_history close of each instrument, NaN if it has none"""
+    rows = dict(db.execute(LATEST_CLOSES_SQL, {"instrument_ids": instrument_ids}).fetchall()) if instrument_ids else {}
+    return np.array([rows.get(i, np.nan) for i in instrument_ids], dtype=np.float64)
+
+def value_holdings(holdings: Holdings, quantity: np.ndarray, avg_cost: np.ndarray, prices: np.ndarray) -> tuple:
+    """
+    (prices, values, totals) for (days x pairs) quantities: prices fall back
+    to the average cost where there is no close, totals are (days x portfolios)
+    """
+    prices = np.where(np.isnan(prices), avg_cost, prices)
+    values = quantity * prices
+    totals = np.add.reduceat(values, holdings.pair_starts[:-1], axis=1) if holdings.pairs else values
+    return prices, values, totals
+
+def pair_buckets(db: Session, holdings: Holdings, instrument_ids: list) -> np.ndarray:
+    """Index in BUCKETS of each pair's instrument"""
+    info = {row[0]: instrument_bucket(row[1], row[2])
+            for row in db.execute(INSTRUMENTS_SQL, {"instrument_ids": instrument_ids}).fetchall()}
+    return np.array([BUCKETS.index(info.get(i, 'equity')) for i in holdings.pair_instrument], dtype=np.int64)
+
+def ips_bucket_targets(config) -> list:
+    """Target weight (summing to 1) of each bucket from an IPS config's assetAllocation"""
+    allocation = (config or {}).get("assetAllocation", DEFAULT_ALLOCATION)
+    raw = np.array([max(float(allocation.get(b, 0) or 0), 0.0) for b in BUCKETS])
+    return list(raw / raw.sum()) if raw.sum() > 0 else [1 / len(BUCKETS)] * len(BUCKETS)
+
+def current_bucket_values(db: Session, holdings: Holdings) -> np.ndarray:
+    """
+    Current EUR value of each portfolio's holdings per bucket, as a
+    (portfolios x buckets) array in holdings.portfolio_ids order
+    """
+    values = np.zeros((len(holdings.portfolio_ids), len(BUCKETS)))
+    if not holdings.pairs:
+        return values
+    instrument_ids = sorted(set(holdings.pair_instrument))
+    closes = dict(zip(instrument_ids, latest_closes(db, instrument_ids)))
+    quantity, avg_cost = holdings.current()
+    prices = np.array([closes[i] for i in holdings.pair_instrument])
+    _, pair_values, _ = value_holdings(holdings, quantity[None, :], avg_cost[None, :], prices[None, :])
+    np.add.at(values, (holdings.pair_owner, pair_buckets(db, holdings, instrument_ids)), pair_values[0])
+    return values
+
+def bucket_drift(holdings: Holdings, weights: np.ndarray, buckets: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    Each pair's share of its bucket's drift from target: weight * (1 - target / bucket weight),
+    which sums to (bucket weight - bucket target) over the bucket's pairs.
+    buckets: bucket index of each pair, targets: (portfolios x buckets) target weights.
+    """
+    group = holdings.pair_owner * len(BUCKETS) + buckets
+    order = np.argsort(group, kind='stable')
+    starts = np.flatnonzero(np.r_[True, group[order][1:] != group[order][:-1]])
+    sums = np.add.reduceat(weights[:, order], starts, axis=1)
+    bucket_weight = np.empty_like(weights)
+    bucket_weight[:, order] = np.repeat(sums, np.diff(np.append(starts, len(order))), axis=1)
+    target = targets[holdings.pair_owner, buckets]
+    ratio = np.divide(target, bucket_weight, out=np.zeros_like(weights), where=bucket_weight > 0)
+    return weights * (1 - ratio)
+
+def run_snapshots(db: Session, run_id: str, user_id: str = None, backfill: bool = False) -> int:
+    """
+    Rebuild positions from transactions and write position_snapshot rows for
+    every portfolio (or only user_id's): today's, or with backfill=True one
+    per trading day since each portfolio's first transaction.
+    Portfolios are processed in chunks of SNAPSHOT_CHUNK_SIZE. Returns the
+    number of snapshots written.
+    """
+    print(f"📸 Starting {'backfill ' if backfill else ''}snapshot engine for run {run_id}")
+    written = 0
+    after = ""
+    while True:
+        portfolios = db.execute(
+            PORTFOLIOS_SQL,
+            {"user_id": user_id, "after": after, "limit": settings.snapshot_chunk_size}
+        ).fetchall()
+        if not portfolios:
+            break
+        after = portfolios[-1][0]
+
+        with span("snapshot_load", portfolios=len(portfolios)):
+            holdings = load_holdings(db, [p[0] for p in portfolios])
+        if not holdings.pairs:
+            continue
+        configs = {p[0]: p[2] for p in portfolios}
+        written += _snapshot_chunk(db, holdings, configs, backfill)
+        print(f"  Wrote {written} snapshots")
+
+    print(f"✅ Snapshots completed: {written} snapshots")
+    return written
+
+def _snapshot_chunk(db: Session, holdings: Holdings, configs: dict, backfill: bool) -> int:
+    instrument_ids = sorted(set(holdings.pair_instrument))
+    column = {instrument_id: i for i, instrument_id in enumerate(instrument_ids)}
+    pair_column = np.array([column[i] for i in holdings.pair_instrument], dtype=np.int64)
+    today = date.today()
+
+    with span("snapshot_prices", instruments=len(instrument_ids), backfill=backfill):
+        if backfill:
+            first = pd.Timestamp(_EPOCH + holdings.days.min()).date()
+            window = load_window(db, instrument_ids, first - timedelta(days=PRICE_LEAD_DAYS), today)
+            dates, closes = window.close_matrix(instrument_ids)
+            closes = pd.DataFrame(closes).ffill().to_numpy()
+            days = _days(dates.to_numpy())
+            keep = days >= holdings.days.min()
+            days, closes = days[keep], closes[keep]
+            if not len(days):
+                days, closes = np.array([_day(today)]), np.full((1, len(instrument_ids)), np.nan)
+        else:
+            days = np.array([_day(today)])
+            closes = latest_closes(db, instrument_ids)[None, :]
+
+    with span("snapshot_value", pairs=holdings.pairs, days=len(days)):
+        quantity, avg_cost = holdings.at(days)
+        prices, values, totals = value_holdings(holdings, quantity, avg_cost, closes[:, pair_column])
+        weights = np.divide(values, totals[:, holdings.pair_owner], out=np.zeros_like(values),
+                            where=totals[:, holdings.pair_owner] > 0)
+        buckets = pair_buckets(db, holdings, instrument_ids)
+        targets = np.array([ips_bucket_targets(configs.get(p)) for p in holdings.portfolio_ids])
+        drift = bucket_drift(holdings, weights, buckets, targets)
+
+    with span("snapshot_write"):
+        rows = _snapshot_rows(holdings, days, quantity, prices, values, totals, weights, drift)
+        for i in range(0, len(rows), settings.snapshot_write_chunk_size):
+            insert_values(
+                db,
+                'INSERT INTO position_snapshot (id, "portfolioId", "snapshotDate", "totalValueEur", items)',
+                "(gen_random_uuid(), :portfolio_id, :snapshot_date, :total_value, CAST(:items AS jsonb))",
+                rows[i:i + settings.snapshot_write_chunk_size],
+                suffix='ON CONFLICT ("portfolioId", "snapshotDate") DO UPDATE '
+                       'SET "totalValueEur" = EXCLUDED."totalValueEur", items = EXCLUDED.items'
+            )
+        _write_positions(db, holdings)
+        db.commit()
+    return len(rows)
+
+def _snapshot_rows(holdings: Holdings, days: np.ndarray, quantity: np.ndarray, prices: np.ndarray,
+                   values: np.ndarray, totals: np.ndarray, weights: np.ndarray, drift: np.ndarray) -> list:
+    rows = []
+    for k, portfolio_id in enumerate(holdings.portfolio_ids):
+        cols = slice(holdings.pair_starts[k], holdings.pair_starts[k + 1])
+        instruments = holdings.pair_instrument[cols]
+        # No snapshots before the portfolio's first transaction
+        for d in np.flatnonzero(days >= holdings.first_day[k]):
+            held = np.flatnonzero(np.abs(quantity[d, cols]) > FLAT)
+            rows.append({
+                "portfolio_id": portfolio_id,
+                "snapshot_date": pd.Timestamp(_EPOCH + days[d]).date(),
+                "total_value": round(float(totals[d, k]), 2),
+                "items": json.dumps([
+                    {
+                        "instrument_id": instruments[j],
+                        "qty": round(float(quantity[d, cols][j]), 6),
+                        "price": round(float(prices[d, cols][j]), 4),
+                        "value": round(float(values[d, cols][j]), 2),
+                        "weight": round(float(weights[d, cols][j]), 6),
+                        "drift": round(float(drift[d, cols][j]), 6),
+                    }
+                    for j in held
+                ]),
+            })
+    return rows
+
+def _write_positions(db: Session, holdings: Holdings):
+    """Replace the portfolios' position rows with the rebuilt open positions"""
+    quantity, avg_cost = holdings.current()
+    now = datetime.utcnow()
+    db.execute(DELETE_POSITIONS_SQL, {"portfolio_ids": holdings.portfolio_ids})
+    insert_values(
+        db,
+        'INSERT INTO position (id, "portfolioId", "instrumentId", quantity, "avgCostEur", "updatedAt")',
+        "(gen_random_uuid(), :portfolio_id, :instrument_id, :quantity, :avg_cost, :now)",
+        [
+            {"portfolio_id": portfolio_id, "instrument_id": instrument_id,
+             "quantity": float(q), "avg_cost": float(c), "now": now}
+            for portfolio_id, instrument_id, q, c
+            in zip(holdings.pair_portfolio, holdings.pair_instrument, quantity, avg_cost)
+            if abs(q) > FLAT
+        ]
+    )
+
+def _group_cumsum(values: np.ndarray, group_start: np.ndarray) -> np.ndarray:
+    """Running sum of values restarting at every True in group_start"""
+    total = np.cumsum(values)
+    start = np.maximum.accumulate(np.where(group_start, np.arange(len(values)), 0))
+    return total - (total[start] - values[start])
+
+def _days(dates: np.ndarray) -> np.ndarray:
+    return (np.asarray(dates).astype('datetime64[D]') - _EPOCH).astype(np.int64)
+
+def _day(value: date) -> int:
+    return int((np.datetime64(value, 'D') - _EPOCH).astype(np.int64))
@@ -0,0 +1,124 @@
+"""
+Worker supervisor: runs N worker processes, each with its own Redis
+connection and SQLAlchemy engine, restarts the ones that crash and stops
+them gracefully (in-flight jobs are allowed to finish).
+
+Standalone:  python supervisor.py
+Embedded:    started from main.py's lifespan when WORKER_PROCESSES > 0
+"""
+import multiprocessing
+import signal
+import threading
+import time
+from config import settings
+
+# Spawned (not forked) children import database.py themselves, so every
+# process builds its own engine and connection pool
+_ctx = multiprocessing.get_context("spawn")
+
+class WorkerStop:
+    """
+    Stop signal of one worker: its own event, set by a SIGTERM sent to that
+    worker, or the supervisor's shared one, set only when the supervisor
+    shuts down. Stopping one worker leaves the others (and the supervisor,
+    which restarts it) running.
+    """
+
+    def __init__(self, shared):
+        self.shared = shared
+        self.local = threading.Event()
+
+    def set(self):
+        self.local.set()
+
+    def is_set(self) -> bool:
+        return self.local.is_set() or self.shared.is_set()
+
+def _worker_main(stop_event, worker_id: int):
+    # Ctrl+C goes to the supervisor, which stops workers through stop_event;
+    # a direct SIGTERM stops only this worker, after its current job
+    stop = WorkerStop(stop_event)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    from worker import start_worker
+    start_worker(stop_event=stop, worker_id=worker_id)
+
+class WorkerSupervisor:
+    def __init__(self, processes: int = None, restart_delay: float = None, shutdown_timeout: float = None):
+        self.processes = processes or settings.worker_processes
+        self.restart_delay = settings.worker_restart_delay if restart_delay is None else restart_delay
+        self.shutdown_timeout = settings.worker_shutdown_timeout if shutdown_timeout is None else shutdown_timeout
+        self.stop_event = _ctx.Event()
+        self.workers = {}
+        self.restarts = 0
+        self._lock = threading.Lock()
+
+    def _spawn(self, worker_id: int):
+        process = _ctx.Process(
+            target=_worker_main,
+            args=(self.stop_event, worker_id),
+            name=f"aurora-worker-{worker_id}",
+            daemon=False
+        )
+        process.start()
+        self.workers[worker_id] = process
+        print(f"🧵 Started worker {worker_id} (pid {process.pid})")
+
+    def start(self):
+        with self._lock:
+            for worker_id in range(self.processes):
+                self._spawn(worker_id)
+
+    def check(self):
+        """Restart any worker that exited while the supervisor is running"""
+        with self._lock:
+            if self.stop_event.is_set():
+                return
+            for worker_id, process in list(self.workers.items()):
+                if process.is_alive():
+                    continue
+                print(f"💥 Worker {worker_id} (pid {process.pid}) exited with code {process.exitcode}, restarting")
+                process.join()
+                self.restarts += 1
+                time.sleep(self.restart_delay)
+                self._spawn(worker_id)
+
+    def monitor(self, interval: float = 1.0):
+        """Block, restarting crashed workers, until stop() is called"""
+        while not self.stop_event.is_set():
+            self.check()
+            self.stop_event.wait(interval)
+
+    def stop(self):
+        """Ask workers to finish their current job and exit; kill stragglers after shutdown_timeout"""
+        print("🛑 Stopping workers...")
+        self.stop_event.set()
+        with self._lock:
+            deadline = time.monotonic() + self.shutdown_timeout
+            for worker_id, process in self.workers.items():
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    print(f"⚠️ Worker {worker_id} did not stop in time, terminating")
+                    process.terminate()
+                    process.join()
+        print("✅ All workers stopped")
+
+    def alive(self) -> int:
+        return sum(1 for p in self.workers.values() if p.is_alive())
+
+def run_supervisor():
+    supervisor = WorkerSupervisor()
+
+    def handle_signal(*_):
+        supervisor.stop_event.set()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    supervisor.start()
+    supervisor.monitor()
+    supervisor.stop()
+
+if __name__ == "__main__":
+    run_supervisor()
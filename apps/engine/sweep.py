@@ -0,0 +1,167 @@
+"""
+Parameter sweep of the scoring thresholds and PAC settings against history.
+
+Scoring metrics (return, volatility, Sharpe, drawdown) depend only on the
+lookback window, so they are computed once per distinct lookback with the
+backtester and shared with the pool workers through memory-mapped files.
+Each parameter set then only re-buckets those metrics with its thresholds,
+picks its holdings and simulates the contributions. Every set is evaluated
+over the same rebalance dates (those the longest lookback allows).
+
+Usage:
+    python sweep.py --synthetic 15 300 --random 40
+    python sweep.py --grid --rank-by max_drawdown --output sweep.csv
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from config import settings
+from scoring_engine import PERFORMANCE_THRESHOLDS, VOLATILITY_THRESHOLDS, SHARPE_THRESHOLDS, DRAWDOWN_THRESHOLDS
+from backtest import load_closes, monthly_rebalance_dates, rebalance_metrics, simulate, synthetic_closes, target_weights
+
+THRESHOLD_PARAMS = ('performance', 'volatility', 'sharpe', 'drawdown')
+
+DEFAULT_SPACE = {
+    'performance': [PERFORMANCE_THRESHOLDS, (0, 5, 10, 15), (0, 15, 30, 45)],
+    'volatility': [VOLATILITY_THRESHOLDS, (8, 12, 16, 20), (12, 18, 24, 30)],
+    'sharpe': [SHARPE_THRESHOLDS, (0, 0.25, 0.5, 0.75), (0, 0.75, 1.5, 2.25)],
+    'drawdown': [DRAWDOWN_THRESHOLDS, (5, 10, 15, 20), (15, 20, 25, 30)],
+    'lookback_days': [180, 365],
+    'max_instruments': [4, 8, 12],
+    'min_allocation_pct': [2.5, 5.0, 10.0],
+}
+
+# Lower is better for these summary columns when ranking
+ASCENDING = ('volatility', 'max_drawdown', 'turnover', 'fees')
+
+# Set in pool workers by _init_worker
+_shared = None
+
+def grid(space: dict) -> list:
+    """Every combination of the space"""
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+
+def random_search(space: dict, samples: int, seed: int = 0) -> list:
+    """samples distinct combinations drawn uniformly from the space"""
+    rng = random.Random(seed)
+    total = int(np.prod([len(v) for v in space.values()]))
+    picked = set()
+    params = []
+    while len(params) < min(samples, total):
+        choice = tuple(rng.randrange(len(values)) for values in space.values())
+        if choice not in picked:
+            picked.add(choice)
+            params.append({name: space[name][i] for name, i in zip(space, choice)})
+    return params
+
+def run_sweep(closes: np.ndarray, dates: np.ndarray, params: list, rank_by: str = 'cagr',
+              processes: int = None) -> pd.DataFrame:
+    """Evaluate every parameter set and return the results ranked by rank_by"""
+    lookbacks = sorted({p.get('lookback_days', settings.scoring_lookback_days) for p in params})
+    start_idx = int(np.searchsorted(dates, dates[0] + np.timedelta64(max(lookbacks), 'D')))
+    rebalance_idx = monthly_rebalance_dates(dates, start_idx)
+
+    tmp = tempfile.mkdtemp(prefix="aurora-sweep-")
+    try:
+        np.save(os.path.join(tmp, "closes.npy"), np.ascontiguousarray(closes))
+        np.save(os.path.join(tmp, "dates.npy"), dates)
+        np.save(os.path.join(tmp, "rebalance.npy"), rebalance_idx)
+        for lookback in lookbacks:
+            started = time.perf_counter()
+            metrics = rebalance_metrics(closes, dates, rebalance_idx, lookback, processes)
+            np.save(os.path.join(tmp, f"metrics-{lookback}.npy"), metrics)
+            print(f"  Metrics for {lookback}-day lookback: {time.perf_counter() - started:.1f}s")
+
+        processes = processes if processes is not None else (settings.backtest_processes or os.cpu_count())
+        if processes <= 1:
+            _init_worker(tmp)
+            rows = [_evaluate(p) for p in params]
+        else:
+            with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_init_worker, initargs=(tmp,)) as pool:
+                rows = list(pool.map(_evaluate, params, chunksize=max(1, len(params) // (processes * 4))))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    results = pd.DataFrame(rows)
+    results = results.sort_values(rank_by, ascending=rank_by in ASCENDING, na_position='last')
+    return results.reset_index(drop=True)
+
+def _init_worker(path: str):
+    global _shared
+    _shared = {
+        'closes': np.load(os.path.join(path, "closes.npy"), mmap_mode='r'),
+        'dates': np.load(os.path.join(path, "dates.npy")),
+        'rebalance_idx': np.load(os.path.join(path, "rebalance.npy")),
+        'path': path,
+        'metrics': {},
+    }
+
+def _metrics(lookback: int) -> np.ndarray:
+    if lookback not in _shared['metrics']:
+        _shared['metrics'][lookback] = np.load(os.path.join(_shared['path'], f"metrics-{lookback}.npy"), mmap_mode='r')
+    return _shared['metrics'][lookback]
+
+def _evaluate(params: dict) -> dict:
+    thresholds = {name: params[name] for name in THRESHOLD_PARAMS if name in params}
+    weights = target_weights(
+        _metrics(params.get('lookback_days', settings.scoring_lookback_days)),
+        params.get('max_instruments'),
+        params.get('min_allocation_pct'),
+        thresholds,
+    )
+    result = simulate(_shared['closes'], _shared['dates'], _shared['rebalance_idx'], weights)
+    row = {
+        f"{name}_thresholds" if name in THRESHOLD_PARAMS else name: str(value) if isinstance(value, tuple) else value
+        for name, value in params.items()
+    }
+    row.update(result.summary())
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep scoring thresholds and PAC settings")
+    parser.add_argument("--synthetic", nargs=2, type=int, metavar=("YEARS", "INSTRUMENTS"))
+    parser.add_argument("--years", type=int, default=20)
+    search = parser.add_mutually_exclusive_group()
+    search.add_argument("--grid", action="store_true", help="Evaluate the full grid")
+    search.add_argument("--random", type=int, default=50, help="Number of random parameter sets")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rank-by", default="cagr")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--output", help="Write the full ranked table to this CSV file")
+    parser.add_argument("--processes", type=int)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.synthetic:
+        dates, closes = synthetic_closes(*args.synthetic)
+    else:
+        from database import SessionLocal
+        db = SessionLocal()
+        try:
+            dates, _, closes = load_closes(db, args.years)
+        finally:
+            db.close()
+
+    params = grid(DEFAULT_SPACE) if args.grid else random_search(DEFAULT_SPACE, args.random, args.seed)
+    print(f"🔬 Sweeping {len(params)} parameter sets over {closes.shape[1]} instruments x {closes.shape[0]} days")
+
+    results = run_sweep(closes, dates, params, args.rank_by, args.processes)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(results.head(args.top).to_string())
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f"  Results written to {args.output}")
+    print(f"✅ Sweep completed in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
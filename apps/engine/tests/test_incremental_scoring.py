@@ -0,0 +1,87 @@
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+from incremental_scoring import metrics_from_states, state_from_closes, update_state
+from scoring_engine import calculate_etf_score, lookback_window, score_metrics
+
+POINTS = ('performance_score', 'volatility_score', 'sharpe_score', 'drawdown_score', 'total_score')
+
+def _history(seed, start='2023-01-02', periods=700, drift=0.0003, vol=0.012) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    closes = 100 * np.cumprod(1 + rng.normal(drift, vol, periods))
+    return pd.Series(closes, index=pd.bdate_range(start, periods=periods), name='Close')
+
+def _window(history: pd.Series, today: date) -> pd.Series:
+    """The full path's window: the lookback ending today"""
+    first_day, today = lookback_window(today)
+    return history[(history.index >= pd.Timestamp(first_day)) & (history.index <= pd.Timestamp(today))]
+
+def _rebuild(history: pd.Series, today: date) -> dict:
+    window = _window(history, today)
+    return state_from_closes('X', window.index.to_numpy(), window.to_numpy())
+
+def _slide(state: dict, history: pd.Series, today: date):
+    """The rows _apply_deltas reads for one instrument, passed to update_state"""
+    first_day, today = lookback_window(today)
+    rows = [(ts.date(), float(close)) for ts, close in history.items()
+            if state['firstDate'] <= ts.date() <= today]
+    evicted = [row for row in rows if row[0] < first_day]
+    remaining = [row for row in rows if row[0] >= first_day]
+    new_rows = [row for row in remaining if row[0] > state['lastDate']]
+    return update_state(state, evicted, remaining[0] if remaining else None, new_rows)
+
+def _assert_matches_full(state: dict, history: pd.Series, today: date):
+    expected = calculate_etf_score('X', _window(history, today).to_frame())
+    result = score_metrics(*metrics_from_states([state]))[0]
+    assert [result[k] for k in POINTS] == [expected[k] for k in POINTS]
+    for name, value in expected['metrics'].items():
+        assert abs(result['metrics'][name] - value) <= 0.01, name
+
+@pytest.mark.parametrize("seed", range(4))
+def test_incremental_matches_full_recompute(seed):
+    history = _history(seed)
+    rng = np.random.default_rng(seed + 100)
+    today = date(2024, 3, 1)
+    state = _rebuild(history, today)
+    rebuilt = 0
+
+    for _ in range(120):
+        # Runs one to five days apart, bars arriving in between
+        today += timedelta(days=int(rng.integers(1, 6)))
+        state = _slide(state, history, today)
+        if state is None:
+            state = _rebuild(history, today)
+            rebuilt += 1
+        _assert_matches_full(state, history, today)
+
+    assert rebuilt < 120
+
+def test_stale_instrument_uses_window_ending_today():
+    # No bars after the history ends: the window keeps moving, as in the full path
+    history = _history(7, periods=400)
+    today = history.index[-1].date()
+    state = _rebuild(history, today)
+
+    for days in (10, 30, 90):
+        later = today + timedelta(days=days)
+        slid = _slide(state, history, later) or _rebuild(history, later)
+        assert slid['firstDate'] >= lookback_window(later)[0]
+        _assert_matches_full(slid, history, later)
+
+def test_evicting_the_drawdown_peak_requires_rebuild():
+    closes = np.concatenate([[100.0, 120.0], np.linspace(90, 110, 300)])
+    dates = pd.bdate_range('2024-01-01', periods=len(closes))
+    state = state_from_closes('X', dates.to_numpy(), closes)
+    assert state['peakDate'] == dates[1].date()
+
+    evicted = [(dates[0].date(), 100.0), (dates[1].date(), 120.0)]
+    boundary = (dates[2].date(), 90.0)
+    assert update_state(state, evicted, boundary, []) is None
+
+def test_window_with_no_rows_left_requires_rebuild():
+    closes = 100 + np.arange(10, dtype=np.float64)
+    dates = pd.bdate_range('2024-01-01', periods=len(closes))
+    state = state_from_closes('X', dates.to_numpy(), closes)
+    evicted = [(d.date(), c) for d, c in zip(dates, closes)]
+    assert update_state(state, evicted, None, []) is None
@@ -0,0 +1,19 @@
+import pytest
+from job_queue import JobLease, lock_key
+
+fakeredis = pytest.importorskip("fakeredis")
+
+def test_lease_released_on_exit():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    with JobLease(r, "1", lease_seconds=30):
+        assert r.get(lock_key("1")) is not None
+    assert r.get(lock_key("1")) is None
+
+def test_lease_taken_over_is_not_released():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    with JobLease(r, "1", lease_seconds=30) as lease:
+        # The lease expired and another worker picked the job up
+        lease._stop.set()
+        lease._thread.join()
+        r.set(lock_key("1"), "other-worker")
+    assert r.get(lock_key("1")) == "other-worker"
@@ -0,0 +1,22 @@
+import asyncio
+import main
+
+def test_inline_run_failure_marks_the_run_failed(monkeypatch):
+    failed = []
+
+    def execute_run(*args):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(main, "_create_run", lambda user_id, run_type: "run_1")
+    monkeypatch.setattr(main, "execute_run", execute_run)
+    monkeypatch.setattr(main, "mark_run_failed", lambda run_id, error: failed.append((run_id, error)))
+
+    async def scenario():
+        response = await main._start_run(main.RunRequest(userId="u", inline=True), "scoring")
+        assert response["runId"] == "run_1"
+        # What shutdown does: wait for inline runs, including the failure bookkeeping
+        while main._inline_runs:
+            await asyncio.gather(*main._inline_runs, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert failed == [("run_1", "db down")]
@@ -0,0 +1,43 @@
+from datetime import date, timedelta
+import pandas as pd
+from market_data import OHLCV_COLUMNS, MarketDataFetcher, MarketDataProvider
+
+class LaggingProvider(MarketDataProvider):
+    """Daily bars up to `latest`, however far the requested range goes"""
+
+    def __init__(self, latest: date):
+        self.latest = latest
+        self.calls = []
+
+    def download(self, tickers: list, start: date, end: date) -> dict:
+        self.calls.append((start, end))
+        days = pd.date_range(start, min(end, self.latest))
+        if days.empty:
+            return {}
+        frame = pd.DataFrame({column: 1.0 for column in OHLCV_COLUMNS}, index=days)
+        return {ticker: frame for ticker in tickers}
+
+def _fetcher(provider, tmp_path) -> MarketDataFetcher:
+    return MarketDataFetcher(provider, cache_dir=str(tmp_path), batch_size=10, max_workers=1,
+                             rate_per_sec=1000, max_retries=0)
+
+def test_coverage_ends_at_last_bar_returned(tmp_path):
+    start, end = date(2024, 1, 1), date(2024, 1, 31)
+    provider = LaggingProvider(end - timedelta(days=2))
+    fetcher = _fetcher(provider, tmp_path)
+
+    fetcher.fetch(['AAA'], start, end)
+    assert fetcher.cache.coverage('AAA') == (start, end - timedelta(days=2))
+
+    # The trailing days are requested again once the provider has them
+    provider.latest = end
+    result = fetcher.fetch(['AAA'], start, end)
+    assert provider.calls[-1] == (end - timedelta(days=1), end)
+    assert result['AAA'].index.max() == pd.Timestamp(end)
+    assert fetcher.cache.coverage('AAA') == (start, end)
+
+def test_no_coverage_without_bars(tmp_path):
+    provider = LaggingProvider(date(2023, 12, 1))
+    fetcher = _fetcher(provider, tmp_path)
+    assert fetcher.fetch(['AAA'], date(2024, 1, 1), date(2024, 1, 31)) == {}
+    assert fetcher.cache.coverage('AAA') is None
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from optimizer import DEFAULT_ALLOCATION, _project_simplex, _prune, optimize
+
+BUCKETS = ['equity', 'equity', 'equity', 'bonds', 'bonds', 'cash']
+
+def _universe(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    a = rng.normal(size=(n, n))
+    return rng.normal(0.05, 0.02, n), a @ a.T / n + np.eye(n) * 0.01
+
+def test_project_simplex_zero_total():
+    assert np.array_equal(_project_simplex(np.array([0.3, -0.1, 0.5]), 0.0), np.zeros(3))
+
+@pytest.mark.parametrize("method", ["mean_variance", "min_variance", "risk_parity"])
+def test_zero_target_bucket_gets_nothing(method):
+    # The default allocation has cash: 0
+    mu, cov = _universe(len(BUCKETS))
+    weights = optimize(method, BUCKETS, DEFAULT_ALLOCATION, mu, cov)
+    assert weights[-1] == 0
+    assert weights.sum() == pytest.approx(1)
+    assert weights[:3].sum() == pytest.approx(0.8)
+
+def test_prune_reserves_no_slot_for_zero_target_bucket():
+    buckets = np.array(['equity', 'equity', 'bonds', 'cash'])
+    w = np.array([0.5, 0.3, 0.2, 0.0])
+    drop = _prune(np.arange(4), w, buckets, {'equity': 0.8, 'bonds': 0.2, 'cash': 0.0},
+                  max_instruments=3, min_weight=0)
+    assert drop.tolist() == [3]
@@ -0,0 +1,47 @@
+import numpy as np
+import pac_engine
+from config import settings
+from pac_engine import allocation_weights
+
+def test_weights_proportional_to_score():
+    np.testing.assert_array_equal(allocation_weights([60, 30, 10], min_allocation_pct=0), [60, 30, 10])
+
+def test_small_allocations_dropped_and_renormalized():
+    np.testing.assert_array_equal(allocation_weights([60, 36, 4], min_allocation_pct=5), [62.5, 37.5, 0])
+
+def test_equal_weights_without_positive_total():
+    np.testing.assert_array_equal(allocation_weights([0, 0, 0, 0], min_allocation_pct=5), [25, 25, 25, 25])
+
+def _etf(n: int, score: float) -> tuple:
+    return (f"i{n}", f"T{n}", f"ETF {n}", "ETF", score, {}, "equity")
+
+def test_batch_uses_each_ips_optimizer(monkeypatch):
+    monkeypatch.setattr(settings, "pac_optimizer", "score")
+    monkeypatch.setattr(settings, "pac_max_instruments", 2)
+    monkeypatch.setattr(settings, "pac_optimizer_candidates", 3)
+    monkeypatch.setattr(settings, "pac_min_allocation_pct", 0)
+    calls = []
+
+    def optimized(db, top_etfs, method, target_allocation):
+        calls.append((method, len(top_etfs)))
+        return np.array([0.0, 0.0, 1.0])
+
+    monkeypatch.setattr(pac_engine, "_optimized_weights", optimized)
+    top_etfs = [_etf(0, 60), _etf(1, 40), _etf(2, 10)]
+    users = [
+        ("u1", {}, "p1"),
+        ("u2", {"optimizer": "min_variance"}, "p2"),
+        ("u3", {"optimizer": "min_variance"}, "p3"),
+        ("u4", {"optimizer": "score"}, None),
+    ]
+    allocations = {}
+    groups = pac_engine._group_by_allocation(None, top_etfs, users, allocations)
+
+    assert [[u[0] for u in group] for group in groups.values()] == [["u1"], ["u2", "u3"]]
+    assert calls == [("min_variance", 3)]
+    score, optimized = (allocations[key] for key in groups)
+    assert [etf[0] for etf in score[1]] == ["i0", "i1"]
+    np.testing.assert_allclose(score[3], [0.6, 0.4])
+    assert optimized[0] == "min_variance"
+    assert [etf[0] for etf in optimized[1]] == ["i2"]
+    np.testing.assert_allclose(optimized[3], [1.0])
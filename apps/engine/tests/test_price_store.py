@@ -0,0 +1,70 @@
+from datetime import date, timedelta
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from config import settings
+from price_store import _read_meta, sync_store
+
+TODAY = date(2024, 6, 28)
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "price_store_history_days", 60)
+    monkeypatch.setattr(settings, "price_store_resync_days", 7)
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE instrument (id TEXT PRIMARY KEY)'))
+        conn.execute(text('CREATE TABLE price_history (id TEXT, "instrumentId" TEXT NOT NULL, date DATE NOT NULL, '
+                          'open REAL, high REAL, low REAL, close REAL NOT NULL, volume REAL)'))
+        conn.execute(text("INSERT INTO instrument (id) VALUES ('a'), ('b')"))
+    session = sessionmaker(bind=engine)()
+    for n in range(30):
+        day = TODAY - timedelta(days=29 - n)
+        _add_bar(session, 'a', day, 100 + n)
+        if n % 2 == 0 and n < 28:
+            _add_bar(session, 'b', day, 50 + n)
+    yield session
+    session.close()
+    engine.dispose()
+
+def _add_bar(db, instrument_id: str, day: date, close: float):
+    db.execute(text('INSERT INTO price_history ("instrumentId", date, close) VALUES (:i, :d, :c)'),
+               {"i": instrument_id, "d": day, "c": close})
+    db.commit()
+
+def _closes(store, instrument_id: str) -> dict:
+    window = store.window([instrument_id], date.min, date.max)
+    return {d.astype('datetime64[D]').item(): c for d, c in zip(window.dates, window.close)}
+
+def test_unchanged_store_is_reused(db, tmp_path):
+    path = str(tmp_path / 'store')
+    version = sync_store(db, path).version
+    meta = _read_meta(path)
+    assert sync_store(db, path).version == version
+    assert _read_meta(path) == meta
+
+def test_new_and_late_bars_are_synced_in_place(db, tmp_path):
+    path = str(tmp_path / 'store')
+    version = sync_store(db, path).version
+
+    _add_bar(db, 'a', TODAY + timedelta(days=1), 200)
+    # b's bar for a day already synced, arriving late
+    _add_bar(db, 'b', TODAY - timedelta(days=1), 77)
+    store = sync_store(db, path)
+
+    assert store.version == version
+    assert _closes(store, 'a')[TODAY + timedelta(days=1)] == 200
+    assert _closes(store, 'b')[TODAY - timedelta(days=1)] == 77
+    assert sync_store(db, path).version == version
+
+def test_backfilled_history_rebuilds(db, tmp_path):
+    path = str(tmp_path / 'store')
+    version = sync_store(db, path).version
+
+    _add_bar(db, 'b', TODAY - timedelta(days=26), 42)
+    store = sync_store(db, path)
+
+    assert store.version == version + 1
+    assert _closes(store, 'b')[TODAY - timedelta(days=26)] == 42
+    assert len(_closes(store, 'a')) + len(_closes(store, 'b')) == 30 + 14 + 1
+    assert sync_store(db, path).version == version + 1
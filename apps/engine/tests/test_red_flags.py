@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from price_loader import load_price_window
+from red_flags import evaluate_rules, flag_frame
+
+TODAY = date(2024, 6, 28)
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'flags.db'}")
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE instrument (id TEXT PRIMARY KEY)'))
+        conn.execute(text('CREATE TABLE price_history (id TEXT, "instrumentId" TEXT NOT NULL, date DATE NOT NULL, '
+                          'open REAL, high REAL, low REAL, close REAL NOT NULL, volume REAL)'))
+        conn.execute(text('CREATE TABLE etf_metrics (id TEXT, "instrumentId" TEXT UNIQUE, ter REAL, aum REAL, '
+                          '"avgDailyVolume" REAL, "avgSpread" REAL, "trackingError" REAL, "inceptionDate" TIMESTAMP)'))
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+def _instrument(db, instrument_id: str, bars: int, last_bar: date = TODAY, inception: date = None):
+    db.execute(text('INSERT INTO instrument (id) VALUES (:i)'), {"i": instrument_id})
+    for n in range(bars):
+        db.execute(text('INSERT INTO price_history ("instrumentId", date, close, volume) VALUES (:i, :d, 100, 1e6)'),
+                   {"i": instrument_id, "d": last_bar - timedelta(days=bars - 1 - n)})
+    if inception:
+        db.execute(text('INSERT INTO etf_metrics ("instrumentId", "avgDailyVolume", "inceptionDate") '
+                        'VALUES (:i, 1e6, :d)'), {"i": instrument_id, "d": inception})
+    db.commit()
+
+def _flags(db, instrument_ids: list) -> dict:
+    window = load_price_window(db, instrument_ids, TODAY - timedelta(days=365), TODAY)
+    frame = flag_frame(db, instrument_ids, window, today=TODAY)
+    return {i: sorted(code for code, flagged in row.items() if flagged)
+            for i, row in evaluate_rules(frame).iterrows()}
+
+def test_short_history_without_inception_is_not_too_young(db):
+    # 30 stored bars is the start of our data, not the fund's age
+    _instrument(db, 'a', 30)
+    _instrument(db, 'young', 30, inception=TODAY - timedelta(days=30))
+    _instrument(db, 'old', 30, inception=date(2010, 1, 1))
+    flags = _flags(db, ['a', 'young', 'old'])
+    assert 'too_young' not in flags['a']
+    assert 'too_young' in flags['young']
+    assert 'too_young' not in flags['old']
+
+def test_stale_data_needs_a_stored_bar(db):
+    _instrument(db, 'fresh', 30)
+    _instrument(db, 'stale', 30, last_bar=TODAY - timedelta(days=60))
+    _instrument(db, 'outside_window', 30, last_bar=TODAY - timedelta(days=500))
+    # Scored on downloaded data: nothing stored, nothing known
+    _instrument(db, 'no_bars', 0)
+    flags = _flags(db, ['fresh', 'stale', 'outside_window', 'no_bars'])
+    assert 'stale_data' not in flags['fresh']
+    assert 'stale_data' in flags['stale']
+    assert 'stale_data' in flags['outside_window']
+    assert flags['no_bars'] == []
@@ -0,0 +1,17 @@
+import numpy as np
+from return_cache import ffill
+
+def test_ffill_keeps_leading_nans():
+    matrix = np.array([
+        [np.nan, 1.0, np.nan],
+        [2.0, np.nan, np.nan],
+        [np.nan, np.nan, 3.0],
+        [4.0, 5.0, np.nan],
+    ])
+    expected = np.array([
+        [np.nan, 1.0, np.nan],
+        [2.0, 1.0, np.nan],
+        [2.0, 1.0, 3.0],
+        [4.0, 5.0, 3.0],
+    ])
+    np.testing.assert_array_equal(ffill(matrix), expected)
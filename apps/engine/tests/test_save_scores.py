@@ -0,0 +1,65 @@
+import uuid
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+import scoring_engine
+from scoring_engine import save_scores
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'scores.db'}")
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.create_function("gen_random_uuid", 0, lambda: str(uuid.uuid4()))
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def _sqlite_json(conn, cursor, statement, parameters, context, executemany):
+        return statement.replace("AS jsonb)", "AS TEXT)"), parameters
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE etf_scoring_result (id TEXT, "runId" TEXT, "instrumentId" TEXT, bucket TEXT, '
+            'score DOUBLE PRECISION CHECK (score <= 100), breakdown TEXT, "redFlags" TEXT, "dataAsof" DATE)'
+        ))
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+def _scored(totals: list) -> list:
+    return [
+        (f"i{n}", f"T{n}", {'performance_score': 0, 'volatility_score': 0, 'sharpe_score': 0,
+                            'drawdown_score': 0, 'total_score': total, 'metrics': {}})
+        for n, total in enumerate(totals)
+    ]
+
+def _stored(db, run_id: str) -> list:
+    """Committed results of a run, read on another connection"""
+    with db.get_bind().connect() as conn:
+        return sorted(row[0] for row in conn.execute(
+            text('SELECT "instrumentId" FROM etf_scoring_result WHERE "runId" = :run_id'), {"run_id": run_id}
+        ))
+
+def test_failing_row_is_skipped_and_the_rest_committed(db):
+    assert save_scores(db, "run", _scored([50, 150, 60, 70]), chunk_size=2) == 3
+    assert _stored(db, "run") == ["i0", "i2", "i3"]
+
+def test_replay_replaces_the_run_results(db):
+    save_scores(db, "run", _scored([50, 60, 70]))
+    save_scores(db, "other", _scored([40]))
+    assert save_scores(db, "run", _scored([80, 90])) == 2
+    assert _stored(db, "run") == ["i0", "i1"]
+    assert _stored(db, "other") == ["i0"]
+
+def test_interrupted_save_keeps_previous_results(db, monkeypatch):
+    save_scores(db, "run", _scored([50, 60]))
+
+    def interrupted(db, rows):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(scoring_engine, "_insert_scores", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        save_scores(db, "run", _scored([80]))
+    db.rollback()
+    assert _stored(db, "run") == ["i0", "i1"]
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scoring_engine import (
+    DRAWDOWN_THRESHOLDS, PERFORMANCE_THRESHOLDS, SHARPE_THRESHOLDS, VOLATILITY_THRESHOLDS,
+    _same_score, build_close_matrix, calculate_etf_score, calculate_scores_batch,
+    check_batch_parity, metric_points,
+)
+
+def _frame(closes, start='2024-01-01', dates=None) -> pd.DataFrame:
+    index = pd.DatetimeIndex(dates) if dates is not None else pd.bdate_range(start, periods=len(closes))
+    return pd.DataFrame({'Close': np.asarray(closes, dtype=np.float64)}, index=index)
+
+def _random_closes(rng, n=260, drift=0.0004, vol=0.012):
+    return 100 * np.cumprod(1 + rng.normal(drift, vol, n))
+
+def _scalar_ladders(returns_1y, volatility, sharpe_ratio, max_drawdown) -> tuple:
+    """The if/elif ladders of calculate_etf_score, one value at a time"""
+    def higher(value, thresholds, points):
+        for threshold, pts in zip(reversed(thresholds), reversed(points[1:])):
+            if value > threshold:
+                return pts
+        return points[0]
+
+    def lower(value, thresholds, points):
+        for threshold, pts in zip(thresholds, points):
+            if value < threshold:
+                return pts
+        return points[-1]
+
+    return (
+        higher(returns_1y, PERFORMANCE_THRESHOLDS, (0, 10, 15, 20, 25)),
+        lower(volatility, VOLATILITY_THRESHOLDS, (25, 20, 15, 10, 5)),
+        higher(sharpe_ratio, SHARPE_THRESHOLDS, (0, 10, 15, 20, 25)),
+        lower(max_drawdown, DRAWDOWN_THRESHOLDS, (25, 20, 15, 10, 5)),
+    )
+
+@pytest.mark.parametrize("seed", range(5))
+def test_batch_matches_scalar_on_random_universe(seed):
+    rng = np.random.default_rng(seed)
+    frames = {
+        f"T{i}": _frame(_random_closes(rng, drift=rng.normal(0.0003, 0.0008), vol=rng.uniform(0.003, 0.03)))
+        for i in range(30)
+    }
+    assert check_batch_parity(frames) == []
+
+def test_batch_matches_scalar_with_gaps():
+    rng = np.random.default_rng(7)
+    dates = pd.bdate_range('2024-01-01', periods=260)
+    full = _frame(_random_closes(rng), dates=dates)
+    # Missing bars inside the window, a late listing and an early delisting:
+    # the aligned matrix has NaN where an instrument has no bar
+    holes = np.ones(260, dtype=bool)
+    holes[[5, 6, 7, 50, 120, 121, 200]] = False
+    frames = {
+        'FULL': full,
+        'HOLES': _frame(_random_closes(rng)[holes], dates=dates[holes]),
+        'LATE': _frame(_random_closes(rng, n=180), dates=dates[80:]),
+        'EARLY': _frame(_random_closes(rng, n=200), dates=dates[:200]),
+    }
+    assert check_batch_parity(frames) == []
+
+def test_batch_matches_scalar_with_nan_prices():
+    rng = np.random.default_rng(11)
+    closes = _random_closes(rng)
+    closes[[10, 11, 100]] = np.nan
+    frames = {'NAN': _frame(closes), 'CLEAN': _frame(_random_closes(rng))}
+    assert check_batch_parity(frames) == []
+
+def test_batch_matches_scalar_on_threshold_values():
+    # Flat over the window (return exactly 0) with an exact 25% drawdown on the way
+    closes = np.ones(260)
+    closes[100:150] = 0.75
+    frames = {'BOUNDARY': _frame(closes), 'FLAT': _frame(np.full(260, 50.0))}
+    scalar = calculate_etf_score('BOUNDARY', frames['BOUNDARY'])
+    assert scalar['metrics']['return_1y'] == 0
+    assert scalar['metrics']['max_drawdown'] == 25
+    assert check_batch_parity(frames) == []
+
+@pytest.mark.parametrize("offset", [-1e-9, 0.0, 1e-9])
+def test_points_match_ladders_at_thresholds(offset):
+    for values in zip(PERFORMANCE_THRESHOLDS, VOLATILITY_THRESHOLDS, SHARPE_THRESHOLDS, DRAWDOWN_THRESHOLDS):
+        values = [v + offset for v in values]
+        points = metric_points(*(np.array([v]) for v in values))
+        assert tuple(int(p[0]) for p in points) == _scalar_ladders(*values)
+
+def test_nan_metrics_fall_to_else_branch():
+    points = metric_points(*(np.array([np.nan]) for _ in range(4)))
+    assert tuple(int(p[0]) for p in points) == _scalar_ladders(np.nan, np.nan, np.nan, np.nan)
+
+def test_batch_results_in_input_order():
+    rng = np.random.default_rng(3)
+    frames = [_frame(_random_closes(rng, drift=d)) for d in (-0.002, 0.0, 0.002)]
+    _, matrix = build_close_matrix([f['Close'] for f in frames])
+    for frame, result in zip(frames, calculate_scores_batch(matrix)):
+        assert _same_score(calculate_etf_score('X', frame), result)
@@ -0,0 +1,30 @@
+import pytest
+from scoring_cache import CACHE_PREFIX, get_or_compute
+
+fakeredis = pytest.importorskip("fakeredis")
+
+LOCK_KEY = f"{CACHE_PREFIX}:k:lock"
+
+def test_computes_once_and_releases_lock():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [("id", "T", {"total_score": 50})]
+
+    assert get_or_compute(r, "k", compute) == [("id", "T", {"total_score": 50})]
+    assert get_or_compute(r, "k", compute) == [("id", "T", {"total_score": 50})]
+    assert len(calls) == 1
+    assert r.get(LOCK_KEY) is None
+
+def test_does_not_release_a_lock_taken_by_another_run():
+    r = fakeredis.FakeRedis(decode_responses=True)
+
+    def compute():
+        # Our lock expired mid-compute and another run took it
+        r.set(LOCK_KEY, "other-run")
+        return []
+
+    get_or_compute(r, "k", compute)
+    assert r.get(LOCK_KEY) == "other-run"
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+from snapshots import Holdings, _day
+
+def _holdings(rows):
+    return Holdings(pd.DataFrame(
+        rows, columns=['portfolioId', 'instrumentId', 'side', 'quantity', 'totalEur', 'executedAt']
+    ))
+
+def test_first_day_spans_all_pairs():
+    # Sorted by (portfolio, instrument): pair a comes first but b was bought earlier
+    holdings = _holdings([
+        ('p1', 'a', 'BUY', 1, 10, '2025-06-01'),
+        ('p1', 'b', 'BUY', 1, 10, '2025-01-01'),
+        ('p2', 'a', 'BUY', 1, 10, '2025-03-01'),
+    ])
+    assert list(holdings.first_day) == [_day(pd.Timestamp('2025-01-01').date()),
+                                        _day(pd.Timestamp('2025-03-01').date())]
+
+def test_quantity_and_average_cost():
+    holdings = _holdings([
+        ('p1', 'a', 'BUY', 10, 100, '2024-01-02'),
+        ('p1', 'a', 'BUY', 10, 300, '2024-01-05'),
+        ('p1', 'a', 'SELL', 20, 600, '2024-01-08'),
+        ('p1', 'a', 'BUY', 2, 50, '2024-01-10'),
+    ])
+    days = np.array([_day(pd.Timestamp(d).date()) for d in ('2024-01-01', '2024-01-05', '2024-01-09', '2024-01-10')])
+    quantity, avg_cost = holdings.at(days)
+    assert quantity[:, 0].tolist() == [0, 20, 0, 2]
+    # The lot bought after going flat starts a new average cost
+    assert avg_cost[1, 0] == 20 and avg_cost[3, 0] == 25
+
+def test_average_cost_after_partial_sell_matches_api():
+    # Weighted average as in the API: BUY 10 for 100, SELL 5, BUY 5 for 100 -> 150 / 10
+    holdings = _holdings([
+        ('p1', 'a', 'BUY', 10, 100, '2024-01-02'),
+        ('p1', 'a', 'SELL', 5, 80, '2024-01-03'),
+        ('p1', 'a', 'BUY', 5, 100, '2024-01-04'),
+        ('p1', 'a', 'SELL', 6, 120, '2024-01-05'),
+        ('p1', 'a', 'BUY', 2, 40, '2024-01-06'),
+    ])
+    quantity, avg_cost = holdings.current()
+    assert quantity[0] == 6
+    assert np.allclose(holdings.avg_cost, [10, 10, 15, 15, (4 * 15 + 40) / 6])
+
+def _api_avg_cost(rows) -> list:
+    """updatePosition of the API's transactions.service, after every transaction"""
+    result, total_quantity, total_cost = [], 0.0, 0.0
+    for _, _, side, quantity, total_eur, _ in rows:
+        if side == 'BUY':
+            total_quantity += quantity
+            total_cost += total_eur
+        else:
+            total_quantity -= quantity
+            total_cost -= total_cost / (total_quantity + quantity) * quantity
+        if total_quantity > 1e-9:
+            result.append(total_cost / total_quantity)
+        else:
+            total_quantity, total_cost = 0.0, 0.0
+            result.append(result[-1] if result else 0.0)
+    return result
+
+def test_average_cost_matches_api_on_random_trades():
+    rng = np.random.default_rng(0)
+    rows, held = [], 0
+    for n in range(200):
+        if held and rng.random() < 0.4:
+            quantity = held if rng.random() < 0.2 else int(rng.integers(1, held + 1))
+            side, held = 'SELL', held - quantity
+        else:
+            quantity = int(rng.integers(1, 20))
+            side, held = 'BUY', held + quantity
+        rows.append(('p1', 'a', side, quantity, float(quantity * rng.uniform(50, 150)),
+                     str(np.datetime64('2020-01-01') + n)))
+    assert np.allclose(_holdings(rows).avg_cost, _api_avg_cost(rows))
@@ -0,0 +1,16 @@
+import multiprocessing
+from supervisor import WorkerStop
+
+def test_worker_stop_is_local():
+    shared = multiprocessing.get_context("spawn").Event()
+    first, second = WorkerStop(shared), WorkerStop(shared)
+    first.set()
+    assert first.is_set()
+    assert not second.is_set()
+    assert not shared.is_set()
+
+def test_supervisor_stop_reaches_every_worker():
+    shared = multiprocessing.get_context("spawn").Event()
+    workers = [WorkerStop(shared) for _ in range(3)]
+    shared.set()
+    assert all(stop.is_set() for stop in workers)
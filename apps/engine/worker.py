@@ -1,89 +1,205 @@
 import redis
 import json
+import sys
+import threading
 import time
 from datetime import datetime
 from sqlalchemy import text
 from config import settings
-from database import SessionLocal
-from scoring_engine import run_scoring
-from pac_engine import run_pac
+from database import SessionLocal, pool_stats
+from progress import RunProgress
+from metrics import increment, observe, span, trace_run
+from job_queue import ACTIVE_KEY, WAIT_KEY, JobLease, job_hash_key, reap_stalled_jobs
+from redis_client import get_redis, redis_pool_stats
 import traceback
 
-def start_worker():
-    """Start the BullMQ worker to process jobs"""
-    r = redis.Redis(
-        host=settings.redis_host,
-        port=settings.redis_port,
-        db=settings.redis_db,
-        decode_responses=True
-    )
+# The analytics stack (pandas, numpy, market data providers) behind the job
+# types: imported by the first job, or in the background with ENGINE_PREWARM,
+# so the worker starts polling and the API answers without waiting for it
+ENGINE_MODULES = ("scoring_engine", "pac_engine", "snapshots")
+_engines_lock = threading.Lock()
 
-    print("🚀 Worker started, listening for jobs...")
+RUN_STARTED_SQL = text("UPDATE engine_run SET type = 'running', \"startedAt\" = :now WHERE \"runId\" = :run_id")
+RUN_COMPLETED_SQL = text("""
+    UPDATE engine_run
+    SET type = 'completed', "completedAt" = :now, "durationMs" = :duration_ms,
+        result = CAST(:result AS jsonb)
+    WHERE "runId" = :run_id
+""")
+RUN_FAILED_SQL = text("""
+    UPDATE engine_run
+    SET type = 'failed', error = :error, "completedAt" = :now, "durationMs" = :duration_ms,
+        result = CAST(:result AS jsonb)
+    WHERE "runId" = :run_id
+""")
 
-    while True:
+def process_job(r, job_key: str):
+    """Run one job taken from the active list"""
+    print(f"📦 Processing job: {job_key}")
+
+    # Get job data - BullMQ stores jobs as hash with the full key
+    job_full_key = job_hash_key(job_key)
+    job_data = r.hgetall(job_full_key)
+    data = json.loads(job_data.get("data", "{}"))
+
+    run_id = data.get("runId")
+    user_id = data.get("userId")
+    job_type = data.get("type")
+
+    print(f"📊 Job details: runId={run_id}, userId={user_id}, type={job_type}")
+    if job_data.get("timestamp"):
+        # BullMQ stamps jobs with their creation time in ms
+        observe("aurora_job_wait_seconds", max(time.time() - int(job_data["timestamp"]) / 1000, 0), type=job_type)
+    execute_run(run_id, user_id, job_type, profile=bool(data.get("profile")))
+
+def execute_run(run_id: str, user_id: str, job_type: str, profile: bool = False):
+    """
+    Run one engine job and keep its engine_run row and progress stream up to date.
+    The run's phase timings are stored in engine_run.result; with profile=True
+    the run is also profiled (see metrics.trace_run).
+    """
+    progress = RunProgress(run_id)
+    started = time.perf_counter()
+    timings = {}
+
+    # Update run status to RUNNING
+    db = SessionLocal()
+    try:
+        db.execute(
+            RUN_STARTED_SQL,
+            {"now": datetime.utcnow(), "run_id": run_id}
+        )
+        db.commit()
+        progress.emit("running", type=job_type)
+
+        # Execute the appropriate engine
+        with trace_run(run_id, profile) as timings:
+            _run_engine(db, run_id, user_id, job_type)
+
+        # Update run status to COMPLETED
+        duration = time.perf_counter() - started
+        db.execute(
+            RUN_COMPLETED_SQL,
+            {"now": datetime.utcnow(), "duration_ms": int(duration * 1000),
+             "result": json.dumps({"timings": timings}), "run_id": run_id}
+        )
+        db.commit()
+        progress.emit("completed", durationMs=int(duration * 1000))
+        observe("aurora_job_duration_seconds", duration, type=job_type, status="completed")
+        increment("aurora_jobs_total", type=job_type, status="completed")
+        print(f"✅ Job {run_id} completed successfully in {duration:.1f}s")
+
+    except Exception as e:
+        error_msg = str(e)
+        print(f"❌ Job {run_id} failed: {error_msg}")
+        traceback.print_exc()
+
+        # Update run status to FAILED
+        duration = time.perf_counter() - started
+        db.rollback()
+        db.execute(
+            RUN_FAILED_SQL,
+            {"error": error_msg, "now": datetime.utcnow(), "duration_ms": int(duration * 1000),
+             "result": json.dumps({"timings": timings}), "run_id": run_id}
+        )
+        db.commit()
+        progress.emit("failed", error=error_msg)
+        observe("aurora_job_duration_seconds", duration, type=job_type, status="failed")
+        increment("aurora_jobs_total", type=job_type, status="failed")
+    finally:
+        db.close()
+
+def mark_run_failed(run_id: str, error: str):
+    """Mark a run failed when execute_run itself raised, so it doesn't stay running"""
+    db = SessionLocal()
+    try:
+        db.execute(
+            RUN_FAILED_SQL,
+            {"error": error, "now": datetime.utcnow(), "duration_ms": None,
+             "result": json.dumps({}), "run_id": run_id}
+        )
+        db.commit()
+        RunProgress(run_id).emit("failed", error=error)
+    except Exception as e:
+        print(f"❌ Could not mark run {run_id} failed: {e}")
+    finally:
+        db.close()
+
+def engines_loaded() -> bool:
+    return all(module in sys.modules for module in ENGINE_MODULES)
+
+def load_engines():
+    """Import the analytics stack now rather than on the first job"""
+    with _engines_lock:
+        if engines_loaded():
+            return
+        started = time.perf_counter()
+        for module in ENGINE_MODULES:
+            __import__(module)
+        print(f"🔥 Engines loaded in {time.perf_counter() - started:.1f}s")
+
+def prewarm_in_background() -> threading.Thread:
+    thread = threading.Thread(target=load_engines, name="engine-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+def _run_engine(db, run_id: str, user_id: str, job_type: str):
+    if not engines_loaded():
+        with span("engine_import"):
+            load_engines()
+    from scoring_engine import run_scoring
+    from pac_engine import run_pac, run_pac_batch, run_pac_drift_batch
+    from snapshots import run_snapshots
+
+    if job_type == "scoring":
+        run_scoring(db, run_id, user_id)
+    elif job_type == "pac":
+        run_pac(db, run_id, user_id)
+    elif job_type == "pac_batch":
+        run_scoring(db, run_id, user_id)
+        run_pac_batch(db, run_id)
+    elif job_type == "pac_drift":
+        run_scoring(db, run_id, user_id)
+        run_pac_drift_batch(db, run_id)
+    elif job_type == "snapshot":
+        run_snapshots(db, run_id)
+    elif job_type == "snapshot_backfill":
+        run_snapshots(db, run_id, user_id, backfill=True)
+    elif job_type == "full":
+        run_scoring(db, run_id, user_id)
+        run_pac(db, run_id, user_id)
+
+def start_worker(stop_event=None, worker_id: int = None):
+    """
+    Start the BullMQ worker to process jobs
+    When stop_event is set the worker exits after finishing its current job
+    """
+    # Shares the process-wide pool with the engines' progress and cache clients
+    r = get_redis()
+
+    name = f"Worker {worker_id}" if worker_id is not None else "Worker"
+    print(f"🚀 {name} started, listening for jobs...")
+    if settings.engine_prewarm:
+        prewarm_in_background()
+
+    while not (stop_event and stop_event.is_set()):
         try:
             # Poll for jobs from BullMQ queue
             # BullMQ stores jobs in a specific format, we need to check the wait list
-            job_key = r.brpoplpush("bull:aurora-jobs:wait", "bull:aurora-jobs:active", timeout=5)
+            job_key = r.brpoplpush(WAIT_KEY, ACTIVE_KEY, timeout=5)
 
             if job_key:
-                print(f"📦 Processing job: {job_key}")
-
-                # Get job data - BullMQ stores jobs as hash with the full key
-                job_full_key = f"bull:aurora-jobs:{job_key}"
-                job_data = r.hgetall(job_full_key)
-                data = json.loads(job_data.get("data", "{}"))
-
-                run_id = data.get("runId")
-                user_id = data.get("userId")
-                job_type = data.get("type")
-
-                print(f"📊 Job details: runId={run_id}, userId={user_id}, type={job_type}")
-
-                # Update run status to RUNNING
-                db = SessionLocal()
-                try:
-                    db.execute(
-                        text("UPDATE engine_run SET type = 'running', \"startedAt\" = :now WHERE \"runId\" = :run_id"),
-                        {"now": datetime.utcnow(), "run_id": run_id}
-                    )
-                    db.commit()
-
-                    # Execute the appropriate engine
-                    if job_type == "scoring":
-                        run_scoring(db, run_id, user_id)
-                    elif job_type == "pac":
-                        run_pac(db, run_id, user_id)
-                    elif job_type == "full":
-                        run_scoring(db, run_id, user_id)
-                        run_pac(db, run_id, user_id)
-
-                    # Update run status to COMPLETED
-                    db.execute(
-                        text("UPDATE engine_run SET type = 'completed', \"completedAt\" = :now WHERE \"runId\" = :run_id"),
-                        {"now": datetime.utcnow(), "run_id": run_id}
-                    )
-                    db.commit()
-                    print(f"✅ Job {run_id} completed successfully")
-
-                except Exception as e:
-                    error_msg = str(e)
-                    print(f"❌ Job {run_id} failed: {error_msg}")
-                    traceback.print_exc()
-
-                    # Update run status to FAILED
-                    db.execute(
-                        text("UPDATE engine_run SET type = 'failed', error = :error, \"completedAt\" = :now WHERE \"runId\" = :run_id"),
-                        {"error": error_msg, "now": datetime.utcnow(), "run_id": run_id}
-                    )
-                    db.commit()
-                finally:
-                    db.close()
+                # Hold a lease while the job runs so the reaper can recover it if we die
+                with JobLease(r, job_key):
+                    process_job(r, job_key)
 
                 # Remove job from active list
-                r.lrem("bull:aurora-jobs:active", 1, job_key)
+                r.lrem(ACTIVE_KEY, 1, job_key)
                 r.delete(job_key)
 
+            # Requeue jobs left active by workers that died
+            reap_stalled_jobs(r)
+
         except redis.exceptions.TimeoutError:
             # No jobs available, continue polling
             pass
@@ -92,5 +208,7 @@ def start_worker():
             traceback.print_exc()
             time.sleep(5)
 
+    print(f"👋 {name} stopped (db pool: {pool_stats()}, redis pool: {redis_pool_stats()})")
+
 if __name__ == "__main__":
     start_worker()
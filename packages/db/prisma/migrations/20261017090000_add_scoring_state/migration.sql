@@ -0,0 +1,22 @@
+-- CreateTable
+CREATE TABLE "scoring_state" (
+    "instrumentId" TEXT NOT NULL,
+    "lookbackDays" INTEGER NOT NULL,
+    "firstDate" DATE NOT NULL,
+    "lastDate" DATE NOT NULL,
+    "firstClose" DOUBLE PRECISION NOT NULL,
+    "lastClose" DOUBLE PRECISION NOT NULL,
+    "count" INTEGER NOT NULL,
+    "mean" DOUBLE PRECISION NOT NULL,
+    "m2" DOUBLE PRECISION NOT NULL,
+    "peak" DOUBLE PRECISION NOT NULL,
+    "peakDate" DATE NOT NULL,
+    "maxDrawdown" DOUBLE PRECISION NOT NULL,
+    "mddPeakDate" DATE,
+    "updatedAt" TIMESTAMP(3) NOT NULL,
+
+    CONSTRAINT "scoring_state_pkey" PRIMARY KEY ("instrumentId")
+);
+
+-- AddForeignKey
+ALTER TABLE "scoring_state" ADD CONSTRAINT "scoring_state_instrumentId_fkey" FOREIGN KEY ("instrumentId") REFERENCES "instrument"("id") ON DELETE CASCADE ON UPDATE CASCADE;